@@ -0,0 +1,270 @@
+"""
+Reproducible benchmarks of the hot paths: classification of combinations,
+playing from a hand, checking plays on a trick and playing whole tricks and
+rounds.
+
+Run as a script to print ops/sec and peak memory of every benchmark and
+save them as JSON. Passing a previous result file with ``--baseline``
+compares against it and exits with a non-zero status if any benchmark got
+slower than the tolerance allows::
+
+    python benchmarks.py --output new.json --baseline old.json
+"""
+import argparse
+import itertools
+import json
+import logging
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+from combination import Combination, card_objects
+from game import Round, Trick
+from player import Player, Hand, PassAction, PlayAction
+from strategies import GreedyStrategy
+
+logger = logging.getLogger('tichu.' + __name__)
+
+SEED = 1
+
+#_Workloads_____________________________________________________________________
+
+# Card indices (suit*13 + rank-2, specials 52-55) of a combination of every
+# type, with and without the phoenix (54)
+combination_indices = {
+    'single' : [0],
+    'single_phoenix' : [54],
+    'pair' : [0, 13],
+    'pair_phoenix' : [0, 54],
+    'triplet' : [0, 13, 26],
+    'triplet_phoenix' : [0, 13, 54],
+    'straight' : [0, 14, 2, 3, 4],
+    'straight_phoenix' : [0, 14, 54, 3, 4],
+    'full_house' : [0, 13, 26, 1, 14],
+    'full_house_phoenix' : [0, 13, 54, 1, 14],
+    'straight_of_pairs' : [0, 13, 1, 14, 2, 15],
+    'straight_of_pairs_phoenix' : [0, 13, 1, 54, 2, 15],
+    'bomb' : [0, 13, 26, 39],
+    'straight_bomb' : [0, 1, 2, 3, 4],
+}
+
+def bench_combination(name) :
+    cards_by_index = card_objects()
+    cards = [cards_by_index[i] for i in combination_indices[name]]
+    def run() :
+        Combination(cards)
+    return run
+
+def bench_hand_play() :
+    """ Play a legal combination out of a number of random hands. """
+    cards_by_index = card_objects()
+    rng = random.Random(SEED)
+    cases = []
+    for i in range(100) :
+        hand = Hand(rng.sample(cards_by_index, 14))
+        play = rng.choice(list(hand.legal_plays()))
+        indices = [hand.cards.index(card) for card in play]
+        cases.append((hand, indices))
+    cases = itertools.cycle(cases)
+    def run() :
+        hand, indices = next(cases)
+        hand.play(indices)
+    return run
+
+def _single_chain() :
+    """ Increasing singles from 2 to ace, topped with the dragon. """
+    cards_by_index = card_objects()
+    return [PlayAction(Combination([cards_by_index[i]]))
+            for i in list(range(13)) + [55]]
+
+def _pair_chain() :
+    """ Increasing pairs from 3 to ace, topped with a bomb of twos. """
+    cards_by_index = card_objects()
+    chain = [PlayAction(Combination([cards_by_index[i], cards_by_index[i+13]]))
+             for i in range(1, 13)]
+    bomb = [cards_by_index[i] for i in (0, 13, 26, 39)]
+    return chain + [PlayAction(Combination(bomb))]
+
+def bench_trick_chain(chain) :
+    """ Play a chain of increasing combinations onto a fresh trick. The 
+    player is dealt the cards of the chain anew for every run.
+    """
+    player = Player('Benchmark')
+    cards = [card for action in chain for card in action.combination]
+    top = chain[-1].combination
+    def run() :
+        player.hand = Hand(cards)
+        trick = Trick([player])
+        for action in chain :
+            trick.handle_action(action, player)
+        assert trick.top is top, 'The chain was not played out.'
+    return run
+
+class ScriptedChannel() :
+    """ Stand-in for :class: `ActionChannel <tichu.player.ActionChannel>`
+    that hands out a fixed sequence of actions.
+    """
+    def __init__(self, script) :
+        self.script = script
+        self.is_open = False
+
+    def open(self) :
+        self.is_open = True
+
+    def close(self) :
+        self.is_open = False
+
+    def submit(self, action) :
+        self.script.append(action)
+
+    def receive(self, timeout=None) :
+        if not self.script :
+            raise RuntimeError('The script ran out of actions.')
+        return self.script.pop(0)
+
+def bench_trickloop() :
+    """ A full trick through :meth: `Trick._trickloop` with four scripted
+    players: singles are played until everyone passes on the dragon.
+    """
+    cards_by_index = card_objects()
+    singles = [Combination([cards_by_index[i]]) 
+               for i in (1, 16, 30, 45, 11, 55)]
+    def scripts() :
+        return [[PlayAction(singles[0]), PlayAction(singles[4]), PassAction()],
+                [PlayAction(singles[1]), PassAction(), PassAction()],
+                [PlayAction(singles[2]), PassAction(), PassAction()],
+                [PlayAction(singles[3]), PlayAction(singles[5])]]
+    # Every player keeps one more card, so nobody runs out
+    hands = [[0, 1, 11], [2, 16], [3, 30], [4, 45, 55]]
+    players = [Player('Player {}'.format(i)) for i in range(4)]
+    def run() :
+        for player, script, hand in zip(players, scripts(), hands) :
+            player.actions = ScriptedChannel(script)
+            player.hand = Hand([cards_by_index[i] for i in hand])
+        trick = Trick(list(players))
+        trick._trickloop()
+        trick.resolve()
+    return run
+
+def bench_round() :
+    """ Complete headless rounds with greedy strategies. """
+    rng = random.Random(SEED)
+    players = [Player('Player {}'.format(i)) for i in range(4)]
+    strategies = [GreedyStrategy()] * 4
+    def run() :
+        Round(players, strategies, rng=rng).play()
+    return run
+
+# name -> (factory of the function to benchmark, number of calls)
+benchmarks = dict(
+    [('combination.' + name, (lambda name=name : bench_combination(name),
+                              20000))
+     for name in combination_indices] +
+    [('hand.play', (bench_hand_play, 20000)),
+     ('trick.single_chain', (lambda : bench_trick_chain(_single_chain()),
+                             2000)),
+     ('trick.pair_chain', (lambda : bench_trick_chain(_pair_chain()), 2000)),
+     ('trick.trickloop', (bench_trickloop, 2000)),
+     ('round.greedy', (bench_round, 20))])
+
+#_Measurement___________________________________________________________________
+
+def measure(factory, number, repeat=3) :
+    """ Time *number* calls of the function created by *factory* and
+    measure the peak memory allocated meanwhile. Timing takes the best of
+    *repeat* runs and is done without memory tracing.
+    """
+    best = float('inf')
+    for i in range(repeat) :
+        run = factory()
+        start = time.perf_counter()
+        for j in range(number) :
+            run()
+        best = min(best, time.perf_counter() - start)
+
+    run = factory()
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    baseline, _ = tracemalloc.get_traced_memory()
+    for j in range(number) :
+        run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return dict(ops_per_sec=number / best, seconds=best, number=number,
+                peak_memory=peak - baseline)
+
+def run_benchmarks(names=None, scale=1., repeat=3) :
+    """ Run the benchmarks given by *names* (default: all) and return the
+    results as a dict.
+    """
+    if names is None :
+        names = list(benchmarks)
+    # The per-move log records are not what we want to measure here
+    tichu_logger = logging.getLogger('tichu')
+    handlers = tichu_logger.handlers[:]
+    tichu_logger.handlers = [logging.NullHandler()]
+    try :
+        results = {}
+        for name in names :
+            factory, number = benchmarks[name]
+            number = max(1, int(number * scale))
+            results[name] = measure(factory, number, repeat)
+            print('{:40s} {:>14,.0f} ops/s {:>12,d} B peak'.format(
+                name, results[name]['ops_per_sec'],
+                results[name]['peak_memory']))
+    finally :
+        tichu_logger.handlers = handlers
+    return dict(meta=dict(python=platform.python_version(),
+                          machine=platform.machine(),
+                          time=time.strftime('%Y-%m-%d %H:%M:%S'),
+                          seed=SEED, scale=scale),
+                results=results)
+
+def compare(results, baseline, tolerance=0.1) :
+    """ Print the change of every benchmark with respect to *baseline*.
+    Return the names of benchmarks that are more than *tolerance* slower.
+    """
+    regressions = []
+    for name, result in results['results'].items() :
+        try :
+            old = baseline['results'][name]['ops_per_sec']
+        except KeyError :
+            continue
+        ratio = result['ops_per_sec'] / old
+        flag = ''
+        if ratio < 1 - tolerance :
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print('{:40s} {:>8.2f}x{}'.format(name, ratio, flag))
+    return regressions
+
+def main(argv=None) :
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('-o', '--output', help='Save results to this JSON file.')
+    parser.add_argument('-b', '--baseline',
+                        help='Compare to results in this JSON file.')
+    parser.add_argument('-t', '--tolerance', type=float, default=0.1,
+                        help='Allowed relative slowdown (default 0.1).')
+    parser.add_argument('-s', '--scale', type=float, default=1.,
+                        help='Scale the number of calls per benchmark.')
+    parser.add_argument('-r', '--repeat', type=int, default=3)
+    parser.add_argument('names', nargs='*',
+                        help='Benchmarks to run (default: all).')
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.names or None, args.scale, args.repeat)
+    if args.output :
+        with open(args.output, 'w') as f :
+            json.dump(results, f, indent=2)
+    if args.baseline :
+        with open(args.baseline) as f :
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance) :
+            return 1
+    return 0
+
+if __name__ == '__main__' :
+    sys.exit(main())
+
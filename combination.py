@@ -14,258 +14,499 @@ several cards. These are:
 These combinations are implemeneted in this submodule.
 """
 import logging
+from collections import OrderedDict
+from operator import itemgetter
 
-from kustom.cards.deck import Card, tichu_deck
+from core import DOG, MAHJONGG, PHOENIX, DRAGON, N_CARDS, Dog_bit, \
+                 Mahjongg_bit, Phoenix_bit, Dragon_bit, suit_masks, \
+                 rank_by_index, bit_by_index, histogram_by_index
 
 logger = logging.getLogger('tichu.' + __name__)
 
-# Define some special cards for comparisons
-Dog = Card(rank=0, suit='Special', name='Dog', shortname='Dog')
-Mahjongg = Card(rank=1, suit='Special', name='Mahjongg')
-Phoenix = Card(rank=14.5, suit='Special', name='Phoenix')
-Dragon = Card(rank=15, suit='Special', name='Dragon', shortname='Dragon')
+#_Card_encoding_________________________________________________________________
+
+# Every card of the 56 card game gets a fixed index: the 52 regular cards keep 
+# their position in *tichu_deck*, the special cards are appended behind them. 
+# The indices, ranks and bits of the cards are defined in :mod: `tichu.core`.
+
+# The card objects are created on first use (see :func: `_load_cards`), such 
+# that modules working on card masks do not need the kustom package. Until 
+# then, the following names are looked up by the module's *__getattr__*.
+_card_names = ('Card', 'tichu_deck', 'Dog', 'Mahjongg', 'Phoenix', 'Dragon', 
+               'cards_by_index')
+
+# Lookup from (suit, rank) to card index. Cards are looked up by value rather 
+# than by identity, such that equal copies of a card encode identically.
+_card_index = {}
+
+# Fast path for the card objects of *cards_by_index*: lookup by identity. 
+# These objects are kept alive by *cards_by_index*, so their ids cannot be 
+# reused.
+_card_index_by_id = {}
+
+def _load_cards() :
+    """ Create the card objects and fill the card index lookups. """
+    from kustom.cards.deck import Card, tichu_deck
+    # Define some special cards for comparisons
+    Dog = Card(rank=0, suit='Special', name='Dog', shortname='Dog')
+    Mahjongg = Card(rank=1, suit='Special', name='Mahjongg')
+    Phoenix = Card(rank=14.5, suit='Special', name='Phoenix')
+    Dragon = Card(rank=15, suit='Special', name='Dragon', shortname='Dragon')
+    # The inverse lookup: the card object belonging to each index
+    cards_by_index = tuple(tichu_deck[:52]) + (Dog, Mahjongg, Phoenix, Dragon)
+    for i, card in enumerate(cards_by_index) :
+        _card_index[(card.suit, card.rank)] = i
+        _card_index_by_id[id(card)] = i
+    globals().update(Card=Card, tichu_deck=tichu_deck, Dog=Dog, 
+                     Mahjongg=Mahjongg, Phoenix=Phoenix, Dragon=Dragon, 
+                     cards_by_index=cards_by_index)
+
+def card_objects() :
+    """ The tuple of the card objects by index, see *cards_by_index*. """
+    if not _card_index : _load_cards()
+    return cards_by_index
+
+def __getattr__(name) :
+    if name in _card_names :
+        _load_cards()
+        return globals()[name]
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, 
+                                                                    name))
+
+def card_index(card) :
+    """ Return the index (0-55) of *card* in the 56 card encoding. """
+    try :
+        return _card_index_by_id[id(card)]
+    except KeyError :
+        if not _card_index : _load_cards()
+        return _card_index[(card.suit, card.rank)]
+
+def encode(cards) :
+    """ Encode a collection of cards as the tuple (*mask*, *histogram*).
+
+    =========  ================================================================
+    cards      iterable of :class: `Card <cards.deck.Card>` objects.
+    mask       int; 56 bit mask with bit *i* set if card *i* is present.
+    histogram  int; 4 bits per rank (0-15) holding the number of cards of 
+               that rank. The phoenix is not counted.
+    =========  ================================================================
+    """
+    mask = 0
+    histogram = 0
+    for card in cards :
+        i = _card_index_by_id.get(id(card))
+        if i is None :
+            i = card_index(card)
+        mask |= bit_by_index[i]
+        histogram += histogram_by_index[i]
+    return mask, histogram
+
+def histogram_of(mask) :
+    """ Build the rank histogram belonging to card *mask*. """
+    histogram = 0
+    while mask :
+        low = mask & -mask
+        histogram += histogram_by_index[low.bit_length() - 1]
+        mask ^= low
+    return histogram
+
+#_Classifier____________________________________________________________________
+
+# Combo type codes. These index into *Combination.combinations*.
+SINGLE, PAIR, TRIPLET, STRAIGHT, FULL_HOUSE, STRAIGHT_OF_PAIRS, BOMB, \
+STRAIGHT_BOMB = range(8)
+
+# How much to increase the ranks of bombs
+BOMB_OFFSET = 100
+STRAIGHT_BOMB_OFFSET = 1000
+
+# Repeating bit patterns to pick out one bit of every 4 bit rank slot
+_NIBBLE_1 = 0x1111111111111111
+
+# Precomputed run tables. Keys are rank occupancy patterns (one bit per 
+# nibble) shifted down to the lowest occupied rank.
+# _runs: pattern of *n* subsequent ranks -> n
+# _gapped_runs: pattern of subsequent ranks with exactly one rank missing 
+#               in between -> number of occupied ranks
+_runs = {}
+_gapped_runs = {}
+for _n in range(1, 17) :
+    _pattern = 0
+    for _j in range(_n) :
+        _pattern |= 1 << (_j << 2)
+    _runs[_pattern] = _n
+    for _j in range(1, _n-1) :
+        _gapped_runs[_pattern & ~(1 << (_j << 2))] = _n - 1
+
+def _is_run(occupancy, with_phoenix) :
+    """ Return True if the nibble *occupancy* pattern consists of subsequent 
+    ranks, allowing for a single gap if *with_phoenix* is True.
+    """
+    pattern = occupancy >> ((occupancy & -occupancy).bit_length() - 1)
+    if pattern in _runs : return True
+    return with_phoenix and pattern in _gapped_runs
+
+def is_same_suit(mask) :
+    """ Return True if all cards in *mask* are regular cards of one suit. """
+    for suit_mask in suit_masks :
+        if not mask & ~suit_mask : return True
+    return False
+
+def classify(mask, histogram) :
+    """ Determine combo type code and rank of the cards encoded by *mask* and 
+    *histogram* (see :func: `encode`). Returns *None* if the cards do not 
+    form a valid combination.
+    """
+    n = mask.bit_count()
+    with_phoenix = mask & Phoenix_bit
+    if n == 1 :
+        if with_phoenix : return SINGLE, rank_by_index[PHOENIX]
+        return SINGLE, rank_by_index[mask.bit_length() - 1]
+
+    # Split the histogram into bit patterns holding one bit per rank for 
+    # each possible count
+    b0 = histogram & _NIBBLE_1
+    b1 = (histogram >> 1) & _NIBBLE_1
+    b2 = (histogram >> 2) & _NIBBLE_1
+    occupancy = b0 | b1 | b2
+    n_ranks = occupancy.bit_count()
+    lowest = ((occupancy & -occupancy).bit_length() - 1) >> 2
+    dog_or_dragon = mask & (Dog_bit | Dragon_bit)
+    # The special cards exist only once, they cannot be paired up with the 
+    # help of the phoenix. The Mahjongg may still be part of a straight.
+    special = mask & (Dog_bit | Mahjongg_bit | Dragon_bit)
+
+    # Pairs and triplets
+    if n_ranks == 1 :
+        if n == 2 and not special : return PAIR, lowest
+        if n == 3 : return TRIPLET, lowest
+
+    # Straights: at least 5 subsequent singles, no dogs or dragons
+    singles = b0 & ~b1 & ~b2
+    is_single_run = (n >= 5 and not dog_or_dragon and 
+                     singles == occupancy and 
+                     _is_run(occupancy, with_phoenix))
+    if is_single_run and not is_same_suit(mask) :
+        return STRAIGHT, lowest
+
+    # Full house: a triplet and a pair. With the phoenix, assume the higher 
+    # cards as the triplet, unless there already is one.
+    if n == 5 and not special and n_ranks == 2 :
+        triplets = b0 & b1 & ~b2
+        if triplets :
+            return FULL_HOUSE, (triplets.bit_length() - 1) >> 2
+        if with_phoenix :
+            return FULL_HOUSE, (occupancy.bit_length() - 1) >> 2
+
+    # Straight of pairs: every rank occurs twice, except for one rank that 
+    # the phoenix completes, and ranks are subsequent. The phoenix cannot 
+    # fill a gap, which would need two cards.
+    if n >= 4 and not n % 2 and not special :
+        pairs = b1 & ~b0 & ~b2
+        if with_phoenix :
+            counts_ok = (pairs and singles and not singles & (singles - 1) 
+                         and (pairs | singles) == occupancy)
+        else :
+            counts_ok = pairs == occupancy
+        if counts_ok and _is_run(occupancy, False) :
+            return STRAIGHT_OF_PAIRS, lowest
+
+    # Four of a kind without the help of the phoenix
+    if n == 4 and n_ranks == 1 and not with_phoenix :
+        return BOMB, BOMB_OFFSET + lowest
+
+    # Straight of one suit. Its rank is increased to make it beat other 
+    # bombs and shorter straight bombs.
+    if is_single_run :
+        return STRAIGHT_BOMB, lowest + n * STRAIGHT_BOMB_OFFSET
 
-class Combination() :
+    return None
+
+#_Batch_classifier______________________________________________________________
+
+# Suit code of the special cards in batch encodings
+SPECIAL_SUIT = 4
+
+def batch_from_indices(indices) :
+    """ Convert a 2-D array of card indices (see :func: `card_index`), padded 
+    with -1, into the *ranks*, *suits* and *phoenix* arrays expected by 
+    :func: `classify_batch`.
     """
+    import numpy as np
+    indices = np.asarray(indices)
+    valid = indices >= 0
+    is_phoenix = indices == PHOENIX
+    phoenix = is_phoenix.any(axis=1)
+    keep = valid & ~is_phoenix
+    rank_table = np.array([int(rank) for rank in rank_by_index[:PHOENIX]] + 
+                          [0, rank_by_index[DRAGON]])
+    suit_table = np.array([i // 13 for i in range(52)] + [SPECIAL_SUIT] * 4)
+    ranks = np.where(keep, rank_table[indices], -1)
+    suits = np.where(keep, suit_table[indices], -1)
+    return ranks, suits, phoenix
+
+def classify_batch(ranks, suits, phoenix) :
+    """ Classify many card sets at once. This follows the same rules as 
+    :func: `classify`, using array operations on rank histograms.
+
+    =========  ================================================================
+    ranks      2-D int array; one row per card set holding the ranks (0-15) 
+               of all cards except the phoenix, padded with -1.
+    suits      2-D int array of the same shape; suit (0-3) of every card, 
+               *SPECIAL_SUIT* for the Dog, Mahjongg and Dragon.
+    phoenix    1-D bool array; whether each set contains the phoenix.
+    =========  ================================================================
+
+    Returns two arrays: the combo type codes (-1 for invalid sets) and the 
+    ranks (nan for invalid sets).
+    """
+    import numpy as np
+    ranks = np.asarray(ranks)
+    suits = np.asarray(suits)
+    phoenix = np.asarray(phoenix, dtype=bool)
+    n_sets = len(ranks)
+    valid = ranks >= 0
+
+    # Rank histograms through a single bincount over offset ranks
+    rows = np.broadcast_to(np.arange(n_sets)[:, None], ranks.shape)
+    counts = np.bincount((rows * 16 + ranks)[valid], 
+                         minlength=16*n_sets).reshape(n_sets, 16)
+    n = valid.sum(axis=1) + phoenix
+    occupied = counts > 0
+    n_ranks = occupied.sum(axis=1)
+    lowest = occupied.argmax(axis=1)
+    highest = 15 - occupied[:, ::-1].argmax(axis=1)
+    dog_or_dragon = occupied[:, 0] | occupied[:, 15]
+    special = dog_or_dragon | occupied[:, 1]
+
+    # Runs: subsequent ranks, or a single gap with the phoenix
+    span = highest - lowest + 1
+    is_run = (span == n_ranks) | (phoenix & (span == n_ranks + 1))
+    n_singles = (counts == 1).sum(axis=1)
+    n_pairs = (counts == 2).sum(axis=1)
+    n_triplets = (counts == 3).sum(axis=1)
+    triplet_rank = (counts == 3).argmax(axis=1)
+
+    # All cards regular and of one suit
+    suit_max = np.where(valid, suits, -1).max(axis=1)
+    suit_min = np.where(valid, suits, SPECIAL_SUIT + 1).min(axis=1)
+    same_suit = (suit_min == suit_max) & (suit_max < SPECIAL_SUIT) & ~phoenix
+
+    single_run = (n >= 5) & ~dog_or_dragon & (n_singles == n_ranks) & is_run
+    full_house = (n == 5) & ~special & (n_ranks == 2)
+    pair_counts_ok = np.where(phoenix, 
+                              (n_pairs > 0) & (n_singles == 1) & 
+                              (n_pairs + 1 == n_ranks),
+                              n_pairs == n_ranks)
+    straight_of_pairs = ((n >= 4) & (n % 2 == 0) & ~special & pair_counts_ok & 
+                         (span == n_ranks))
+
+    # The conditions in the order of :func: `classify`; the first match wins
+    conditions = [
+        n == 1,
+        (n_ranks == 1) & (n == 2) & ~special,
+        (n_ranks == 1) & (n == 3),
+        single_run & ~same_suit,
+        full_house & (n_triplets > 0),
+        full_house & phoenix,
+        straight_of_pairs,
+        (n == 4) & (n_ranks == 1) & ~phoenix,
+        single_run,
+    ]
+    codes = np.select(conditions, [SINGLE, PAIR, TRIPLET, STRAIGHT, 
+                                   FULL_HOUSE, FULL_HOUSE, STRAIGHT_OF_PAIRS,
+                                   BOMB, STRAIGHT_BOMB], -1)
+    rank = np.select(conditions, 
+                     [np.where(phoenix, rank_by_index[PHOENIX], lowest), 
+                      lowest, lowest, lowest, triplet_rank, highest, lowest,
+                      BOMB_OFFSET + lowest, 
+                      lowest + n * STRAIGHT_BOMB_OFFSET], np.nan)
+    return codes, rank
+
+#_Classification_cache__________________________________________________________
+
+class ClassificationCache() :
+    """ Bounded LRU memoization of :func: `classify`. The result of a 
+    classification only depends on the rank histogram, the presence of the 
+    phoenix and whether all cards are of one suit, so these make up the key.
+
+    ========  ==================================================================
+    maxsize   int; maximum number of stored results. 0 disables the cache.
+    hits      int; number of lookups answered from the cache.
+    misses    int; number of lookups that had to be classified.
+    ========  ==================================================================
+    """
+    def __init__(self, maxsize=4096) :
+        self.maxsize = maxsize
+        self._results = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def classify(self, mask, histogram) :
+        """ Same as :func: `classify`, but look the result up first. """
+        if not self.maxsize :
+            return classify(mask, histogram)
+        key = (histogram, mask & Phoenix_bit, is_same_suit(mask))
+        try :
+            result = self._results[key]
+        except KeyError :
+            self.misses += 1
+            result = classify(mask, histogram)
+            self._results[key] = result
+            if len(self._results) > self.maxsize :
+                self._results.popitem(last=False)
+            return result
+        self.hits += 1
+        self._results.move_to_end(key)
+        return result
+
+    def resize(self, maxsize) :
+        """ Change the maximum size, dropping the least recently used 
+        results if necessary. A *maxsize* of 0 disables the cache.
+        """
+        self.maxsize = maxsize
+        while len(self._results) > maxsize :
+            self._results.popitem(last=False)
+
+    def clear(self) :
+        """ Drop all stored results and reset the counters. """
+        self._results.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) :
+        return len(self._results)
+
+    def __str__(self) :
+        return '<ClassificationCache {}/{}: {} hits, {} misses>'.format(
+            len(self), self.maxsize, self.hits, self.misses)
+
+    def __repr__(self) :
+        return self.__str__()
+
+# The cache used by all Combinations
+classification_cache = ClassificationCache()
+
+#_Combination___________________________________________________________________
+
+# Combo type names by type code and number of cards, such that they don't 
+# have to be formatted for every combination
+_combo_type_names = tuple(
+    tuple('{}-{}'.format(n, name) if 'straight' in name else name 
+          for n in range(57))
+    for name in ['single', 'pair', 'triplet', 'straight', 'full_house', 
+                 'straight_of_pairs', 'bomb', 'straight_bomb'])
+
+class Combination(tuple) :
+    """ An immutable, hashable combination of cards, stored as a tuple. Two 
+    combinations are equal if they consist of the same cards. Comparisons 
+    with ``<``, ``>`` etc. compare the strength (*rank*) of the combinations.
+
     ============  ==============================================================
+    cards         tuple of :class: `Card <cards.deck.Card>` objects.
+    N             int; the number of cards.
     combo_type    str; one of ['single', 'pair', 'triplet', 'straight', 
                   'full_house', 'straight_of_pairs', 'bomb', 'straight_bomb'];
                   the type of this combination.
+    type_code     int; index of the combo type in *combinations*.
+    rank          float; the strength of this combination.
     with_phoenix  boolean; *True* if the phoenix appears in this combination.
+    mask          int; bitmask encoding of the cards (see :func: `encode`).
+    histogram     int; rank histogram of the cards (see :func: `encode`).
     ============  ==============================================================
     """
+    __slots__ = ()
 
-    # The names of the possible combinations here must match the respective 
-    # methods `is_xxx`!
+    # The names of the possible combinations, ordered by their type codes
     combinations = ['single', 'pair', 'triplet', 'straight', 'full_house', 
                     'straight_of_pairs', 'bomb', 'straight_bomb']
 
-    with_phoenix = False
-
     # How much to increase the ranks of bombs
-    bomb_offset = 100
-    straight_bomb_offset = 1000
+    bomb_offset = BOMB_OFFSET
+    straight_bomb_offset = STRAIGHT_BOMB_OFFSET
 
-    def __init__(self, cards) :
+    def __new__(cls, cards) :
         """ 
         =====  =================================================================
         cards  list of :class: `Card <cards.deck.Card>` objects.
         =====  =================================================================
         """
-        self.cards = cards
-        # The number of cards is frequently used in determining the combo 
-        # type, so a shorthand is useful
-        self.N = len(self.cards)
-        # Same argument for the list of ranks
-        self.ranks = [card.rank for card in self.cards]
-        if Phoenix in self :
-            self.ranks.remove(Phoenix.rank)
-            self.with_phoenix = True
-
-        self.determine_combination()
+        cards = tuple(cards)
+        mask, histogram = encode(cards)
+        result = classification_cache.classify(mask, histogram)
+        if result is None or len(cards) != mask.bit_count() :
+            raise ValueError('Could not determine valid combination: ' + 
+                             ', '.join(str(card) for card in cards))
+        return tuple.__new__(cls, (cards, len(cards), mask, histogram, 
+                                   result[0], result[1]))
+
+    cards = property(itemgetter(0))
+    # The number of cards is frequently used, so a shorthand is useful
+    N = property(itemgetter(1))
+    mask = property(itemgetter(2))
+    histogram = property(itemgetter(3))
+    type_code = property(itemgetter(4))
+    rank = property(itemgetter(5))
+
+    @property
+    def combo_type(self) :
+        return _combo_type_names[self[4]][self[1]]
+
+    @property
+    def with_phoenix(self) :
+        return bool(self[2] & Phoenix_bit)
+
+    @property
+    def ranks(self) :
+        """ List of the ranks of all cards except the phoenix. """
+        return [card.rank for card in self[0] if card_index(card) != PHOENIX]
 
     def __iter__(self) :
         """ Iterate over the cards in this combo. """
-        return (card for card in self.cards)
-
-    def __str__(self) :
-        res = '<Combination {}: '.format(self.combo_type)
-        for card in self.cards :
-            res += '{}, '.format(card)
-        # Strip last comma and close '>'
-        res = res[:-2]
-        res += '>'
-        return res
-
-    def __repr__(self) :
-        return self.__str__()
-
-    def determine_combination(self) :
-        """ Go through all possible combinations and verify whether these 
-        cards fulfill the requirements for one them.
-        """
-        # Call all functions that go by the name `is_xxx` where `xxx` is a 
-        # name of a possible combination
-        combo_determined = False
-        for combination in self.combinations :
-            fcn_name = 'is_{}'.format(combination)
-            is_this_combo = self.__getattribute__(fcn_name)()
-            # Set the combination type and rank, if a match was found
-            # (The rank is set in the `is_xxx` functions since it differs 
-            # slightly for different combinations)
-            if is_this_combo :
-                # Special case for straights
-                if 'straight' in combination :
-                    self.combo_type = '{}-{}'.format(len(self.cards), combination)
-                else :
-                    self.combo_type = combination
-                combo_determined = True
-                break
-        if not combo_determined :
-            msg = 'Could not determine valid combination: '
-            for card in self.cards :
-                msg += '{}, '.format(card)
-            raise ValueError(msg)
-
-    def is_single(self) :
-        """ All single cards are valid. """
-        if self.N == 1 :
-            self.rank = self.cards[0].rank
-            return True
-        else :
-            return False
-
-    def is_pair(self) :
-        """ Two cards of the same rank qualify as a pair. """
-        if not self.N == 2 : return False
-
-        # Dogs and Dragons may not appear in a pair (due to the phoenix they 
-        # would be playable)
-        if Dog in self or Dragon in self : return False
-
-        return self.have_equal_ranks()
-        
-    def is_triplet(self) :
-        """ Three cards of the same rank. """
-        if not self.N == 3 : return False
+        return iter(self[0])
 
-        return self.have_equal_ranks()
+    def __len__(self) :
+        return self[1]
 
-    def is_straight(self) :
-        """ 5 or more consecutive cards of non-equal suit (equal suits is a 
-        straight bomb).
-        """
-        if not self.are_subsequent_singles() : return False
-        if not self.are_same_suit() : return True
-        return False
-
-    def are_subsequent_singles(self) :
-        """ Test if *self.cards* consist of at least 5 subsequent cards, 
-        paying no mind to the suits.
-        Also set the rank if subsequency is detected.
-        """
-        if self.N < 5 : return False
-
-        # Dogs and Dragons may not appear in a straight
-        if Dog in self or Dragon in self : return False
+    def __contains__(self, card) :
+        return card in self[0]
 
-        res = self.is_subsequent_list(self.ranks)
-        if res :
-            # TODO Account for the phoenix' rank correctly
-            self.rank = min(self.ranks)
-        return res
-
-    def is_subsequent_list(self, my_list) :
-        """ Check whether *my_list* contains only subsequent values (or 
-        maximally 1 step of 2, if *with_phoenix* is True.
-        """
-        have_phoenix = self.with_phoenix
-        # Sort the ranks and verify that they are subsequent
-        ordered = sorted(my_list)
-        for i in range(len(ordered) - 1) :
-            delta = ordered[i+1] - ordered[i]
-            if delta == 1 :
-                continue
-            elif delta == 2 and have_phoenix :
-                # "Use" the phoenix
-                have_phoenix = False
-            else :
-                return False
-
-        return True
-
-    def are_same_suit(self) :
-        """ Return True if all cards in *self.cards* are of one suit. """
-        suits = [card.suit for card in self]
-        if len(set(suits)) == 1 :
-            return True
-        else :
-            return False
+    def __hash__(self) :
+        return hash(self[2])
 
-    def is_full_house(self) :
-        """ Exactly 5 cards, consisting of a triplet and a pair. """
-        if self.N != 5 : return False
+    def __eq__(self, other) :
+        if not isinstance(other, Combination) : return NotImplemented
+        return self[2] == other[2]
 
-        # Dogs and Dragons may not appear in a full_house
-        if Dog in self or Dragon in self : return False
+    def __ne__(self, other) :
+        if not isinstance(other, Combination) : return NotImplemented
+        return self[2] != other[2]
 
-        # Ensure that there are only 2 different ranks
-        rank_set = set(self.ranks)
-        if not len(rank_set) == 2 : return False
+    def __lt__(self, other) :
+        return self[5] < other[5]
 
-        # Determine which rank corresponds to the triplet
-        for rank in rank_set :
-            if self.ranks.count(rank) == 3 :
-                self.rank = rank
-                return True
+    def __le__(self, other) :
+        return self[5] <= other[5]
 
-        # With the phoenix, assume the higher cards as the triplet
-        # TODO In rare cases it might make strategic sense to use the lower 
-        # rank as the triplet -> user interaction
-        if self.with_phoenix :
-            self.rank = max(self.ranks)
-            return True
+    def __gt__(self, other) :
+        return self[5] > other[5]
 
+    def __ge__(self, other) :
+        return self[5] >= other[5]
 
-    def is_straight_of_pairs(self) :
-        """ At least 4 cards, where every rank has to occur exactly twice AND 
-        has to be subsequent to another rank.
-        """ 
-        # Need at least 4 cards and it has to be an even number
-        if self.N < 4 or self.N%2 : return False
+    def __reduce__(self) :
+        return (Combination, (self[0],))
 
-        rank_set = set(self.ranks)
+    def __str__(self) :
+        return '<Combination {}: {}>'.format(
+            self.combo_type, ', '.join(str(card) for card in self[0]))
 
-        # Verify that each rank appears twice, unless the phoenix is present, 
-        # in which case one element may occur once
-        counts = set([self.ranks.count(rank) for rank in rank_set])
-        if self.with_phoenix :
-            if not counts == set([1, 2]) : return False
-        else :
-            if not counts == set([2]) : return False
-
-        # Check if the cards are subsequent
-        res = self.is_subsequent_list(list(rank_set))
-        if res :
-            self.rank = min(rank_set)
-        return res
-
-    def is_bomb(self) :
-        """ Four of a kind without the help of the phoenix"""
-        if not self.N == 4 : return False
-
-        # No phoenix
-        if Phoenix in self : return False
-
-        # Are all 4 cards of the same kind?
-        if not self.have_equal_ranks() : return False
-
-        # By this point we know that we have a bomb. Add an offset to the 
-        # rank to make the bomb beat all regular combinations.
-        self.rank = self.bomb_offset + self.ranks[0]
-        return True
-
-    def have_equal_ranks(self) :
-        """ Returns True if all *self.cards* have the same rank. """
-        # If all ranks are equal, the resulting set will have len(1)
-        if len(set(self.ranks)) == 1 :
-            self.rank = self.ranks[0]
-            return True
-        else :
-            return False
-
-    def is_straight_bomb(self) :
-        """ Min. 5 subsequent cards of the same suit. """
-        if not self.are_subsequent_singles() : return False
-        if not self.are_same_suit() : return False
-        # By now we know we have a straight bomb with the rank of a straight 
-        # of that length. Increase its rank to make it beat other bombs and 
-        # shorter straight bombs.
-        self.rank += len(self.cards) * self.straight_bomb_offset
-        return True
+    def __repr__(self) :
+        return self.__str__()
 
 # Testing
 if __name__ == '__main__' :
+    _load_cards()
     td = tichu_deck
     # Create some combinations
     full_house = [td[0], td[13], td[24], td[11], Phoenix]
@@ -0,0 +1,96 @@
+"""
+Card constants and logging setup, free of import time side effects.
+
+This module only defines plain integers and tuples, so it can be imported
+by every worker process at no cost. Cards are referred to by their index
+(0-55) in the 56 card encoding (see :func: `combination.encode
+<tichu.combination.encode>`): the 52 regular cards are ordered by suit and
+rank, the special cards come last.
+
+==========  ====================================================================
+DECK        tuple of all 56 card indices.
+DOG         index of the Dog (52), likewise *MAHJONGG*, *PHOENIX* and
+            *DRAGON*.
+<name>_bit  the bit of a card in card masks, e.g. *Phoenix_bit*.
+suit_masks  masks of the 13 regular cards of every suit.
+==========  ====================================================================
+
+The card objects (:class: `Card <cards.deck.Card>` of the kustom package)
+are only needed to present cards and are created on first use by :mod:
+`tichu.combination`.
+
+Importing the tichu modules configures no logging. Scripts call :func:
+`configure_logging` to print the log, including the messages of level
+*GAME_LEVEL* that describe the course of a game.
+
+Without cached bytecode, compiling the modules dominates the start-up of a
+worker process (about 25 ms against 2 to 5 ms for the modules up to :mod:
+`tichu.simulation`). Where bytecode is not written on import, e.g. with
+*PYTHONDONTWRITEBYTECODE* set, run ``python -m compileall`` on the package
+once.
+"""
+
+#_Cards_________________________________________________________________________
+
+DOG, MAHJONGG, PHOENIX, DRAGON = 52, 53, 54, 55
+N_CARDS = 56
+DECK = tuple(range(N_CARDS))
+
+Dog_bit = 1 << DOG
+Mahjongg_bit = 1 << MAHJONGG
+Phoenix_bit = 1 << PHOENIX
+Dragon_bit = 1 << DRAGON
+
+# Bitmasks of the 13 regular cards of each suit
+suit_masks = tuple(0x1fff << (13*i) for i in range(4))
+
+# Rank of each card index: 2 to 14 (Ace) in every suit, then the specials
+rank_by_index = tuple(i % 13 + 2 for i in range(52)) + (0, 1, 14.5, 15)
+
+# Points of each card: fives count 5, tens and kings 10
+points_by_index = tuple({5: 5, 10: 10, 13: 10}.get(rank, 0)
+                        for rank in rank_by_index[:52]) + (0, 0, -25, 25)
+
+# (points, mask of the cards worth them) for every nonzero point value
+_points_masks = tuple((points, sum(1 << i for i, p in enumerate(points_by_index)
+                                   if p == points))
+                      for points in sorted(set(points_by_index)) if points)
+
+def mask_points(mask) :
+    """ The sum of the points of the cards in *mask*. """
+    total = 0
+    for points, cards in _points_masks :
+        total += points * (mask & cards).bit_count()
+    return total
+
+# Contribution of each card index to the mask and the histogram. The phoenix
+# does not get a histogram slot, as it is treated as a wildcard by the
+# classifier.
+bit_by_index = tuple(1 << i for i in range(N_CARDS))
+histogram_by_index = tuple(0 if i == PHOENIX else 1 << (rank << 2)
+                            for i, rank in enumerate(rank_by_index))
+
+#_Logging_______________________________________________________________________
+
+# A log level between INFO and WARNING for the course of a game
+GAME_LEVEL = 25
+
+_handler = None
+
+def configure_logging(level=10) :
+    """ Print the messages of the tichu loggers from *level* on (default
+    DEBUG) to the console and name the level *GAME_LEVEL* 'GAME'. Return the
+    'tichu' logger.
+    """
+    global _handler
+    import logging
+    logging.addLevelName(GAME_LEVEL, 'GAME')
+    logger = logging.getLogger('tichu')
+    logger.setLevel(level)
+    if _handler is None :
+        _handler = logging.StreamHandler()
+        _handler.setFormatter(logging.Formatter(
+            '[%(levelname)s][%(name)s] %(message)s'))
+        logger.addHandler(_handler)
+    logger.propagate = False
+    return logger
@@ -0,0 +1,314 @@
+"""
+Export the decisions of self-play games as a dataset of NumPy shards.
+
+Games are played headlessly, as in :mod: `tichu.simulation`, and every time
+a player is asked to play, a record of the decision is written:
+
+============  ==================================================================
+field         content
+============  ==================================================================
+game          game number.
+round         round number within the game.
+seat          seat of the deciding player.
+hand          mask of the player's cards (see :func: `combination.encode
+              <tichu.combination.encode>`).
+unseen        mask of the cards held by the other players.
+top           mask of the combination to beat, 0 when leading.
+top_type      index of its combo type in :attr: `Combination.combinations
+              <tichu.combination.Combination.combinations>`, -1 when leading.
+top_rank      the rank to beat (see :class: `Trick <tichu.game.Trick>`), NaN
+              when leading.
+moves_start   offset of the legal moves in the moves array of the shard.
+n_moves       number of legal moves.
+action        index of the chosen move among the legal moves.
+============  ==================================================================
+
+The legal moves are card masks, 0 standing for a pass, stored one after the
+other in a flat ``uint64`` array per shard. A shard is a pair of ``.npy``
+files, ``<name>.records.npy`` and ``<name>.moves.npy``, holding at most
+*shard_size* records, so writers never keep more than one shard in memory.
+
+Games are split into blocks of *games_per_task* that are played on a pool of
+worker processes. Block *k* writes the shards ``k-0``, ``k-1``, ..., and
+game *i* is dealt from :func: `game_seed(seed, i)
+<tichu.simulation.game_seed>`, so the files are the same for any number of
+processes. :class: `Dataset` maps the shards into memory for training::
+
+    export('data', [GreedyStrategy()] * 4, n_games=1000)
+    for records, moves in Dataset('data').batches(4096) :
+        ...
+"""
+import argparse
+import glob
+import logging
+import multiprocessing
+import os
+import sys
+
+import numpy as np
+
+from combination import Combination
+from core import configure_logging
+from dealing import DealStream
+from game import Game
+from simulation import game_seed
+from strategies import Strategy
+import strategies
+
+logger = logging.getLogger('tichu.' + __name__)
+
+RECORD = np.dtype([('game', '<u4'), ('round', '<u2'), ('seat', 'u1'),
+                   ('top_type', 'i1'), ('hand', '<u8'), ('unseen', '<u8'),
+                   ('top', '<u8'), ('top_rank', '<f4'), ('moves_start', '<u4'),
+                   ('n_moves', '<u2'), ('action', '<i2')])
+
+RECORDS_SUFFIX = '.records.npy'
+MOVES_SUFFIX = '.moves.npy'
+
+_type_codes = dict((combo_type, code) for code, combo_type
+                   in enumerate(Combination.combinations))
+
+def _type_code(combo_type) :
+    # Straights are named with their length, e.g. '5-straight'
+    return _type_codes[combo_type.split('-')[-1]]
+
+#_Writing_______________________________________________________________________
+
+class ShardWriter() :
+    """ Collect records and write them to shards of at most *shard_size*
+    records named *prefix*-0, *prefix*-1, ... in *directory*.
+    """
+    def __init__(self, directory, prefix, shard_size=65536) :
+        self.directory = directory
+        self.prefix = prefix
+        self.shard_size = shard_size
+        self.records = np.zeros(shard_size, dtype=RECORD)
+        self.moves = []
+        self.n = 0
+        self.n_shards = 0
+        self.n_records = 0
+
+    def add(self, game, round_number, seat, hand, unseen, top, top_type,
+            top_rank, moves, action) :
+        """ Add one decision; *moves* is the list of legal moves (masks) and
+        *action* the index of the chosen one.
+        """
+        record = self.records[self.n]
+        record['game'] = game
+        record['round'] = round_number
+        record['seat'] = seat
+        record['hand'] = hand
+        record['unseen'] = unseen
+        record['top'] = top
+        record['top_type'] = top_type
+        record['top_rank'] = top_rank
+        record['moves_start'] = len(self.moves)
+        record['n_moves'] = len(moves)
+        record['action'] = action
+        self.moves.extend(moves)
+        self.n += 1
+        if self.n == self.shard_size :
+            self.flush()
+
+    def flush(self) :
+        """ Write the collected records as a new shard. """
+        if not self.n : return
+        path = os.path.join(self.directory, '{}-{}'.format(self.prefix,
+                                                           self.n_shards))
+        np.save(path + RECORDS_SUFFIX, self.records[:self.n])
+        np.save(path + MOVES_SUFFIX, np.array(self.moves, dtype='<u8'))
+        self.n_shards += 1
+        self.n_records += self.n
+        self.n = 0
+        self.moves = []
+
+class RecordingStrategy(Strategy) :
+    """ Play like *strategy* and add every play decision to the :class:
+    `ShardWriter` *writer*. *game* is the running :class: `Game
+    <tichu.game.Game>` and *game_number* its number.
+    """
+    def __init__(self, strategy, writer) :
+        self.strategy = strategy
+        self.writer = writer
+        self.game = None
+        self.game_number = 0
+
+    def play(self, round_, player, trick) :
+        seat = round_.seats[player]
+        hand = player.hand.mask
+        unseen = 0
+        for other in round_.players :
+            if other is not player :
+                unseen |= other.hand.mask
+        moves = [combination.mask
+                 for combination in trick.legal_plays(player.hand)]
+        if trick.top is None :
+            top, top_type, top_rank = 0, -1, np.nan
+        else :
+            top = trick.top.mask
+            top_type = _type_code(trick.combo_type)
+            top_rank = trick.top_rank
+            moves.insert(0, 0)
+
+        action = self.strategy.play(round_, player, trick)
+        mask = action.combination.mask if action.name == 'play' else 0
+        if mask not in moves :
+            raise ValueError('Game {}, seat {}: {:#x} is not a legal '
+                             'move.'.format(self.game_number, seat, mask))
+        # Rounds are added to the game once they are over
+        self.writer.add(self.game_number, len(self.game.rounds), seat, hand,
+                        unseen, top, top_type, top_rank, moves,
+                        moves.index(mask))
+        return action
+
+    def call_grand_tichu(self, round_, player) :
+        return self.strategy.call_grand_tichu(round_, player)
+
+    def call_tichu(self, round_, player) :
+        return self.strategy.call_tichu(round_, player)
+
+    def push(self, round_, player) :
+        return self.strategy.push(round_, player)
+
+    def give_dragon(self, round_, player, opponents) :
+        return self.strategy.give_dragon(round_, player, opponents)
+
+def export_games(directory, strategies, seed, indices, prefix, shard_size,
+                 **game_kwargs) :
+    """ Play the games with the given *indices* and write their decisions
+    to shards *prefix*-0, *prefix*-1, ... in *directory*. Return the number
+    of records.
+    """
+    writer = ShardWriter(directory, prefix, shard_size)
+    recorders = [RecordingStrategy(strategy, writer)
+                 for strategy in strategies]
+    for i in indices :
+        game = Game(recorders, seed=game_seed(seed, i),
+                    deals=DealStream(game_seed(seed, i)), **game_kwargs)
+        for recorder in recorders :
+            recorder.game = game
+            recorder.game_number = i
+        game.play()
+    writer.flush()
+    return writer.n_records
+
+def _export_task(args) :
+    directory, strategies, seed, indices, prefix, shard_size, game_kwargs = args
+    return export_games(directory, strategies, seed, indices, prefix,
+                        shard_size, **game_kwargs)
+
+def export(directory, strategies, n_games, seed=0, processes=None,
+           games_per_task=50, shard_size=65536, **game_kwargs) :
+    """ Play *n_games* self-play games on a pool of worker processes and
+    write all play decisions to *directory*. Return the number of records.
+
+    ==============  ============================================================
+    directory       str; output directory, created if missing. Existing
+                    shards are overwritten.
+    strategies      list of 4 :class: `Strategy <tichu.strategies.Strategy>`
+                    objects in seat order. They have to be picklable.
+    n_games         int; number of games.
+    seed            int; base seed, see :func: `simulation.simulate
+                    <tichu.simulation.simulate>`.
+    processes       int or *None*; number of worker processes (*None*: one
+                    per core, 1: play in this process).
+    games_per_task  int; games played and written by one task. Changing it
+                    changes the split into shards, not their content.
+    shard_size      int; maximum number of records per shard.
+    game_kwargs     further arguments to :class: `Game <tichu.game.Game>`.
+    ==============  ============================================================
+    """
+    os.makedirs(directory, exist_ok=True)
+    tasks = [(directory, strategies, seed,
+              range(start, min(start + games_per_task, n_games)),
+              '{:05d}'.format(start // games_per_task), shard_size,
+              game_kwargs)
+             for start in range(0, n_games, games_per_task)]
+    if processes == 1 :
+        n = sum(map(_export_task, tasks))
+    else :
+        with multiprocessing.Pool(processes) as pool :
+            n = sum(pool.imap_unordered(_export_task, tasks))
+    logger.info('Exported %d decisions of %d games.', n, n_games)
+    return n
+
+#_Reading_______________________________________________________________________
+
+def load_shard(path) :
+    """ Map the shard *path* (without suffix) into memory. Return its records
+    and moves arrays.
+    """
+    return (np.load(path + RECORDS_SUFFIX, mmap_mode='r'),
+            np.load(path + MOVES_SUFFIX, mmap_mode='r'))
+
+def legal_moves(records, moves, i) :
+    """ The legal moves of record *i*, as a view into *moves*. """
+    start = int(records['moves_start'][i])
+    return moves[start:start + int(records['n_moves'][i])]
+
+class Dataset() :
+    """ All shards in *directory*, in the order they were written. """
+    def __init__(self, directory) :
+        self.directory = directory
+        suffix = len(RECORDS_SUFFIX)
+        paths = [path[:-suffix] for path in
+                 glob.glob(os.path.join(directory, '*' + RECORDS_SUFFIX))]
+        # Sort by task and part number
+        def order(path) :
+            task, part = os.path.basename(path).split('-')
+            return task, int(part)
+        self.paths = sorted(paths, key=order)
+        self._shards = {}
+
+    def shard(self, k) :
+        """ Records and moves of shard number *k* (memory mapped). """
+        try :
+            return self._shards[k]
+        except KeyError :
+            shard = self._shards[k] = load_shard(self.paths[k])
+            return shard
+
+    def __len__(self) :
+        return sum(len(self.shard(k)[0]) for k in range(len(self.paths)))
+
+    def __iter__(self) :
+        for k in range(len(self.paths)) :
+            yield self.shard(k)
+
+    def batches(self, batch_size) :
+        """ Iterate over (records, moves) pairs of at most *batch_size*
+        records, taken from one shard at a time. The records are views into
+        the mapped file, *moves* is the moves array of their shard.
+        """
+        for records, moves in self :
+            for start in range(0, len(records), batch_size) :
+                yield records[start:start + batch_size], moves
+
+def main(argv=None) :
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('directory', help='Output directory.')
+    parser.add_argument('strategies', nargs='+',
+                        help='Strategy classes of the strategies module, one '
+                        'for all seats or one per seat.')
+    parser.add_argument('-n', '--games', type=int, default=100,
+                        help='Number of games (default 100).')
+    parser.add_argument('-s', '--seed', type=int, default=0)
+    parser.add_argument('-p', '--processes', type=int, default=None,
+                        help='Worker processes (default: one per core).')
+    parser.add_argument('--shard-size', type=int, default=65536,
+                        help='Records per shard (default 65536).')
+    args = parser.parse_args(argv)
+    configure_logging(logging.INFO)
+
+    names = args.strategies * 4 if len(args.strategies) == 1 \
+            else args.strategies
+    if len(names) != 4 :
+        parser.error('Give one strategy or four.')
+    seats = [getattr(strategies, name)() for name in names]
+    n = export(args.directory, seats, args.games, args.seed, args.processes,
+               shard_size=args.shard_size)
+    print('{} decisions written to {}.'.format(n, args.directory))
+    return 0
+
+if __name__ == '__main__' :
+    sys.exit(main())
@@ -0,0 +1,103 @@
+"""
+Fast, reproducible dealing of many rounds at once.
+
+A *deal* is an array of the 56 card indices (see :func: `combination.encode
+<tichu.combination.encode>`) in the order they are dealt: cards 14*s to
+14*s+13 go to seat *s*, of which the first 8 are seen before grand tichu
+calls. Many deals are stored as the rows of a 2-D ``uint8`` array and
+shuffled by a single call to :meth: `numpy.random.Generator.permuted`.
+
+Work is split across processes by :func: `stream`: stream *i* of a seed is
+independent of all other streams and of the number of streams in use, so
+results do not depend on how the work was distributed.
+
+In *duplicate* mode, the same deals are played again with the hands moved
+by one or more seats (:func: `rotate`). Comparing bots on the same cards
+from both sides of the table removes most of the luck of the deal from
+their evaluation::
+
+    deals = DealStream(seed, rotation=1)
+    Game(strategies, seed=seed, deals=deals).play()
+"""
+import logging
+
+import numpy as np
+
+from combination import N_CARDS, card_objects
+
+logger = logging.getLogger('tichu.' + __name__)
+
+HAND_SIZE = 14
+
+_deck = np.arange(N_CARDS, dtype=np.uint8)
+
+def stream(seed, i=0) :
+    """ Return the random number generator of stream *i* of *seed*, a
+    :class: `numpy.random.Generator`. Different streams are statistically
+    independent.
+    """
+    return np.random.Generator(np.random.PCG64(
+        np.random.SeedSequence(seed, spawn_key=(i,))))
+
+def deal_rounds(n, rng) :
+    """ Return *n* deals as an (n, 56) ``uint8`` array. *rng* is a
+    :class: `numpy.random.Generator` or a seed for :func: `stream`.
+    """
+    if not isinstance(rng, np.random.Generator) :
+        rng = stream(rng)
+    return rng.permuted(np.tile(_deck, (n, 1)), axis=1)
+
+def deal_round(rng) :
+    """ Return a single deal, see :func: `deal_rounds`. """
+    return deal_rounds(1, rng)[0]
+
+def rotate(deals, shift) :
+    """ Return *deals* (one deal or an array of them) with the hand of
+    seat *s* moved to seat *s* + *shift*. A shift of 1 or 3 swaps the
+    cards of the teams.
+    """
+    deals = np.asarray(deals)
+    return np.roll(deals, (shift % 4) * HAND_SIZE, axis=-1)
+
+def duplicate(deals, rotations=(0, 1, 2, 3)) :
+    """ Repeat every deal once for each of the seat *rotations*. Return an
+    array with ``len(rotations)`` consecutive rows per deal.
+    """
+    deals = np.asarray(deals)
+    rotated = np.stack([rotate(deals, shift) for shift in rotations], axis=1)
+    return rotated.reshape(-1, N_CARDS)
+
+def hands(deal) :
+    """ The four hands of *deal* as lists of card indices, in seat order. """
+    return [[int(i) for i in deal[HAND_SIZE*s:HAND_SIZE*(s+1)]]
+            for s in range(4)]
+
+def cards(deal) :
+    """ The cards of *deal* in dealing order. """
+    cards_by_index = card_objects()
+    return [cards_by_index[i] for i in deal]
+
+class DealStream() :
+    """ An endless iterator over the deals of stream *i* of *seed*, drawn
+    *block_size* at a time and moved by *rotation* seats. Streams with the
+    same *seed* and *i* yield the same deals, whatever the rotation, which
+    is how duplicate games are set up.
+    """
+    def __init__(self, seed, i=0, rotation=0, block_size=64) :
+        self.seed = seed
+        self.i = i
+        self.rotation = rotation
+        self.block_size = block_size
+        self.rng = stream(seed, i)
+        self.dealt = 0
+        self._block = []
+
+    def __iter__(self) :
+        return self
+
+    def __next__(self) :
+        if not len(self._block) :
+            self._block = list(rotate(deal_rounds(self.block_size, self.rng),
+                                      self.rotation))
+        self.dealt += 1
+        return self._block.pop(0)
@@ -0,0 +1,262 @@
+"""
+Split a hand into the fewest legal plays.
+
+The number of plays a hand needs to get rid of all its cards is a good
+measure of its strength, e.g. for tichu calls. Apart from straight bombs,
+which depend on suits, whether some cards form a combination only depends
+on their ranks and the phoenix. The solver therefore searches over rank
+histograms (see :func: `encode <tichu.combination.encode>`) with memoization,
+such that the many hands sharing the same rank structure and the many sub
+problems every hand shares with others are solved only once. Straight bombs
+are chosen up front from the suit bits of the hand.
+
+Of all splits with the fewest plays the *strongest* one is returned: the one
+with the highest sum of the ranks (as given by :class: `Combination
+<tichu.combination.Combination>`) of its plays. As bombs have very high
+ranks, this keeps bombs together whenever possible.
+
+Like the classifier, splits follow the rules of the game: the Dog and the
+Dragon are only played as singles, the Mahjongg alone or in a straight, and
+the phoenix takes the place of exactly one card.
+"""
+import functools
+import logging
+import multiprocessing
+
+from combination import Combination, PHOENIX, Phoenix_bit, SINGLE, PAIR, \
+                        TRIPLET, STRAIGHT, FULL_HOUSE, STRAIGHT_OF_PAIRS, \
+                        BOMB, STRAIGHT_BOMB, BOMB_OFFSET, \
+                        STRAIGHT_BOMB_OFFSET, encode, histogram_of, \
+                        card_objects, rank_by_index, suit_masks
+
+logger = logging.getLogger('tichu.' + __name__)
+
+def _count(histogram, rank) :
+    return (histogram >> (rank << 2)) & 15
+
+def _moves(histogram, phoenix, r) :
+    """ Yield all plays (code, rank, histogram part, phoenix used) that
+    contain a card of rank *r*, the lowest rank in *histogram*.
+    """
+    one = 1 << (r << 2)
+    c = _count(histogram, r)
+    yield SINGLE, r, one, False
+    # The Dog and the Dragon are only played alone
+    if r == 0 or r == 15 :
+        return
+
+    # Straights starting at *r* (the Mahjongg counts as 1). The phoenix may
+    # stand in for any later card, or for the card below *r*.
+    for below in ((False, True) if phoenix and r > 2 else (False,)) :
+        stack = [(r + 1, one, below)]
+        while stack :
+            rank, part, used = stack.pop()
+            length = (rank - r) + below
+            if length >= 5 :
+                yield STRAIGHT, r, part, used
+            if rank > 14 :
+                continue
+            bit = 1 << (rank << 2)
+            if _count(histogram, rank) :
+                stack.append((rank + 1, part + bit, used))
+            if phoenix and not used :
+                stack.append((rank + 1, part, True))
+
+    if r == 1 :
+        return
+
+    # Pairs, triplets and the bomb
+    if c >= 2 : yield PAIR, r, 2 * one, False
+    if phoenix : yield PAIR, r, one, True
+    if c >= 3 : yield TRIPLET, r, 3 * one, False
+    if c >= 2 and phoenix : yield TRIPLET, r, 2 * one, True
+    if c == 4 : yield BOMB, BOMB_OFFSET + r, 4 * one, False
+
+    # Full houses with *r* in the triplet or in the pair. Options are given
+    # as (natural cards, phoenix used).
+    triplets = [(3, False)] if c >= 3 else []
+    pairs = [(2, False)] if c >= 2 else []
+    if phoenix :
+        if c >= 2 : triplets.append((2, True))
+        pairs.append((1, True))
+    for s in range(r + 1, 15) :
+        cs = _count(histogram, s)
+        if not cs : continue
+        other = 1 << (s << 2)
+        for n_r, r_used in triplets :
+            for n_s, s_used in ((2, False), (1, True)) :
+                if n_s > cs or (s_used and (r_used or not phoenix)) : 
+                    continue
+                # The rank is the one of the natural triplet or, with two 
+                # natural pairs, the higher one
+                yield (FULL_HOUSE, r if n_r == 3 else s, 
+                       n_r * one + n_s * other, r_used or s_used)
+        for n_r, r_used in pairs :
+            for n_s, s_used in ((3, False), (2, True)) :
+                if n_s > cs or (s_used and (r_used or not phoenix)) : 
+                    continue
+                yield FULL_HOUSE, s, n_r * one + n_s * other, r_used or s_used
+
+    # Straights of pairs starting at *r*
+    stack = [(r, 0, False)]
+    while stack :
+        rank, part, used = stack.pop()
+        if rank - r >= 2 and part :
+            yield STRAIGHT_OF_PAIRS, r, part, used
+        if rank > 14 :
+            continue
+        cr = _count(histogram, rank)
+        bit = 1 << (rank << 2)
+        if cr >= 2 :
+            stack.append((rank + 1, part + 2 * bit, used))
+        if cr >= 1 and phoenix and not used :
+            stack.append((rank + 1, part + bit, True))
+
+@functools.lru_cache(maxsize=1 << 20)
+def _solve(histogram, phoenix) :
+    """ Return (number of plays, strength, first play, rest) of the best
+    split of the cards given by *histogram* and *phoenix*. The first play
+    is a (code, rank, histogram part, phoenix used) tuple, *rest* the
+    (histogram, phoenix) state it leaves.
+    """
+    if not histogram :
+        if phoenix :
+            return 1, rank_by_index[PHOENIX], \
+                   (SINGLE, rank_by_index[PHOENIX], 0, True), (0, False)
+        return 0, 0, None, None
+    low = histogram & -histogram
+    r = (low.bit_length() - 1) >> 2
+    best = None
+    for move in _moves(histogram, phoenix, r) :
+        rest = (histogram - move[2], phoenix and not move[3])
+        n, strength, _, _ = _solve(*rest)
+        n += 1
+        strength += move[1]
+        if best is None or n < best[0] or \
+           (n == best[0] and strength > best[1]) :
+            best = (n, strength, move, rest)
+    return best
+
+def _straight_bombs(mask) :
+    """ All straight bombs in *mask*, as masks. """
+    bombs = []
+    for suit, suit_mask in enumerate(suit_masks) :
+        bits = (mask & suit_mask) >> (13 * suit)
+        for length in range(5, 14) :
+            starts = bits
+            for i in range(1, length) :
+                starts &= bits >> i
+            while starts :
+                low = starts & -starts
+                bombs.append(((1 << length) - 1) * low << (13 * suit))
+                starts ^= low
+    return bombs
+
+def _straight_bomb_rank(bomb) :
+    lowest = rank_by_index[(bomb & -bomb).bit_length() - 1]
+    return lowest + bomb.bit_count() * STRAIGHT_BOMB_OFFSET
+
+def _best_split(mask) :
+    """ Return (number of plays, strength, straight bombs, state) of the best
+    split of *mask*, where *state* is the (histogram, phoenix) state left
+    after playing the chosen straight bombs.
+    """
+    best = None
+    def search(mask, bombs, chosen) :
+        nonlocal best
+        state = (histogram_of(mask & ~Phoenix_bit), bool(mask & Phoenix_bit))
+        n, strength, _, _ = _solve(*state)
+        n += len(chosen)
+        strength += sum(_straight_bomb_rank(bomb) for bomb in chosen)
+        if best is None or n < best[0] or \
+           (n == best[0] and strength > best[1]) :
+            best = (n, strength, list(chosen), state)
+        for i, bomb in enumerate(bombs) :
+            if not bomb & ~mask :
+                search(mask & ~bomb, bombs[i+1:], chosen + [bomb])
+    search(mask, _straight_bombs(mask), [])
+    return best
+
+def _mask(cards) :
+    if isinstance(cards, int) :
+        return cards
+    return encode(cards)[0]
+
+def min_plays(cards) :
+    """ The fewest plays that *cards* (a collection of cards or a mask) can
+    be split into.
+    """
+    return _best_split(_mask(cards))[0]
+
+def score(cards) :
+    """ Return (number of plays, number of bombs, strength) of the best
+    split of *cards* (a collection of cards or a mask).
+    """
+    n, strength, bombs, state = _best_split(_mask(cards))
+    n_bombs = len(bombs)
+    while state[0] or state[1] :
+        _, _, move, state = _solve(*state)
+        n_bombs += move[0] == BOMB
+    return n, n_bombs, strength
+
+def decompose(cards) :
+    """ Return the strongest split of *cards* (a collection of cards or a
+    mask) into the fewest plays, as a list of :class: `Combination
+    <tichu.combination.Combination>` objects.
+    """
+    mask = _mask(cards)
+    n, strength, bombs, state = _best_split(mask)
+    cards_by_index = card_objects()
+    plays = []
+    for bomb in bombs :
+        plays.append([cards_by_index[i] for i in range(52) if bomb >> i & 1])
+        mask &= ~bomb
+    # Cards of the remaining hand by rank
+    by_rank = [[] for rank in range(16)]
+    for i in range(len(cards_by_index)) :
+        if mask >> i & 1 and i != PHOENIX :
+            by_rank[rank_by_index[i]].append(cards_by_index[i])
+    while state[0] or state[1] :
+        _, _, move, state = _solve(*state)
+        code, rank, part, used = move
+        play = [cards_by_index[PHOENIX]] if used else []
+        for r in range(16) :
+            for j in range(_count(part, r)) :
+                play.append(by_rank[r].pop())
+        plays.append(play)
+    return [Combination(play) for play in plays]
+
+def _score_indices(indices) :
+    mask = 0
+    for i in indices :
+        if i >= 0 :
+            mask |= 1 << int(i)
+    return score(mask)
+
+def _score_chunk(hands) :
+    return [_score_indices(indices) for indices in hands]
+
+def score_batch(hands, processes=1, chunk_size=1000) :
+    """ Score many hands at once. *hands* is a sequence of card index
+    sequences (e.g. the rows of a 2-D array, padded with -1). Return the
+    list of (number of plays, number of bombs, strength) per hand.
+
+    With *processes* other than 1, chunks of *chunk_size* hands are scored
+    on a pool of worker processes (*None*: one per core).
+    """
+    if processes == 1 :
+        return _score_chunk(hands)
+    chunks = [[list(indices) for indices in hands[start:start + chunk_size]]
+              for start in range(0, len(hands), chunk_size)]
+    results = []
+    with multiprocessing.Pool(processes) as pool :
+        for chunk in pool.imap(_score_chunk, chunks) :
+            results.extend(chunk)
+    return results
+
+def cache_info() :
+    """ Statistics of the memoized sub problems. """
+    return _solve.cache_info()
+
+def clear_cache() :
+    _solve.cache_clear()
@@ -0,0 +1,492 @@
+"""
+Exact solver for the end of a round when all hands are known.
+
+The solver searches the rest of the round with alpha-beta pruning. Team 0
+(seats 0 and 2) maximizes and team 1 minimizes the difference of the round
+scores, which are counted as in :meth: `Round.score <tichu.game.Round.score>`.
+Plays are enumerated with :class: `PlayIndex <tichu.moves.PlayIndex>` and
+compared with the ranks of :class: `Combination
+<tichu.combination.Combination>`, the phoenix and the dog follow the rules
+of :class: `Trick <tichu.game.Trick>`.
+
+Bombs can be played out of turn: before a player acts on a trick, the
+opponents may interrupt with a bomb that beats it. The partner's bombs are
+among the moves of the player's team. A trick won with the dragon is given
+to the opponent the winning team chooses.
+
+Positions are stored in a :class: `TranspositionTable` under Zobrist keys:
+every card in every hand, every card of the top combination and the other
+parts of a position have a random 64 bit key, and the key of a position is
+the XOR of the keys of its parts. The table has a fixed number of slots and
+keeps, for each slot, the entry with the largest subtree (the most cards
+left) plus the most recent one.
+"""
+import logging
+import random
+from collections import namedtuple
+
+from combination import card_objects, card_index, encode, DOG, DRAGON, \
+                        N_CARDS
+from core import mask_points
+from moves import PlayIndex
+from player import PassAction, PlayAction
+
+logger = logging.getLogger('tichu.' + __name__)
+
+# Stages of a position: opponents of *turn* may bomb, *turn* acts, the
+# winner of a dragon trick gives it away
+INTERRUPT, TURN, GIFT = range(3)
+
+Position = namedtuple('Position', ['hands', 'turn', 'top', 'top_rank',
+                                   'winner', 'passes', 'trick_points', 'won',
+                                   'finished', 'stage'])
+Position.__doc__ = """ The state of a round during the endgame.
+
+============  ==================================================================
+hands         tuple of the 4 hands as card masks.
+turn          seat of the player to act.
+top           the :class: `Combination <tichu.combination.Combination>` to
+              beat or *None* when leading.
+top_rank      the rank to beat (differs from *top.rank* for the phoenix).
+winner        seat that played *top*.
+passes        number of passes since *top* was played.
+trick_points  points of the cards in the current trick.
+won           tuple of the points won in tricks by each seat.
+finished      tuple of the seats that are out of cards, in order.
+stage         *INTERRUPT*, *TURN* or *GIFT*.
+============  ==================================================================
+"""
+
+Solution = namedtuple('Solution', ['move', 'value', 'scores'])
+Solution.__doc__ = """ Result of :meth: `EndgameSolver.solve`: the best
+*move* (a :class: `PlayerAction <tichu.player.PlayerAction>`), its *value*
+(the difference of the team's scores) and the round *scores* of both teams
+when both play perfectly.
+"""
+
+def team(seat) :
+    return seat % 2
+
+def _cards(mask) :
+    cards_by_index = card_objects()
+    return [cards_by_index[i] for i in range(N_CARDS) if mask >> i & 1]
+
+#_Zobrist_keys__________________________________________________________________
+
+POINTS_OFFSET = 128
+
+class ZobristKeys() :
+    """ Random keys for the parts of a :class: `Position`. Masks are hashed
+    a byte at a time through tables holding the XOR of the keys of every
+    byte value.
+    """
+    def __init__(self, seed=0) :
+        rng = random.Random(seed)
+        new = lambda n : [rng.getrandbits(64) for i in range(n)]
+        # One set of card keys per hand plus one for the top combination
+        self.hands = [self._byte_tables(new(N_CARDS)) for seat in range(4)]
+        self.top = self._byte_tables(new(N_CARDS))
+        self.turn = new(4)
+        self.winner = new(5)
+        self.passes = new(4)
+        self.stage = new(3)
+        # Points are offset by *POINTS_OFFSET* (the phoenix counts -25)
+        self.trick_points = new(512)
+        self.won = [new(512) for seat in range(4)]
+        self.finished = [new(4) for position in range(4)]
+        # Effective ranks of a single phoenix, by twice the rank
+        self.phoenix_rank = new(32)
+
+    @staticmethod
+    def _byte_tables(keys) :
+        tables = []
+        for start in range(0, N_CARDS, 8) :
+            table = [0] * 256
+            for value in range(1, 256) :
+                low = value & -value
+                table[value] = table[value ^ low] ^ \
+                               keys[start + low.bit_length() - 1]
+            tables.append(table)
+        return tables
+
+    @staticmethod
+    def _mask_key(tables, mask) :
+        key = 0
+        for table in tables :
+            key ^= table[mask & 255]
+            mask >>= 8
+        return key
+
+    def key(self, position) :
+        """ Return the Zobrist key of *position*. """
+        p = position
+        key = self.turn[p.turn] ^ self.stage[p.stage] ^ \
+              self.passes[p.passes] ^ \
+              self.trick_points[p.trick_points + POINTS_OFFSET] ^ \
+              self.winner[4 if p.winner is None else p.winner]
+        for seat in range(4) :
+            key ^= self._mask_key(self.hands[seat], p.hands[seat])
+            key ^= self.won[seat][p.won[seat] + POINTS_OFFSET]
+        for i, seat in enumerate(p.finished) :
+            key ^= self.finished[i][seat]
+        if p.top is not None :
+            key ^= self._mask_key(self.top, p.top.mask)
+            if p.top.N == 1 and p.top.with_phoenix :
+                key ^= self.phoenix_rank[int(2 * p.top_rank)]
+        return key
+
+#_Transposition_table___________________________________________________________
+
+EXACT, LOWER, UPPER = range(3)
+
+class TranspositionTable() :
+    """ Fixed size store of search results, indexed by the low bits of the
+    Zobrist key. Every slot holds two entries: the one with the largest
+    *depth* seen for the slot, and the most recently stored one. Memory use
+    is bounded by *size* slots (a power of 2).
+    """
+    def __init__(self, size=1 << 18) :
+        if size & (size - 1) :
+            raise ValueError('Size has to be a power of 2.')
+        self.size = size
+        self._mask = size - 1
+        self._deep = [None] * size
+        self._recent = [None] * size
+        self.hits = 0
+        self.stores = 0
+        self.evictions = 0
+
+    def lookup(self, key) :
+        """ Return the stored (key, depth, value, flag, move) entry of *key*
+        or *None*.
+        """
+        i = key & self._mask
+        for entry in (self._deep[i], self._recent[i]) :
+            if entry is not None and entry[0] == key :
+                self.hits += 1
+                return entry
+        return None
+
+    def store(self, key, depth, value, flag, move) :
+        i = key & self._mask
+        entry = (key, depth, value, flag, move)
+        self.stores += 1
+        deep = self._deep[i]
+        if deep is None or deep[0] == key or depth >= deep[1] :
+            # The replaced deep entry still gets a chance as recent one
+            if deep is not None and deep[0] != key :
+                self._replace_recent(i, deep)
+            self._deep[i] = entry
+        else :
+            self._replace_recent(i, entry)
+
+    def _replace_recent(self, i, entry) :
+        old = self._recent[i]
+        if old is not None and old[0] != entry[0] :
+            self.evictions += 1
+        self._recent[i] = entry
+
+    def clear(self) :
+        self._deep = [None] * self.size
+        self._recent = [None] * self.size
+        self.hits = self.stores = self.evictions = 0
+
+    def __len__(self) :
+        return sum(entry is not None for entry in self._deep + self._recent)
+
+    def __str__(self) :
+        return '<TranspositionTable {} slots: {} hits, {} stores, {} ' \
+               'evictions>'.format(self.size, self.hits, self.stores,
+                                   self.evictions)
+
+    def __repr__(self) :
+        return self.__str__()
+
+#_Solver________________________________________________________________________
+
+class EndgameSolver() :
+    """ Solve rounds with perfect information (see the module docstring).
+
+    ==========  ================================================================
+    calls       list of the tichu calls (0, 100 or 200) per seat.
+    table_size  int; number of slots of the :class: `TranspositionTable`.
+    ==========  ================================================================
+    """
+    def __init__(self, calls=(0, 0, 0, 0), table_size=1 << 18, seed=0) :
+        self.calls = tuple(calls)
+        self.table = TranspositionTable(table_size)
+        self.keys = ZobristKeys(seed)
+        self.nodes = 0
+        self._indices = {}
+
+    #_Rules_____________________________________________________________________
+
+    def _index(self, mask) :
+        """ The :class: `PlayIndex <tichu.moves.PlayIndex>` of a hand and 
+        the list of its bombs.
+        """
+        entry = self._indices.get(mask)
+        if entry is None :
+            if len(self._indices) > 100000 :
+                self._indices.clear()
+            index = PlayIndex(_cards(mask))
+            bombs = [bomb for bomb_type in index.bomb_types 
+                     for bomb in index.plays(bomb_type)]
+            entry = self._indices[mask] = (index, bombs)
+        return entry
+
+    def _bombs(self, mask, rank) :
+        """ All bombs in *mask* that beat *rank*. """
+        return [bomb for bomb in self._index(mask)[1] if bomb.rank > rank]
+
+    @staticmethod
+    def is_over(finished) :
+        if len(finished) == 2 and team(finished[0]) == team(finished[1]) :
+            return True
+        return len(finished) >= 3
+
+    @staticmethod
+    def _next(hands, seat) :
+        """ The next seat after *seat* that holds cards. """
+        for i in range(1, 5) :
+            if hands[(seat + i) % 4] :
+                return (seat + i) % 4
+        return None
+
+    def scores(self, hands, won, finished) :
+        """ Round scores of both teams at the end of a round. """
+        scores = [0, 0]
+        first = finished[0]
+        if len(finished) == 2 :
+            scores[team(first)] = 200
+        else :
+            last = [s for s in range(4) if s not in finished][0]
+            scores[1 - team(last)] += mask_points(hands[last])
+            won = list(won)
+            won[first] += won[last]
+            won[last] = 0
+            for seat in range(4) :
+                scores[team(seat)] += won[seat]
+        for seat, call in enumerate(self.calls) :
+            if call :
+                scores[team(seat)] += call if seat == first else -call
+        return tuple(scores)
+
+    def _resolve(self, p, receiver) :
+        """ Give the trick of *p* to *receiver*. Return the next lead
+        position or, at the end of the round, the scores.
+        """
+        won = list(p.won)
+        won[receiver] += p.trick_points
+        won = tuple(won)
+        if self.is_over(p.finished) :
+            return self.scores(p.hands, won, p.finished)
+        leader = p.winner if p.hands[p.winner] else \
+                 self._next(p.hands, p.winner)
+        return Position(p.hands, leader, None, None, None, 0, 0, won,
+                        p.finished, TURN)
+
+    def _end_trick(self, p) :
+        """ The position after the trick of *p* is won. """
+        if p.top.N == 1 and card_index(p.top.cards[0]) == DRAGON :
+            return p._replace(stage=GIFT)
+        return self._resolve(p, p.winner)
+
+    def _play(self, p, seat, combination) :
+        """ The position (or final scores) after *seat* plays
+        *combination*.
+        """
+        hands = list(p.hands)
+        hands[seat] &= ~combination.mask
+        hands = tuple(hands)
+        finished = p.finished if hands[seat] else p.finished + (seat,)
+        trick_points = p.trick_points + mask_points(combination.mask)
+        if combination.N == 1 and combination.with_phoenix :
+            rank = 1.5 if p.top is None else p.top_rank + 0.5
+        else :
+            rank = combination.rank
+        q = Position(hands, seat, combination, rank, seat, 0, trick_points,
+                     p.won, finished, INTERRUPT)
+
+        if combination.N == 1 and card_index(combination.cards[0]) == DOG :
+            # The lead goes to the partner
+            if self.is_over(finished) :
+                return self.scores(hands, p.won, finished)
+            partner = (seat + 2) % 4
+            leader = partner if hands[partner] else self._next(hands, partner)
+            return Position(hands, leader, None, None, None, 0, 0, p.won,
+                            finished, TURN)
+        if self.is_over(finished) or self._trick_finished(q) :
+            return self._end_trick(q)
+        return q._replace(turn=self._next(hands, seat))
+
+    def _trick_finished(self, p) :
+        others = sum(1 for s in range(4) if s != p.winner and p.hands[s])
+        return p.passes >= others
+
+    def _pass(self, p) :
+        q = p._replace(passes=p.passes + 1, stage=INTERRUPT)
+        if self._trick_finished(q) :
+            return self._end_trick(q)
+        return q._replace(turn=self._next(p.hands, p.turn))
+
+    def moves(self, p) :
+        """ Return the moves of position *p* as (move, result) pairs, where
+        results are positions or final scores. Moves are (seat,
+        combination) pairs, (seat, *None*) for passing or declining to
+        bomb and ('gift', seat) for giving away a dragon trick.
+        """
+        if p.stage == GIFT :
+            return [(('gift', s), self._resolve(p, s))
+                    for s in range(4) if team(s) != team(p.winner)]
+
+        if p.stage == INTERRUPT :
+            moves = [((s, bomb), self._play(p, s, bomb))
+                     for s in range(4) if team(s) != team(p.turn) and
+                     p.hands[s] for bomb in self._bombs(p.hands[s], p.top_rank)]
+            if moves :
+                return [((p.turn, None), p._replace(stage=TURN))] + moves
+            p = p._replace(stage=TURN)
+
+        seat = p.turn
+        index = self._index(p.hands[seat])[0]
+        moves = []
+        if p.top is None :
+            plays = index.all_plays()
+        else :
+            plays = index.beating(p.top, p.top_rank)
+            partner = (seat + 2) % 4
+            if p.hands[partner] :
+                moves = [((partner, bomb), self._play(p, partner, bomb))
+                         for bomb in self._bombs(p.hands[partner], p.top_rank)]
+        # Try getting rid of many cards first
+        plays = sorted(plays, key=lambda c : (-c.N, c.rank))
+        moves = [((seat, c), self._play(p, seat, c)) for c in plays] + moves
+        if p.top is not None :
+            moves.append(((seat, None), self._pass(p)))
+        return moves
+
+    #_Search____________________________________________________________________
+
+    def mover(self, p) :
+        """ The team that chooses the move in position *p*. """
+        if p.stage == GIFT :
+            return team(p.winner)
+        if p.stage == INTERRUPT :
+            return 1 - team(p.turn)
+        return team(p.turn)
+
+    @staticmethod
+    def _value(result) :
+        return result[0] - result[1]
+
+    def search(self, p, alpha=float('-inf'), beta=float('inf')) :
+        """ Return the value (team 0 minus team 1 score) of position *p*
+        within the window *alpha*, *beta*.
+        """
+        self.nodes += 1
+        key = self.keys.key(p)
+        entry = self.table.lookup(key)
+        best_move = None
+        if entry is not None :
+            _, _, value, flag, best_move = entry
+            if flag == EXACT or (flag == LOWER and value >= beta) or \
+               (flag == UPPER and value <= alpha) :
+                return value
+
+        moves = self.moves(p)
+        if best_move is not None :
+            moves.sort(key=lambda move : move[0] != best_move)
+        maximize = self.mover(p) == 0
+        best = float('-inf') if maximize else float('inf')
+        a, b = alpha, beta
+        for move, result in moves :
+            if isinstance(result, Position) :
+                value = self.search(result, a, b)
+            else :
+                value = self._value(result)
+            if (value > best) if maximize else (value < best) :
+                best, best_move = value, move
+            if maximize :
+                a = max(a, value)
+            else :
+                b = min(b, value)
+            if a >= b :
+                break
+
+        if best <= alpha :
+            flag = UPPER
+        elif best >= beta :
+            flag = LOWER
+        else :
+            flag = EXACT
+        depth = sum(hand.bit_count() for hand in p.hands)
+        self.table.store(key, depth, best, flag, best_move)
+        return best
+
+    def best_move(self, p, seat=None) :
+        """ Return (value, move, result) of the best move in *p*, only 
+        looking at the moves of *seat* if given.
+        """
+        maximize = self.mover(p) == 0
+        best = None
+        for move, result in self.moves(p) :
+            if seat is not None and move[0] != seat :
+                continue
+            if isinstance(result, Position) :
+                value = self.search(result)
+            else :
+                value = self._value(result)
+            if best is None or \
+               ((value > best[0]) if maximize else (value < best[0])) :
+                best = (value, move, result)
+        return best
+
+    def outcome(self, p) :
+        """ The round scores after perfect play from position *p*. """
+        while isinstance(p, Position) :
+            p = self.best_move(p)[2]
+        return p
+
+    def solve(self, hands, turn, top=None, top_rank=None, winner=None,
+              passes=0, won=(0, 0, 0, 0), trick_points=0, finished=()) :
+        """ Return the :class: `Solution` for the player at seat *turn*.
+
+        ============  ==========================================================
+        hands         list of 4 hands (collections of cards or masks).
+        turn          seat of the player to act.
+        top           the :class: `Combination
+                      <tichu.combination.Combination>` to beat, if any.
+        top_rank      the rank to beat, if it differs from *top.rank*.
+        winner        seat that played *top*.
+        passes        passes since *top* was played.
+        won           points won in tricks per seat.
+        trick_points  points of the cards in the current trick.
+        finished      seats that are out of cards, in order.
+        ============  ==========================================================
+        """
+        hands = tuple(hand if isinstance(hand, int) else encode(hand)[0]
+                      for hand in hands)
+        if top is not None and top_rank is None :
+            top_rank = top.rank
+        p = Position(hands, turn, top, top_rank, winner, passes,
+                     trick_points, tuple(won), tuple(finished), TURN)
+        value, move, result = self.best_move(p, turn)
+        seat, combination = move
+        action = PassAction() if combination is None else \
+                 PlayAction(combination)
+        scores = result if not isinstance(result, Position) else \
+                 self.outcome(result)
+        return Solution(action, value, scores)
+
+    def solve_trick(self, round_, trick) :
+        """ Solve the running *round_* for the player to act on *trick*. """
+        seats = round_.seats
+        return self.solve(
+            [player.hand.mask for player in round_.players],
+            seats[trick.players[0]], trick.top, trick.top_rank,
+            None if trick.winner is None else seats[trick.winner],
+            trick.passes,
+            [mask_points(encode(player.won_cards)[0])
+             for player in round_.players],
+            mask_points(encode(trick.cards)[0]), round_.finished)
@@ -0,0 +1,171 @@
+"""
+Typed game events and the sinks that receive them.
+
+The engine reports what happens in a trick by calling ``sink.emit(kind,
+player, data)`` on its event sink. Sinks decide what to do with an event:
+drop it (:class: `NullSink`, the default), keep the most recent events in a
+preallocated ring buffer (:class: `RingBufferSink`), write them out in
+batches (:class: `BatchWriterSink`) or turn them into human readable log
+messages (:class: `LoggingSink`).
+
+===========  ===================================  ============================
+kind         player                               data
+===========  ===================================  ============================
+PLAY         the player                           the played Combination
+BOMB         the player                           the played bomb
+PASS         the player                           *None*
+TRICK_WON    the player that won the trick        list of the trick's cards
+RAGEQUIT     the player                           *None*
+DEAL         the player                           list of the dealt cards
+CALL         the player                           100 (tichu) or 200 (grand)
+ROUND_OVER   *None*                               list of both team's points
+GAME         *None*                               the seed or *None*
+EXCHANGE     the player giving cards              list of the cards given to 
+                                                  the next 3 seats
+===========  ===================================  ============================
+
+A game starts with a GAME event. Every round starts with one DEAL event per
+player in seat order, followed by the tichu calls and one EXCHANGE event per
+player in seat order, and ends with ROUND_OVER.
+"""
+import logging
+from collections import namedtuple
+
+from core import GAME_LEVEL
+
+logger = logging.getLogger('tichu.' + __name__)
+
+# Event kinds
+PLAY, BOMB, PASS, TRICK_WON, RAGEQUIT, DEAL, CALL, ROUND_OVER, GAME, \
+    EXCHANGE = range(10)
+event_names = ['play', 'bomb', 'pass', 'trick_won', 'ragequit', 'deal', 
+               'call', 'round_over', 'game', 'exchange']
+
+Event = namedtuple('Event', ['kind', 'player', 'data'])
+
+class EventSink() :
+    """ Base class of all event sinks. """
+
+    def emit(self, kind, player, data=None) :
+        """ Receive an event. See the module docstring for the arguments. """
+        raise NotImplementedError
+
+    def flush(self) :
+        """ Pass on any buffered events. """
+        pass
+
+class NullSink(EventSink) :
+    """ Drop all events. """
+
+    def emit(self, kind, player, data=None) :
+        pass
+
+# The default sink of the engine
+null_sink = NullSink()
+
+class RingBufferSink(EventSink) :
+    """ Keep the last *size* events in preallocated storage. Emitting does
+    not allocate; :class: `Event` tuples are only created when reading.
+    """
+    def __init__(self, size=4096) :
+        self.size = size
+        self._kinds = [0] * size
+        self._players = [None] * size
+        self._data = [None] * size
+        # Total number of events emitted
+        self.count = 0
+
+    def emit(self, kind, player, data=None) :
+        i = self.count % self.size
+        self._kinds[i] = kind
+        self._players[i] = player
+        self._data[i] = data
+        self.count += 1
+
+    @property
+    def dropped(self) :
+        """ Number of events that were overwritten. """
+        return max(0, self.count - self.size)
+
+    def __len__(self) :
+        return min(self.count, self.size)
+
+    def __iter__(self) :
+        """ Iterate over the stored events, oldest first. """
+        start = self.count - len(self)
+        for n in range(start, self.count) :
+            i = n % self.size
+            yield Event(self._kinds[i], self._players[i], self._data[i])
+
+    def clear(self) :
+        self.count = 0
+        for i in range(self.size) :
+            self._players[i] = None
+            self._data[i] = None
+
+class BatchWriterSink(EventSink) :
+    """ Write events as tab separated lines (kind, player name, data) to
+    *file*, *batch_size* events at a time.
+    """
+    def __init__(self, file, batch_size=1024) :
+        self.file = file
+        self.batch_size = batch_size
+        self._batch = []
+
+    def emit(self, kind, player, data=None) :
+        self._batch.append((kind, player, data))
+        if len(self._batch) >= self.batch_size :
+            self.flush()
+
+    def flush(self) :
+        if not self._batch : return
+        self.file.write(''.join(
+            '{}\t{}\t{}\n'.format(event_names[kind], 
+                                  '' if player is None else player.name,
+                                  '' if data is None else data)
+            for kind, player, data in self._batch))
+        self._batch = []
+
+    def close(self) :
+        self.flush()
+        self.file.flush()
+
+class LoggingSink(EventSink) :
+    """ Turn events into human readable messages on the *GAME* log level.
+    """
+    messages = ['%s plays: %s.', '%s bombs: %s.', '%s passes.',
+                '%s wins the trick.', '%s ragequits.', '%s gets: %s.', 
+                '%s calls %s.', 'Round over: %s.', 'New game, seed %s.',
+                '%s gives: %s.']
+    # Kinds whose message shows the data, and those without a player
+    with_data = (PLAY, BOMB, DEAL, CALL, EXCHANGE)
+    without_player = (ROUND_OVER, GAME)
+    # The level defined in :mod: `tichu.core`
+    level = GAME_LEVEL
+
+    def __init__(self, logger=logging.getLogger('tichu')) :
+        self.logger = logger
+
+    def emit(self, kind, player, data=None) :
+        if kind in self.with_data :
+            if kind in (DEAL, EXCHANGE) :
+                data = ' '.join(card.shortname for card in data)
+            self.logger.log(self.level, self.messages[kind], player.name, data)
+        elif kind in self.without_player :
+            self.logger.log(self.level, self.messages[kind], data)
+        else :
+            self.logger.log(self.level, self.messages[kind], player.name)
+
+class MultiSink(EventSink) :
+    """ Pass events on to several *sinks*. """
+    def __init__(self, *sinks) :
+        self.sinks = sinks
+
+    def emit(self, kind, player, data=None) :
+        for sink in self.sinks :
+            sink.emit(kind, player, data)
+
+    def flush(self) :
+        for sink in self.sinks :
+            sink.flush()
+
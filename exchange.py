@@ -0,0 +1,215 @@
+"""
+Choose the cards to give away in the exchange before the first trick.
+
+A push gives one card to each of the other three players. Its effect depends
+on the cards the others hold and push in return, which are unknown. The
+optimizer therefore samples deals of the 42 unseen cards, lets the other
+players push with the default rule of :meth: `Strategy.push
+<tichu.strategies.Strategy.push>` and scores the four hands after the
+exchange. A hand is scored by its split into the fewest plays (see :mod:
+`tichu.decomposition`), which follows the :class: `Combination
+<tichu.combination.Combination>` rules. The value of a push is the score of
+the own team minus the score of the opponents, averaged over the samples.
+
+Only a few pushes are compared: the cards the own hand misses least go to
+the opponents, the highest cards to the partner. All candidates are scored
+on the same samples. Samples are spread over a pool of worker processes and
+stop when the per-decision time budget is used up.
+"""
+import itertools
+import logging
+import multiprocessing
+import random
+import time
+
+from combination import N_CARDS, card_index, card_objects, rank_by_index
+import decomposition
+from strategies import Strategy, GreedyStrategy
+
+logger = logging.getLogger('tichu.' + __name__)
+
+# Weights of the parts of the hand score
+BOMB_VALUE = 1.
+HIGH_CARD_VALUE = 0.25
+# Aces, the Phoenix and the Dragon take tricks
+_high_cards = sum(1 << i for i, rank in enumerate(rank_by_index) if rank >= 14)
+
+def hand_value(mask) :
+    """ Score the cards of *mask*: the fewer plays, the more bombs and high
+    cards, the better.
+    """
+    n, n_bombs, strength = decomposition.score(mask)
+    return -n + BOMB_VALUE * n_bombs + \
+           HIGH_CARD_VALUE * (mask & _high_cards).bit_count()
+
+def default_push(indices) :
+    """ The cards (as indices) the default rule pushes from *indices*, to the
+    next three seats.
+    """
+    ordered = sorted(indices, key=lambda i : rank_by_index[i])
+    return [ordered[0], ordered[-1], ordered[1]]
+
+def _mask(indices) :
+    mask = 0
+    for i in indices :
+        mask |= 1 << i
+    return mask
+
+def evaluate_push(hand, candidates, seed) :
+    """ Score all *candidates* (index triples for the next three seats) of
+    *hand* (14 card indices) on the deal sampled with *seed*. Return the
+    list of team score differences.
+    """
+    rng = random.Random(seed)
+    unseen = [i for i in range(N_CARDS) if i not in hand]
+    rng.shuffle(unseen)
+    # The other hands, in seat order after the own seat
+    others = [unseen[14*k:14*(k+1)] for k in range(3)]
+    masks = [_mask(hand)] + [_mask(cards) for cards in others]
+    # What the others give and get among themselves and to the own seat
+    received = [0] * 4
+    for k, cards in enumerate(others, 1) :
+        for offset, i in enumerate(default_push(cards), 1) :
+            masks[k] &= ~(1 << i)
+            received[(k + offset) % 4] |= 1 << i
+    values = []
+    for candidate in candidates :
+        final = list(masks)
+        for offset, i in enumerate(candidate, 1) :
+            final[0] &= ~(1 << i)
+            final[offset] |= 1 << i
+        final = [mask | cards for mask, cards in zip(final, received)]
+        scores = [hand_value(mask) for mask in final]
+        values.append(scores[0] + scores[2] - scores[1] - scores[3])
+    return values
+
+def run_samples(hand, candidates, seeds, deadline) :
+    """ Evaluate all *candidates* on the samples given by *seeds* until the
+    time (:func: `time.time`) passes *deadline*. Return the value sums per
+    candidate and the number of samples used.
+    """
+    sums = [0.] * len(candidates)
+    n = 0
+    for seed in seeds :
+        if deadline is not None and time.time() > deadline :
+            break
+        for k, value in enumerate(evaluate_push(hand, candidates, seed)) :
+            sums[k] += value
+        n += 1
+    return sums, n
+
+def _run_samples(args) :
+    return run_samples(*args)
+
+def candidates(hand, n_opponent=4, n_partner=3) :
+    """ The pushes to compare, as index triples for the next three seats:
+    two of the *n_opponent* cards whose loss hurts the hand least go to the
+    opponents, one of the *n_partner* highest cards to the partner.
+    """
+    mask = _mask(hand)
+    loss = dict((i, hand_value(mask & ~(1 << i))) for i in hand)
+    by_loss = sorted(hand, key=lambda i : (-loss[i], rank_by_index[i]))
+    by_rank = sorted(hand, key=lambda i : -rank_by_index[i])
+    pushes = []
+    for partner in by_rank[:n_partner] :
+        low = [i for i in by_loss if i != partner][:n_opponent]
+        for left, right in itertools.combinations(low, 2) :
+            pushes.append([left, partner, right])
+    return pushes
+
+class PushStrategy(Strategy) :
+    """ Choose the exchange by sampling (see the module docstring) and leave
+    all other decisions to *strategy*.
+
+    ===========  ===============================================================
+    strategy     :class: `Strategy <tichu.strategies.Strategy>` taking all
+                 other decisions.
+    time_budget  float or None; seconds per exchange. Without a budget, all
+                 *n_samples* samples are used.
+    n_samples    int; maximum number of sampled deals per exchange.
+    processes    int or None; number of worker processes (None: one per
+                 core). With 1, samples are scored in the calling process.
+    n_opponent   int; number of cards considered for the opponents.
+    n_partner    int; number of cards considered for the partner.
+    ===========  ===============================================================
+
+    Without a time budget, results are reproducible from the round's seed.
+    """
+    def __init__(self, strategy=GreedyStrategy(), time_budget=0.2,
+                 n_samples=200, processes=1, n_opponent=4, n_partner=3) :
+        self.strategy = strategy
+        self.time_budget = time_budget
+        self.n_samples = n_samples
+        self.processes = processes
+        self.n_opponent = n_opponent
+        self.n_partner = n_partner
+        self.samples = 0
+        self.seconds = 0.
+        self._pool = None
+
+    def __getstate__(self) :
+        # Pools cannot be pickled, every process creates its own
+        state = self.__dict__.copy()
+        state['_pool'] = None
+        return state
+
+    @property
+    def pool(self) :
+        if self._pool is None :
+            self._pool = multiprocessing.Pool(self.processes)
+        return self._pool
+
+    def close(self) :
+        """ Shut down the worker processes. """
+        if self._pool is not None :
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def evaluate(self, hand, pushes, seed) :
+        """ Return the average value of every push in *pushes* and the
+        number of samples used.
+        """
+        deadline = None
+        if self.time_budget is not None :
+            deadline = time.time() + self.time_budget
+        rng = random.Random(seed)
+        seeds = [rng.getrandbits(64) for i in range(self.n_samples)]
+
+        if self.processes == 1 :
+            sums, n = run_samples(hand, pushes, seeds, deadline)
+        else :
+            n_workers = self.pool._processes
+            tasks = [(hand, pushes, seeds[w::n_workers], deadline)
+                     for w in range(n_workers)]
+            sums, n = [0.] * len(pushes), 0
+            for worker_sums, worker_n in self.pool.map(_run_samples, tasks) :
+                sums = [a + b for a, b in zip(sums, worker_sums)]
+                n += worker_n
+        return [s / n if n else 0. for s in sums], n
+
+    def push(self, round_, player) :
+        hand = [card_index(card) for card in player.hand.cards]
+        pushes = candidates(hand, self.n_opponent, self.n_partner)
+        start = time.perf_counter()
+        values, n = self.evaluate(hand, pushes, round_.rng.getrandbits(64))
+        seconds = time.perf_counter() - start
+        self.samples += n
+        self.seconds += seconds
+        logger.debug('%s: %d samples of %d pushes in %.3f s.', player.name, n,
+                     len(pushes), seconds)
+        best = pushes[values.index(max(values))]
+        cards_by_index = card_objects()
+        return [cards_by_index[i] for i in best]
+
+    def play(self, round_, player, trick) :
+        return self.strategy.play(round_, player, trick)
+
+    def call_grand_tichu(self, round_, player) :
+        return self.strategy.call_grand_tichu(round_, player)
+
+    def call_tichu(self, round_, player) :
+        return self.strategy.call_tichu(round_, player)
+
+    def give_dragon(self, round_, player, opponents) :
+        return self.strategy.give_dragon(round_, player, opponents)
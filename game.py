@@ -1,107 +1,442 @@
 """ Abstraction of a full game of Tichu, consisting of several rounds. """
 
 import logging
-import time
+import random
+from collections import deque
 from multiprocessing.dummy import Process
 
-#_Set_up_logging________________________________________________________________
-
-logger = logging.getLogger('tichu')
-logger.setLevel(logging.DEBUG)
-console_handler = logging.StreamHandler()
-console_handler.setLevel(logging.DEBUG)
-formatter = logging.Formatter('[%(levelname)s][%(name)s] %(message)s')
-console_handler.setFormatter(formatter)
-logger.addHandler(console_handler)
-logger.propagate = False
-
-# Create a custom log level
-level = 25 # WARN=30, INFO=20, DEBUG=10
-levelname = 'GAME'
-methodname = levelname.lower()
-def log_for_level(self, message, *args, **kwargs) :
-    self._log(level, message, args, **kwargs)
-logging.addLevelName(level, levelname)
-setattr(logging, levelname, level)
-setattr(logging.getLoggerClass(), methodname, log_for_level)
+from combination import card_index, card_objects
+from core import DOG, MAHJONGG, DRAGON, GAME_LEVEL, rank_by_index, \
+                 points_by_index
+from events import PLAY, BOMB, PASS, TRICK_WON, RAGEQUIT, DEAL, CALL, \
+                   ROUND_OVER, GAME, EXCHANGE, null_sink
+from player import Player, Hand, PassAction
+
+# Logging is set up by :func: `core.configure_logging 
+# <tichu.core.configure_logging>`, messages about the course of the game are 
+# logged at level *GAME_LEVEL*
+logger = logging.getLogger('tichu.' + __name__)
+
+#_Scoring_______________________________________________________________________
+
+# Points of each card, by card index (see :func: `combination.encode`), are 
+# defined in :mod: `tichu.core` as *points_by_index*.
+
+def card_points(cards) :
+    """ Return the sum of the points of *cards*. """
+    return sum(points_by_index[card_index(card)] for card in cards)
 
 #_Game__________________________________________________________________________
 
 class Game() :
-    pass
+    """ A full game of Tichu: rounds are played until a team reaches the 
+    *target* score. The game runs headless, every decision is taken by the 
+    :class: `Strategy <tichu.strategies.Strategy>` of the respective seat.
+    """
+    def __init__(self, strategies, seed=None, target=1000, max_rounds=100, 
+                 names=None, events=None, deals=None) :
+        """
+        ==========  ============================================================
+        strategies  list of 4 :class: `Strategy <tichu.strategies.Strategy>` 
+                    objects, in seat order. Seats 0 and 2 form team 0, seats 
+                    1 and 3 team 1.
+        seed        int or None; seed of the random number generator used for 
+                    dealing and by the strategies.
+        target      int; the game ends when a team reaches this score.
+        max_rounds  int; safety limit on the number of rounds.
+        names       list of 4 str; player names.
+        events      :class: `EventSink <tichu.events.EventSink>`; receives 
+                    the events of all tricks. Defaults to dropping them.
+        deals       iterator or None; yields the deck of every round (see 
+                    :class: `Round`), e.g. a :class: `DealStream 
+                    <tichu.dealing.DealStream>`. By default, decks are 
+                    shuffled with the game's random number generator.
+        ==========  ============================================================
+        """
+        self.strategies = strategies
+        self.events = events if events is not None else null_sink
+        self.deals = deals
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.target = target
+        self.max_rounds = max_rounds
+        if names is None :
+            names = ['Player {}'.format(i) for i in range(4)]
+        self.players = [Player(name) for name in names]
+        self.scores = [0, 0]
+        self.rounds = []
+
+    def play(self) :
+        """ Play rounds until the game is decided. Return the team scores. """
+        while not self.is_over() :
+            round_ = self.new_round()
+            self.end_round(round_, round_.play())
+        return self.scores
+
+    def new_round(self) :
+        """ Return the next :class: `Round`, not yet dealt. """
+        if not self.rounds :
+            self.events.emit(GAME, None, self.seed)
+        deck = next(self.deals) if self.deals is not None else None
+        return Round(self.players, self.strategies, rng=self.rng, 
+                     events=self.events, deck=deck)
+
+    def end_round(self, round_, round_scores) :
+        """ Add the finished *round_* and its *round_scores* to the game. """
+        self.rounds.append(round_)
+        for team in range(2) :
+            self.scores[team] += round_scores[team]
+        self.events.emit(ROUND_OVER, None, round_scores)
+        logger.log(GAME_LEVEL, 'Round %d: %s, total %s.', len(self.rounds), 
+                   round_scores, self.scores)
+
+    def is_over(self) :
+        """ The game is over when a team reached the *target* with a clear 
+        lead, or after *max_rounds* rounds.
+        """
+        if len(self.rounds) >= self.max_rounds : return True
+        return max(self.scores) >= self.target and \
+               self.scores[0] != self.scores[1]
+
+    @property
+    def winner(self) :
+        """ The index of the leading team, *None* on a tie. """
+        if self.scores[0] == self.scores[1] : return None
+        return 0 if self.scores[0] > self.scores[1] else 1
 
 #_Round_________________________________________________________________________
 
 class Round() :
-    pass
+    """ A single round: dealing, tichu calls, tricks until only one player is 
+    left with cards (or a team finishes first and second) and scoring.
+
+    Bombs are only played in turn and the wish of the Mahjongg is not 
+    enforced.
+    """
+    def __init__(self, players, strategies, rng=None, events=None, 
+                 deck=None) :
+        """
+        ==========  ============================================================
+        players     list of 4 :class: `Player <tichu.player.Player>` objects 
+                    in seat order.
+        strategies  list of 4 :class: `Strategy <tichu.strategies.Strategy>` 
+                    objects in seat order.
+        rng         :class: `random.Random` instance used for dealing.
+        events      :class: `EventSink <tichu.events.EventSink>`; receives 
+                    the events of all tricks. Defaults to dropping them.
+        deck        sequence of the 56 card indices in dealing order or None 
+                    to shuffle with *rng*. Seat *s* gets cards 14*s to 
+                    14*s+13, the first 8 of them before grand tichu calls.
+        ==========  ============================================================
+        """
+        self.players = players
+        self.deck = deck
+        self.events = events if events is not None else null_sink
+        self.strategies = strategies
+        self.rng = rng if rng is not None else random.Random()
+        self.seats = dict((player, seat) for seat, player in enumerate(players))
+        # Seats in the order they got rid of their cards
+        self.finished = []
+        # Tichu (100) and grand tichu (200) calls, per seat
+        self.calls = [0] * 4
+        # The cards every seat gave away in the exchange. Card *j* (0-2) went 
+        # to the seat *j*+1 places further.
+        self.pushes = [[] for seat in range(4)]
+        self.n_tricks = 0
+
+    @staticmethod
+    def team(seat) :
+        return seat % 2
+
+    @staticmethod
+    def partner(seat) :
+        return (seat + 2) % 4
+
+    def opponents(self, seat) :
+        return [s for s in range(4) if self.team(s) != self.team(seat)]
+
+    @property
+    def won_cards(self) :
+        """ Cards won in tricks, per seat. """
+        return [player.won_cards for player in self.players]
+
+    def is_active(self, seat) :
+        """ True if the player at *seat* still has cards. """
+        return len(self.players[seat].hand) > 0
+
+    def is_over(self) :
+        """ The round ends when one team finished first and second or only 
+        one player has cards left.
+        """
+        if len(self.finished) == 2 and \
+           self.team(self.finished[0]) == self.team(self.finished[1]) :
+            return True
+        return len(self.finished) >= 3
+
+    def deal(self) :
+        """ Shuffle (unless a deck was given) and deal 14 cards to each 
+        player, allowing grand tichu calls after the first 8 and tichu calls 
+        after all 14.
+        """
+        if self.deck is None :
+            deck = list(card_objects())
+            self.rng.shuffle(deck)
+        else :
+            cards_by_index = card_objects()
+            deck = [cards_by_index[i] for i in self.deck]
+        hands = [deck[14*i:14*(i+1)] for i in range(4)]
+        for seat, player in enumerate(self.players) :
+            player.hand = Hand(hands[seat][:8])
+            player.won_cards = []
+            if self.strategies[seat].call_grand_tichu(self, player) :
+                self.calls[seat] = 200
+        for seat, player in enumerate(self.players) :
+            player.hand.add(hands[seat][8:])
+            if not self.calls[seat] and \
+               self.strategies[seat].call_tichu(self, player) :
+                self.calls[seat] = 100
+        for player in self.players :
+            self.events.emit(DEAL, player, list(player.hand.cards))
+        for seat, player in enumerate(self.players) :
+            if self.calls[seat] :
+                self.events.emit(CALL, player, self.calls[seat])
+
+    def play(self) :
+        """ Play the round from dealing to scoring. Return the points of 
+        both teams.
+        """
+        self.deal()
+        self.exchange()
+        leader = self.first_leader()
+        while not self.is_over() :
+            leader = self.play_trick(leader)
+        return self.score()
+
+    def exchange(self) :
+        """ Every player gives one card to each other player, as chosen by 
+        :meth: `Strategy.push <tichu.strategies.Strategy.push>`. All players 
+        choose before any cards change hands.
+        """
+        pushes = []
+        for seat, player in enumerate(self.players) :
+            cards = list(self.strategies[seat].push(self, player))
+            indices = set(card_index(card) for card in cards)
+            if len(cards) != 3 or len(indices) != 3 or \
+               any(not player.hand.mask >> i & 1 for i in indices) :
+                raise ValueError('Invalid exchange by {}: {}'.format(
+                    player.name, cards))
+            pushes.append(cards)
+        self.pushes = pushes
+        for seat, cards in enumerate(pushes) :
+            self.players[seat].hand.discard(cards)
+        for seat, cards in enumerate(pushes) :
+            for offset, card in enumerate(cards, 1) :
+                self.players[(seat + offset) % 4].hand.add([card])
+            self.events.emit(EXCHANGE, self.players[seat], cards)
+
+    def first_leader(self) :
+        """ The seat holding the Mahjongg, which starts the round. """
+        for seat, player in enumerate(self.players) :
+            if player.hand.has_mahjongg :
+                return seat
+
+    def play_trick(self, leader) :
+        """ Play one trick, starting with the player at seat *leader*. Return 
+        the seat of the player to lead the next trick.
+        """
+        return self.finish_trick(self.start_trick(leader))
+
+    def finish_trick(self, trick) :
+        """ Let the strategies play *trick* from its current state until it 
+        or the round is over. Return the seat of the next leader.
+        """
+        while not trick.trick_finished() and not self.is_over() :
+            player = trick.players[0]
+            if len(player.hand) :
+                seat = self.seats[player]
+                action = self.strategies[seat].play(self, player, trick)
+                if not self.apply_action(trick, player, action) :
+                    raise ValueError('Invalid action by {}: {}'.format(
+                        player.name, action))
+                if self.is_over() : break
+            trick.rotate_players()
+        return self.end_trick(trick)
+
+    def start_trick(self, leader) :
+        """ Return a new :class: `Trick` led by the player at seat *leader*. 
+        """
+        self.n_tricks += 1
+        return Trick([self.players[(leader + i) % 4] for i in range(4)], 
+                     events=self.events)
+
+    def apply_action(self, trick, player, action) :
+        """ Let *player*, whose turn it is, take *action* on *trick*. Return 
+        *False* if the action is not allowed.
+        """
+        if not trick.handle_action(action, player) :
+            return False
+        if not len(player.hand) and self.seats[player] not in self.finished :
+            self.finished.append(self.seats[player])
+        return True
+
+    def end_trick(self, trick, receiver=None) :
+        """ Hand the cards of the finished *trick* to its winner or, if it 
+        was won with the dragon, to the opponent at seat *receiver*. If 
+        *receiver* is not given, the winner's strategy chooses. Return the 
+        seat of the player to lead the next trick.
+        """
+        winner = self.seats[trick.winner]
+        if trick.won_by_dragon :
+            if receiver is None :
+                receiver = self.strategies[winner].give_dragon(
+                    self, trick.winner, self.opponents(winner))
+            trick.resolve(self.players[receiver])
+        else :
+            trick.resolve()
+
+        leader = trick.next_leader()
+        return None if leader is None else self.seats[leader]
+
+    def score(self) :
+        """ Count the points of both teams at the end of the round. """
+        scores = [0, 0]
+        first = self.finished[0]
+        if len(self.finished) == 2 :
+            # Double victory
+            scores[self.team(first)] = 200
+        else :
+            # The last player hands the remaining cards to the opponents and 
+            # the won tricks to the first player to finish
+            last = [s for s in range(4) if s not in self.finished][0]
+            scores[1 - self.team(last)] += card_points(
+                self.players[last].hand.cards)
+            self.players[first].won_cards += self.players[last].won_cards
+            self.players[last].won_cards = []
+            for seat, player in enumerate(self.players) :
+                scores[self.team(seat)] += card_points(player.won_cards)
+
+        for seat, call in enumerate(self.calls) :
+            if call :
+                scores[self.team(seat)] += call if seat == first else -call
+        return scores
 
 #_Trick_________________________________________________________________________
 
 class Trick() :
-    # The type of combination that will be played in this trick
-    combo_type = None
-    # List keeping track of played combinations
-    played_combinations = []
-    # Set keeping track of players that have passed
-    passed = set()
-    # Track if anything happens that makes it impossible for this trick to 
-    # properly finish (e.g. ragequit of a player)
-    trick_unplayable = False
-
-    def __init__(self, players, starting_player=0) :
+    """ The state of a single trick. Only the highest combination is kept, 
+    plus optionally a bounded *history* of plays, so the memory of a trick 
+    does not grow with the number of moves.
+
+    The trick is finished when all other players that still have cards 
+    passed after the last play. The last player to play then wins the trick 
+    and collects its cards (:meth: `resolve`); :meth: `next_leader` tells 
+    who starts the next one.
+    """
+    __slots__ = ('players', 'turn_timeout', 'events', 'combo_type', 'top', 
+                 'top_rank', 'winner', 'passes', 'cards', 'history', 
+                 'trick_unplayable', 'trick_process')
+
+    def __init__(self, players, starting_player=0, turn_timeout=None, 
+                 events=None, history=0) :
         """
         ===============  =======================================================
         players          list of :class: `Player <tichu.player.Player>` 
                          objects; representing the players in their turn 
                          order.  
         starting_player  int; todo
+        turn_timeout     float or *None*; seconds a player has to act before 
+                         automatically passing. Wait indefinitely if *None*.
+        events           :class: `EventSink <tichu.events.EventSink>`; 
+                         receives plays, passes etc. Defaults to dropping 
+                         them, use a :class: `LoggingSink 
+                         <tichu.events.LoggingSink>` for readable output.
+        history          int; number of (player, combination) plays to keep 
+                         in *history*. 0 keeps none.
         ===============  =======================================================
         """
         self.players = players
-        self.trick_process = Process(target=self._trickloop)
+        self.turn_timeout = turn_timeout
+        self.events = events if events is not None else null_sink
+        # The type of combination that will be played in this trick
+        self.combo_type = None
+        # The highest combination played so far and the player who played it
+        self.top = None
+        self.winner = None
+        # The rank to beat. Differs from the rank of the highest combination 
+        # if that is a single phoenix.
+        self.top_rank = None
+        # Number of passes since the last play
+        self.passes = 0
+        # All cards played in this trick
+        self.cards = []
+        self.history = deque(maxlen=history) if history else None
+        # Track if anything happens that makes it impossible for this trick 
+        # to properly finish (e.g. ragequit of a player)
+        self.trick_unplayable = False
+        self.trick_process = None
 
     def start_trickloop(self) :
         logger.info('Starting trickloop.')
+        self.trick_process = Process(target=self._trickloop)
         self.trick_process.start()
 
     def _trickloop(self) :
         while not self.trick_finished() :
-            player = self.players[0]
+            self._trickloop_step()
 
-            action = self.prompt_to_play(player)
-            action_handled = self.handle_action(action, player)
-    
-            # Rotate to the next player
-            if action_handled :
-                self.rotate_players()
+    def _trickloop_step(self) :
+        """ One iteration of the trick loop: the current player acts. """
+        player = self.players[0]
+        # Players without cards are skipped
+        if not len(player.hand) :
+            self.rotate_players()
+            return
+
+        action = self.prompt_to_play(player)
+        action_handled = self.handle_action(action, player)
+
+        # Rotate to the next player
+        if action_handled :
+            self.rotate_players()
 
     def handle_action(self, action, player) :
         """ Determine what action was taken and respond appropriately. """
         if action.name == 'pass' :
-            logger.game('%s passes.', player.name)
-            # TODO Starting player may not pass.
-            # Add this player to the set off passing players
-            self.passed.add(player)
+            # Starting player may not pass.
+            if self.top is None :
+                logger.log(GAME_LEVEL, '%s has to play.', player.name)
+                return False
+            self.events.emit(PASS, player)
+            self.passes += 1
             return True
             
         elif action.name == 'play' :
-            logger.game('%s plays: %s.', player.name, action.combination)
-            # Remove the player from the set of passing players, if necessary
-            try :
-                self.passed.remove(player)
-            except KeyError :
-                pass
+            combination = action.combination
+            # Only cards from the player's hand can be played
+            if combination.mask & ~player.hand.mask :
+                logger.log(GAME_LEVEL, '%s does not hold %s.', player.name, 
+                           combination)
+                return False
             # Check if the player is allowed to play this combo
-            valid_play = self.check_valid_play(action.combination)
+            valid_play = self.check_valid_play(combination)
             if not valid_play :
-                logger.game('Play invalid: %s', action.combination)
+                logger.log(GAME_LEVEL, 'Play invalid: %s', combination)
                 return False
             else :
-                self.played_combinations.append(action.combination)
+                self.events.emit(BOMB if self.is_bomb(combination) else PLAY, 
+                                 player, combination)
+                self.top_rank = self.effective_rank(combination)
+                self.top = combination
+                self.winner = player
+                self.passes = 0
+                self.cards.extend(combination.cards)
+                if self.history is not None :
+                    self.history.append((player, combination))
+                player.hand.discard(combination)
                 return True
 
         elif action.name == 'ragequit' :
-            logger.game('%s ragequits.', player.name)
+            self.events.emit(RAGEQUIT, player)
             self.trick_unplayable = True
             return True
 
@@ -126,11 +461,11 @@ class Trick() :
         combo_type = combination.combo_type
         # If this is the first combination, set combo_type and exit
         if not self.combo_type :
-            self.comby_type = combo_type
+            self.combo_type = combo_type
+            return True
+        # Bombs can always be played, their strength is checked separately
+        elif self.is_bomb(combination) :
             return True
-        # TODO Special cases for bombs
-        elif combo_type in ['bomb', 'straight_bomb'] :
-            return False
         elif combo_type == self.combo_type :
             return True
         else :
@@ -140,42 +475,107 @@ class Trick() :
         """ Compare the strength of the played *combination* to the last played 
         one and return *True* if the new *combination* is stronger.
         """
-        try :
-            highest = self.played_combinations[-1]
-        except IndexError :
+        if self.top is None :
             # If nothing has been played, any combo is good enough
             return True
 
         # Bombs are automatically covered as they get a higher rank internally
-        logger.debug('%d > %d? %s', combination.rank, highest.rank, 
-                     combination.rank>highest.rank)
-        return combination.rank > highest.rank
+        return combination.rank > self.top_rank
+
+    def effective_rank(self, combination) :
+        """ The rank *combination* has when played onto this trick. A single 
+        phoenix is half a rank higher than the card it is played on.
+        """
+        if combination.N == 1 and combination.with_phoenix :
+            if self.top_rank is None : 
+                return rank_by_index[MAHJONGG] + 0.5
+            return self.top_rank + 0.5
+        return combination.rank
+
+    @staticmethod
+    def is_bomb(combination) :
+        return combination.combo_type == 'bomb' or \
+               combination.combo_type.endswith('straight_bomb')
+
+    def legal_plays(self, hand) :
+        """ Iterate over the plays from *hand* that can be played onto this 
+        trick.
+        """
+        if self.top is None :
+            return hand.legal_plays()
+        return hand.legal_plays(beating=self.top, rank=self.top_rank)
 
     def rotate_players(self, n=1) :
         for i in range(n) :
             self.players.append(self.players.pop(0))
 
+    def _is_single(self, index) :
+        """ True if the top of the trick is the single card *index*. """
+        return self.top is not None and self.top.mask == 1 << index
+
+    @property
+    def won_by_dragon(self) :
+        """ True if the trick is topped by the dragon, which means that it has 
+        to be given to an opponent.
+        """
+        return self._is_single(DRAGON)
+
     def trick_finished(self) :
         """ Check whether this trick is over, which is the case if:
-            1) All but the current *winning_player* passed or
-            2) The game is over
+            1) All but the current *winner* passed (players that are out of 
+               cards do not count) or
+            2) The dog was played or
+            3) Somebody ragequit.
         The dog is not counted as a separate trick but just implemented as a 
-        change in player order.
+        change in player order (see :meth: `next_leader`).
+        """
+        if self.trick_unplayable : return True
+        if self.winner is None : return False
+        if self._is_single(DOG) : return True
+        n_others = 0
+        for player in self.players :
+            if player is not self.winner and len(player.hand) :
+                n_others += 1
+        return self.passes >= n_others
+
+    def resolve(self, receiver=None) :
+        """ Hand the cards of this trick to *receiver* (defaults to the 
+        *winner*) and return them.
         """
-        return False or self.trick_unplayable
+        if receiver is None :
+            receiver = self.winner
+        receiver.won_cards.extend(self.cards)
+        self.events.emit(TRICK_WON, self.winner, self.cards)
+        return self.cards
+
+    def next_leader(self) :
+        """ Return the player that leads the next trick: the winner or, if 
+        the dog was played, the winner's partner. If that player has no 
+        cards left, the lead goes on to the next player holding cards. 
+        Returns *None* if nobody has cards left.
+        """
+        n = len(self.players)
+        start = self.players.index(self.winner)
+        if self._is_single(DOG) :
+            start += n // 2
+        for i in range(n) :
+            player = self.players[(start + i) % n]
+            if len(player.hand) :
+                return player
+        return None
 
     def prompt_to_play(self, player) :
-        """ Query the next action of the current player. """
-        player.release_play_lock()
-        query_interval = 0.03 #s
-        while True :
-            action = player.next_action
-            if action is None :
-                time.sleep(query_interval)
-                continue
-            # If an action was found lock the player and reset her 'next_action'
-            player.close_play_lock()
-            player.next_action = None
-            return action
-            
+        """ Query the next action of the current player. Blocks until the 
+        player acts or *turn_timeout* runs out, in which case the player passes.
+        """
+        channel = player.actions
+        channel.open()
+        try :
+            action = channel.receive(self.turn_timeout)
+        finally :
+            channel.close()
+        if action is None :
+            logger.log(GAME_LEVEL, '%s ran out of time.', player.name)
+            action = PassAction()
+        return action
 
@@ -0,0 +1,223 @@
+"""
+Opt-in counters and latency histograms for the hot paths of the engine.
+
+Instrumentation is off by default and then costs nothing: :func: `enable`
+wraps the measured methods with timing versions and :func: `disable` puts
+the originals back, so the engine itself contains no checks.
+
+=========================  =====================================================
+metric                     measures
+=========================  =====================================================
+combination.<combo type>   construction of a :class: `Combination
+                           <tichu.combination.Combination>`, by type;
+                           ``combination.invalid`` for rejected card sets
+trick.check_valid_play     :meth: `Trick.check_valid_play
+                           <tichu.game.Trick.check_valid_play>`
+trick.loop                 one iteration of the threaded trick loop
+trick.prompt               time spent waiting for a player in :meth:
+                           `Trick.prompt_to_play
+                           <tichu.game.Trick.prompt_to_play>`
+round.move                 applying a move in a headless round
+round.trick                finishing a trick in a headless round
+=========================  =====================================================
+
+Every metric counts its calls and sorts their durations into a histogram
+with power of two buckets (in nanoseconds). :func: `snapshot` returns all
+metrics together with the moves and tricks per second since instrumentation
+was enabled; :func: `start_dump` appends a snapshot to a file as one JSON
+line every few seconds::
+
+    instrumentation.enable()
+    instrumentation.start_dump('metrics.jsonl', interval=10)
+    simulate(strategies, 1000)
+    print(instrumentation.snapshot()['rates'])
+
+Metrics are kept per process: worker processes started while instrumentation
+is enabled measure into their own copy.
+"""
+import functools
+import json
+import logging
+import threading
+import time
+
+from combination import Combination
+from game import Round, Trick
+
+logger = logging.getLogger('tichu.' + __name__)
+
+N_BUCKETS = 64
+
+class Histogram() :
+    """ Count and durations of the calls of one metric. Bucket *i* holds the
+    durations of *2**(i-1)* up to *2**i* nanoseconds.
+    """
+    __slots__ = ('count', 'total', 'maximum', 'buckets')
+
+    def __init__(self) :
+        self.count = 0
+        self.total = 0
+        self.maximum = 0
+        self.buckets = [0] * N_BUCKETS
+
+    def add(self, nanoseconds) :
+        self.count += 1
+        self.total += nanoseconds
+        if nanoseconds > self.maximum :
+            self.maximum = nanoseconds
+        self.buckets[min(nanoseconds.bit_length(), N_BUCKETS - 1)] += 1
+
+    def quantile(self, q) :
+        """ Upper bound of the *q* quantile, in nanoseconds. """
+        target = q * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets) :
+            seen += n
+            if n and seen >= target :
+                return min(1 << i, self.maximum)
+        return self.maximum
+
+    def as_dict(self) :
+        return {'count' : self.count,
+                'mean_ns' : self.total / self.count if self.count else 0.,
+                'p50_ns' : self.quantile(0.5), 'p99_ns' : self.quantile(0.99),
+                'max_ns' : self.maximum,
+                'buckets' : dict((i, n) for i, n in enumerate(self.buckets)
+                                 if n)}
+
+class Metrics() :
+    """ A registry of :class: `Histogram` objects by name. """
+    def __init__(self) :
+        self.histograms = {}
+        self.started = time.time()
+
+    def histogram(self, name) :
+        try :
+            return self.histograms[name]
+        except KeyError :
+            histogram = self.histograms[name] = Histogram()
+            return histogram
+
+    def count(self, name) :
+        histogram = self.histograms.get(name)
+        return histogram.count if histogram is not None else 0
+
+    def reset(self) :
+        self.histograms = {}
+        self.started = time.time()
+
+    def snapshot(self) :
+        """ All metrics as a dict that can be written as JSON. """
+        now = time.time()
+        elapsed = now - self.started
+        rates = {}
+        for rate, name in (('moves_per_sec', 'round.move'),
+                           ('tricks_per_sec', 'round.trick')) :
+            rates[rate] = self.count(name) / elapsed if elapsed else 0.
+        # A copy, as the dump thread may run while metrics are added
+        histograms = sorted(dict(self.histograms).items())
+        return {'time' : now, 'elapsed' : elapsed, 'rates' : rates,
+                'metrics' : dict((name, histogram.as_dict())
+                                 for name, histogram in histograms)}
+
+metrics = Metrics()
+
+#_Wrapping______________________________________________________________________
+
+def _timed(function, name) :
+    @functools.wraps(function)
+    def timed(*args, **kwargs) :
+        start = time.perf_counter_ns()
+        try :
+            return function(*args, **kwargs)
+        finally :
+            metrics.histogram(name).add(time.perf_counter_ns() - start)
+    return timed
+
+def _timed_combination(new) :
+    @functools.wraps(new)
+    def timed(cls, cards) :
+        start = time.perf_counter_ns()
+        try :
+            combination = new(cls, cards)
+        except ValueError :
+            metrics.histogram('combination.invalid').add(
+                time.perf_counter_ns() - start)
+            raise
+        metrics.histogram('combination.' + combination.combo_type).add(
+            time.perf_counter_ns() - start)
+        return combination
+    return timed
+
+# (class, attribute, metric name) of the timed methods
+_targets = [(Trick, 'check_valid_play', 'trick.check_valid_play'),
+            (Trick, '_trickloop_step', 'trick.loop'),
+            (Trick, 'prompt_to_play', 'trick.prompt'),
+            (Round, 'apply_action', 'round.move'),
+            (Round, 'end_trick', 'round.trick')]
+
+# The original methods while instrumentation is enabled
+_originals = {}
+
+def is_enabled() :
+    return bool(_originals)
+
+def enable(reset=True) :
+    """ Start measuring. With *reset*, earlier measurements are dropped. """
+    if reset :
+        metrics.reset()
+    if is_enabled() : return
+    for cls, attribute, name in _targets :
+        original = cls.__dict__[attribute]
+        _originals[cls, attribute] = original
+        setattr(cls, attribute, _timed(original, name))
+    new = Combination.__dict__['__new__']
+    _originals[Combination, '__new__'] = new
+    Combination.__new__ = staticmethod(_timed_combination(new))
+
+def disable() :
+    """ Stop measuring and restore the original methods. The measurements
+    are kept.
+    """
+    for (cls, attribute), original in _originals.items() :
+        setattr(cls, attribute, original)
+    _originals.clear()
+
+def snapshot() :
+    return metrics.snapshot()
+
+#_Dumping_______________________________________________________________________
+
+_dumper = None
+
+def dump(path) :
+    """ Append a snapshot to the file at *path* as one JSON line. """
+    with open(path, 'a') as f :
+        f.write(json.dumps(snapshot()) + '\n')
+
+def start_dump(path, interval=10.) :
+    """ Dump a snapshot to *path* every *interval* seconds from a background
+    thread, until :func: `stop_dump` is called.
+    """
+    global _dumper
+    stop_dump()
+    stop = threading.Event()
+    def run() :
+        while not stop.wait(interval) :
+            try :
+                dump(path)
+            except OSError as e :
+                logger.warning('Could not dump metrics: %s', e)
+    thread = threading.Thread(target=run, name='metrics-dump', daemon=True)
+    thread.start()
+    _dumper = (thread, stop, path)
+
+def stop_dump() :
+    """ Stop the periodic dump, writing a last snapshot. """
+    global _dumper
+    if _dumper is None : return
+    thread, stop, path = _dumper
+    stop.set()
+    thread.join()
+    _dumper = None
+    dump(path)
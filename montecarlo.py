@@ -0,0 +1,263 @@
+"""
+A bot that chooses its moves by information set Monte Carlo.
+
+At every decision, the cards the bot cannot see (all cards that are neither
+in its hand nor played yet) are dealt at random to the other players,
+respecting how many cards each of them holds. The cards the bot pushed in
+the exchange stay with their receivers. Every such *determinization*
+is played to the end of the round once for each candidate move by a fast
+headless policy (:class: `GreedyStrategy <tichu.strategies.GreedyStrategy>`
+by default). The move with the best average round score difference for the
+bot's team is played.
+
+All candidates are evaluated on the same determinizations, which makes
+their comparison much less noisy than independent samples. Rollouts are
+spread over a pool of worker processes and stop when the per-move time
+budget is used up.
+"""
+import logging
+import multiprocessing
+import os
+import random
+import time
+
+from combination import Combination, card_objects, card_index
+from core import N_CARDS
+from game import Round, Trick
+from player import Player, Hand, PassAction, PlayAction
+from strategies import Strategy, GreedyStrategy
+
+logger = logging.getLogger('tichu.' + __name__)
+
+def _indices(cards) :
+    return [card_index(card) for card in cards]
+
+def _cards(indices) :
+    cards_by_index = card_objects()
+    return [cards_by_index[i] for i in indices]
+
+class Situation() :
+    """ What the player at *seat* knows about a running round, stored as
+    card indices such that it can be sent to worker processes.
+    """
+    def __init__(self, round_, player, trick) :
+        seats = round_.seats
+        self.seat = seats[player]
+        self.hand = _indices(player.hand.cards)
+        self.hand_sizes = [len(p.hand) for p in round_.players]
+        self.won_cards = [_indices(p.won_cards) for p in round_.players]
+        self.finished = list(round_.finished)
+        self.calls = list(round_.calls)
+        # The trick, with players given by seat in turn order
+        self.order = [seats[p] for p in trick.players]
+        self.combo_type = trick.combo_type
+        self.top = None if trick.top is None else _indices(trick.top.cards)
+        self.top_rank = trick.top_rank
+        self.winner = None if trick.winner is None else seats[trick.winner]
+        self.passes = trick.passes
+        self.trick_cards = _indices(trick.cards)
+
+        known = set(self.hand).union(self.trick_cards, *self.won_cards)
+        self.unseen = [i for i in range(N_CARDS)
+                       if i not in known]
+        # The cards this player pushed are with their receivers, unless 
+        # they were played since
+        self.pushed = [[] for seat in range(4)]
+        for offset, i in enumerate(_indices(round_.pushes[self.seat]), 1) :
+            if i not in known :
+                self.pushed[(self.seat + offset) % 4].append(i)
+
+    def sample(self, rng, strategies) :
+        """ Return a determinization as a (round, trick, player) tuple: the
+        cards pushed by the player stay with their receivers, the other
+        unseen cards are dealt randomly to the other players. The round is
+        played by *strategies*.
+        """
+        pushed = set().union(*self.pushed)
+        unseen = [i for i in self.unseen if i not in pushed]
+        rng.shuffle(unseen)
+        players = []
+        for seat in range(4) :
+            player = Player('Seat {}'.format(seat))
+            if seat == self.seat :
+                hand = self.hand
+            else :
+                n = self.hand_sizes[seat] - len(self.pushed[seat])
+                hand = self.pushed[seat] + unseen[:n]
+                del unseen[:n]
+            player.hand = Hand(_cards(hand))
+            player.won_cards = _cards(self.won_cards[seat])
+            players.append(player)
+
+        round_ = Round(players, strategies, rng=rng)
+        round_.finished = list(self.finished)
+        round_.calls = list(self.calls)
+        trick = Trick([players[seat] for seat in self.order])
+        trick.combo_type = self.combo_type
+        if self.top is not None :
+            trick.top = Combination(_cards(self.top))
+            trick.top_rank = self.top_rank
+            trick.winner = players[self.winner]
+        trick.passes = self.passes
+        trick.cards = _cards(self.trick_cards)
+        return round_, trick, players[self.seat]
+
+def rollout(situation, candidate, seed, strategies) :
+    """ Play *candidate* (card indices or *None* for passing) in a
+    determinization of *situation* drawn with *seed* and let *strategies*
+    finish the round. Return the score difference for the team of the
+    player.
+    """
+    rng = random.Random(seed)
+    round_, trick, player = situation.sample(rng, strategies)
+    if candidate is None :
+        action = PassAction()
+    else :
+        action = PlayAction(Combination(_cards(candidate)))
+    if not round_.apply_action(trick, player, action) :
+        raise ValueError('Invalid candidate {}.'.format(candidate))
+    trick.rotate_players()
+    leader = round_.finish_trick(trick)
+    while not round_.is_over() :
+        leader = round_.play_trick(leader)
+    scores = round_.score()
+    team = round_.team(situation.seat)
+    return scores[team] - scores[1 - team]
+
+def run_rollouts(situation, candidates, seeds, deadline, strategies) :
+    """ Evaluate all *candidates* on the determinizations given by *seeds*
+    until the time (:func: `time.time`) passes *deadline*. Return the score
+    sums per candidate and the number of determinizations used.
+    """
+    sums = [0] * len(candidates)
+    n = 0
+    for seed in seeds :
+        if deadline is not None and time.time() > deadline :
+            break
+        for i, candidate in enumerate(candidates) :
+            sums[i] += rollout(situation, candidate, seed, strategies)
+        n += 1
+    return sums, n
+
+def _run_rollouts(args) :
+    return run_rollouts(*args)
+
+class MonteCarloStrategy(Strategy) :
+    """ Choose plays by information set Monte Carlo (see the module
+    docstring).
+
+    ===============  ===========================================================
+    time_budget      float or None; seconds per move. Without a budget, all
+                     *n_rollouts* determinizations are played.
+    n_rollouts       int; maximum number of determinizations per move.
+    processes        int or None; number of worker processes (None: one per
+                     core). With 1, rollouts run in the calling process.
+    policy           :class: `Strategy <tichu.strategies.Strategy>` playing
+                     all seats during rollouts.
+    max_candidates   int; number of moves that are compared. Passing and the
+                     lowest plays of each combo type are preferred.
+    ===============  ===========================================================
+
+    *rollouts* and *seconds* count the rollouts (one per determinization
+    and candidate) and the time spent on them over all moves,
+    :attr: `rollouts_per_sec` is their ratio.
+    Without a time budget, results are reproducible from the round's seed.
+    """
+    def __init__(self, time_budget=0.5, n_rollouts=200, processes=1,
+                 policy=GreedyStrategy(), max_candidates=8) :
+        self.time_budget = time_budget
+        self.n_rollouts = n_rollouts
+        self.processes = processes
+        self.policy = policy
+        self.max_candidates = max_candidates
+        self.rollouts = 0
+        self.seconds = 0.
+        self._pool = None
+        self._n_workers = 0
+
+    def __getstate__(self) :
+        # Pools cannot be pickled, every process creates its own
+        state = self.__dict__.copy()
+        state['_pool'] = None
+        return state
+
+    @property
+    def pool(self) :
+        if self._pool is None :
+            self._n_workers = self.processes or os.cpu_count() or 1
+            self._pool = multiprocessing.Pool(self._n_workers)
+        return self._pool
+
+    def close(self) :
+        """ Shut down the worker processes. """
+        if self._pool is not None :
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    @property
+    def rollouts_per_sec(self) :
+        return self.rollouts / self.seconds if self.seconds else 0.
+
+    def candidates(self, player, trick) :
+        """ The moves to compare: passing if allowed, then the lowest plays
+        of each combo type, as lists of card indices (*None* for passing).
+        """
+        by_type = {}
+        for combination in trick.legal_plays(player.hand) :
+            plays = by_type.setdefault(combination.combo_type, [])
+            plays.append(combination)
+        candidates = [None] if trick.top is not None else []
+        # Round robin over the combo types, lowest plays first
+        queues = [sorted(plays, key=lambda c : c.rank)
+                  for plays in by_type.values()]
+        while queues and len(candidates) < self.max_candidates :
+            for queue in queues :
+                if len(candidates) < self.max_candidates :
+                    candidates.append(_indices(queue.pop(0).cards))
+            queues = [queue for queue in queues if queue]
+        return candidates
+
+    def evaluate(self, situation, candidates, seed) :
+        """ Return the average score difference of every candidate and the
+        number of determinizations used.
+        """
+        strategies = [self.policy] * 4
+        deadline = None
+        if self.time_budget is not None :
+            deadline = time.time() + self.time_budget
+        rng = random.Random(seed)
+        seeds = [rng.getrandbits(64) for i in range(self.n_rollouts)]
+
+        if self.processes == 1 :
+            sums, n = run_rollouts(situation, candidates, seeds, deadline,
+                                   strategies)
+        else :
+            pool = self.pool
+            n_workers = self._n_workers
+            tasks = [(situation, candidates, seeds[w::n_workers], deadline,
+                      strategies) for w in range(n_workers)]
+            sums, n = [0] * len(candidates), 0
+            for worker_sums, worker_n in pool.map(_run_rollouts, tasks) :
+                sums = [a + b for a, b in zip(sums, worker_sums)]
+                n += worker_n
+        return [s / n if n else 0. for s in sums], n
+
+    def play(self, round_, player, trick) :
+        candidates = self.candidates(player, trick)
+        if len(candidates) == 1 :
+            choice = candidates[0]
+        else :
+            start = time.perf_counter()
+            situation = Situation(round_, player, trick)
+            values, n = self.evaluate(situation, candidates,
+                                      round_.rng.getrandbits(64))
+            seconds = time.perf_counter() - start
+            self.rollouts += n * len(candidates)
+            self.seconds += seconds
+            logger.debug('%s: %d rollouts of %d candidates in %.3f s.',
+                         player.name, n, len(candidates), seconds)
+            choice = candidates[values.index(max(values))]
+        if choice is None :
+            return PassAction()
+        return PlayAction(Combination(_cards(choice)))
@@ -0,0 +1,251 @@
+"""
+Enumeration of the legal plays a set of cards allows.
+
+Instead of trying every subset of a hand (a 14 card hand has 16k of them),
+the cards are grouped by rank and candidate combinations are only built
+along the rank patterns a combo type requires. Results are kept in an index
+by combo type and sorted by rank, such that finding all plays that beat a
+given combination only touches the matching combo type and the bombs.
+"""
+import bisect
+import itertools
+import logging
+
+from combination import Combination, PHOENIX, encode, card_index, \
+                        card_objects, suit_masks
+
+logger = logging.getLogger('tichu.' + __name__)
+
+# Ranks that can be part of pairs, triplets, full houses and straights of
+# pairs (the Mahjongg, Dog and Dragon exist only once)
+_multiple_ranks = range(2, 15)
+# Ranks that can be part of a straight (the Mahjongg counts as a 1)
+_straight_ranks = range(1, 15)
+
+def _parse_combo_type(combo_type) :
+    """ Split a *combo_type* like '6-straight' into ('straight', 6). Combo
+    types without a length give a length of *None*.
+    """
+    length, sep, name = combo_type.partition('-')
+    if sep :
+        return name, int(length)
+    return combo_type, None
+
+class PlayIndex() :
+    """ Lazily built index of all legal plays for a collection of cards. The
+    plays of each combo type are only enumerated when they are first asked
+    for.
+
+    =====  ====================================================================
+    cards  list of :class: `Card <cards.deck.Card>` objects.
+    =====  ====================================================================
+    """
+    # All combo types a hand of up to 14 cards can hold
+    combo_types = (['single', 'pair', 'triplet', 'full_house'] +
+                   ['{}-straight'.format(n) for n in range(5, 15)] +
+                   ['{}-straight_of_pairs'.format(n) for n in range(4, 15, 2)] +
+                   ['bomb'] +
+                   ['{}-straight_bomb'.format(n) for n in range(5, 14)])
+
+    bomb_types = ['bomb'] + ['{}-straight_bomb'.format(n)
+                             for n in range(5, 14)]
+
+    def __init__(self, cards) :
+        self.cards = list(cards)
+        self.mask, self.histogram = encode(self.cards)
+        # Group the cards by rank (0-15), keeping the phoenix aside
+        self.phoenix = None
+        self.by_rank = [[] for i in range(16)]
+        for card in self.cards :
+            if card_index(card) == PHOENIX :
+                self.phoenix = card
+            else :
+                self.by_rank[card.rank].append(card)
+        self.with_phoenix = self.phoenix is not None
+        # combo_type -> (list of ranks, list of combinations), sorted by rank
+        self._index = {}
+
+    def plays(self, combo_type) :
+        """ Return the list of all plays of the given *combo_type*, sorted by
+        rank.
+        """
+        try :
+            return self._index[combo_type][1]
+        except KeyError :
+            pass
+        name, length = _parse_combo_type(combo_type)
+        builder = getattr(self, '_build_{}'.format(name), None)
+        if builder is None :
+            raise ValueError('Unknown combo type: {}'.format(combo_type))
+
+        # Only keep valid combinations of the requested type, dropping
+        # duplicate card sets
+        plays = []
+        seen = set()
+        for cards in builder(length) :
+            try :
+                combination = Combination(list(cards))
+            except ValueError :
+                continue
+            if combination.combo_type != combo_type : continue
+            if combination.mask in seen : continue
+            seen.add(combination.mask)
+            plays.append(combination)
+        plays.sort(key=lambda combination : combination.rank)
+        self._index[combo_type] = ([c.rank for c in plays], plays)
+        return plays
+
+    def higher(self, combo_type, rank) :
+        """ Return all plays of *combo_type* with a rank above *rank*. """
+        plays = self.plays(combo_type)
+        ranks = self._index[combo_type][0]
+        return plays[bisect.bisect_right(ranks, rank):]
+
+    def all_plays(self) :
+        """ Iterate over every legal play, grouped by combo type. """
+        for combo_type in self.combo_types :
+            for combination in self.plays(combo_type) :
+                yield combination
+
+    def beating(self, combination, rank=None) :
+        """ Iterate over all plays that beat *combination*: higher plays of
+        the same combo type and all bombs that are stronger. *rank* replaces
+        the rank of *combination* if given.
+        """
+        if rank is None :
+            rank = combination.rank
+        combo_type = combination.combo_type
+        if combo_type not in self.bomb_types :
+            for play in self.higher(combo_type, rank) :
+                yield play
+        # Bombs beat all regular combinations. Among bombs the internal rank
+        # offsets take care of the ordering.
+        for bomb_type in self.bomb_types :
+            for play in self.higher(bomb_type, rank) :
+                yield play
+
+    #_Builders__________________________________________________________________
+    # Each builder yields candidate card tuples for a combo type. Candidates
+    # are classified by *plays*, so they may overshoot.
+
+    def _build_single(self, length=None) :
+        for card in self.cards :
+            yield (card,)
+
+    def _build_pair(self, length=None) :
+        return self._n_of_a_kind(2)
+
+    def _build_triplet(self, length=None) :
+        return self._n_of_a_kind(3)
+
+    def _build_bomb(self, length=None) :
+        for rank in _multiple_ranks :
+            if len(self.by_rank[rank]) == 4 :
+                yield tuple(self.by_rank[rank])
+
+    def _n_of_a_kind(self, n, rank=None) :
+        """ Yield all sets of *n* cards of equal rank, using the phoenix as
+        a substitute for one of them. Restrict to *rank* if given.
+        """
+        ranks = _multiple_ranks if rank is None else [rank]
+        for rank in ranks :
+            cards = self.by_rank[rank]
+            for natural in itertools.combinations(cards, n) :
+                yield natural
+            if self.with_phoenix :
+                for natural in itertools.combinations(cards, n-1) :
+                    yield natural + (self.phoenix,)
+
+    def _build_full_house(self, length=None) :
+        for triplet_rank in _multiple_ranks :
+            triplets = list(self._n_of_a_kind(3, triplet_rank))
+            if not triplets : continue
+            for pair_rank in _multiple_ranks :
+                if pair_rank == triplet_rank : continue
+                for pair in self._n_of_a_kind(2, pair_rank) :
+                    for triplet in triplets :
+                        # The phoenix can only be used once
+                        if self.phoenix in pair and self.phoenix in triplet :
+                            continue
+                        yield triplet + pair
+
+    def _build_straight(self, length) :
+        return self._runs(length, 1, _straight_ranks)
+
+    def _build_straight_of_pairs(self, length) :
+        return self._runs(length // 2, 2, _multiple_ranks)
+
+    def _runs(self, n_ranks, width, ranks) :
+        """ Yield all runs of *n_ranks* subsequent ranks with *width* cards
+        each. The phoenix may take the place of one card.
+        """
+        lo, hi = ranks[0], ranks[-1]
+        for start in range(lo, hi - n_ranks + 2) :
+            window = range(start, start + n_ranks)
+            # Without the phoenix, and with the phoenix at every position
+            for phoenix_at in [None] + list(window) :
+                if phoenix_at is not None and not self.with_phoenix : break
+                options = []
+                for rank in window :
+                    if rank == phoenix_at :
+                        groups = [g + (self.phoenix,) for g in
+                                  itertools.combinations(self.by_rank[rank],
+                                                         width-1)]
+                    else :
+                        groups = list(itertools.combinations(
+                            self.by_rank[rank], width))
+                    if not groups : break
+                    options.append(groups)
+                else :
+                    for groups in itertools.product(*options) :
+                        yield sum(groups, ())
+
+    def _build_straight_bomb(self, length) :
+        # Only look at runs within each suit. Within a suit, card indices 
+        # follow the ranks, so runs are found on the bits of the mask.
+        for suit, suit_mask in enumerate(suit_masks) :
+            bits = (self.mask & suit_mask) >> (13 * suit)
+            starts = bits
+            for i in range(1, length) :
+                starts &= bits >> i
+            while starts :
+                low = starts & -starts
+                first = 13 * suit + low.bit_length() - 1
+                yield tuple(card_objects()[first:first + length])
+                starts ^= low
+
+def legal_plays(cards, beating=None, rank=None) :
+    """ Iterate over all legal plays that can be made with *cards*. If
+    *beating* is given, only plays that beat that :class: `Combination
+    <tichu.combination.Combination>` (or *rank*, if given) are produced.
+    """
+    index = PlayIndex(cards)
+    if beating is None :
+        return index.all_plays()
+    else :
+        return index.beating(beating, rank)
+
+
+# Testing
+if __name__ == '__main__' :
+    # Compare the generated plays with classifying every subset of random 
+    # hands, which always hold the Phoenix and often the Mahjongg
+    import random
+    from combination import MAHJONGG, classify, histogram_of
+    rng = random.Random(0)
+    for k in range(50) :
+        indices = rng.sample([i for i in range(56) if i != PHOENIX], 13)
+        if k % 2 and MAHJONGG not in indices : indices[0] = MAHJONGG
+        indices.append(PHOENIX)
+        masks = [1 << i for i in indices]
+        generated = set(play.mask for play in 
+                        PlayIndex([card_objects()[i] for i in indices])
+                        .all_plays())
+        subsets = set()
+        for s in range(1, 1 << len(masks)) :
+            mask = sum(m for j, m in enumerate(masks) if s >> j & 1)
+            if classify(mask, histogram_of(mask)) is not None :
+                subsets.add(mask)
+        assert generated == subsets, (indices, 
+                                      [hex(m) for m in subsets ^ generated])
+    print('PlayIndex agrees with the classifier on 50 hands.')
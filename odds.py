@@ -0,0 +1,369 @@
+"""
+Precomputed odds of the final hand, given the first 8 cards.
+
+Grand tichu calls are made after seeing 8 of the 14 cards. What matters is
+what the other 6 can bring: bombs, the Dragon, the Phoenix and, overall, how
+many plays the hand will need (see :func: `decomposition.min_plays
+<tichu.decomposition.min_plays>`). These odds only depend on the ranks of
+the 8 cards, except for straight bombs, which depend on the suits. They are
+therefore tabulated once:
+
+==============  ================================================================
+table           content
+==============  ================================================================
+suit runs       for every 13 bit pattern of cards held in one suit and every
+                number *j* of further cards of that suit, the number of ways
+                to draw them such that the suit holds no straight bomb
+                (exact).
+rank patterns   for every rank pattern of 8 cards (Dog, Mahjongg, 2-A,
+                Dragon, Phoenix), the probability of a four of a kind
+                (exact) and the expected number of plays of the 14 cards
+                (sampled, not counting straight bombs).
+==============  ================================================================
+
+Tables are built offline by :func: `build` (or ``python odds.py build``)
+and written as little endian binary arrays behind a small header. An
+:class: `OddsTable` maps the file into memory and answers queries by
+direct indexing, so loading costs next to nothing and pages are only read
+when they are used::
+
+    table = OddsTable('odds.tbl')
+    odds = table.query(player.hand.cards)
+    if odds.plays < 6 and odds.bomb > 0.2 : ...
+"""
+import argparse
+import logging
+import math
+import mmap
+import multiprocessing
+import numbers
+import random
+import struct
+import sys
+from array import array
+from collections import namedtuple
+
+from combination import PHOENIX, DRAGON, N_CARDS, card_index, rank_by_index
+import decomposition
+
+logger = logging.getLogger('tichu.' + __name__)
+
+MAGIC = b'TICHODD\x01'
+# Magic, number of rank patterns, samples per pattern, seed
+HEADER = struct.Struct('<8sIIQ4x')
+
+SEEN = 8
+DRAWN = 6
+UNSEEN = N_CARDS - SEEN
+# Values per rank pattern: four of a kind probability, expected plays
+N_VALUES = 2
+
+_little_endian = sys.byteorder == 'little'
+
+Odds = namedtuple('Odds', ['bomb', 'straight_bomb', 'dragon', 'phoenix',
+                           'plays'])
+Odds.__doc__ = """ Odds of the 14 card hand: probabilities of holding a four
+of a kind, a straight bomb, the Dragon and the Phoenix, and the expected
+number of plays.
+"""
+
+#_Rank_patterns_________________________________________________________________
+
+# A rank pattern counts the cards of every slot: Dog, Mahjongg, the ranks 2 to
+# A, Dragon and Phoenix
+N_SLOTS = 17
+_slot_sizes = (1, 1) + (4,) * 13 + (1, 1)
+_slot_by_index = tuple(16 if i == PHOENIX else int(rank_by_index[i])
+                       for i in range(N_CARDS))
+
+def _pattern_offsets() :
+    """ Return *ways* and *offsets* for ranking patterns: ways[i][t] counts
+    the fillings of the slots *i* and up with *t* cards, offsets[i][t][c]
+    the ones with fewer than *c* cards in slot *i*.
+    """
+    ways = [[0] * (SEEN + 1) for i in range(N_SLOTS + 1)]
+    ways[N_SLOTS][0] = 1
+    for i in reversed(range(N_SLOTS)) :
+        for t in range(SEEN + 1) :
+            ways[i][t] = sum(ways[i+1][t-c]
+                             for c in range(min(t, _slot_sizes[i]) + 1))
+    offsets = [[[0] * (_slot_sizes[i] + 2) for t in range(SEEN + 1)]
+               for i in range(N_SLOTS)]
+    for i in range(N_SLOTS) :
+        for t in range(SEEN + 1) :
+            for c in range(_slot_sizes[i] + 1) :
+                below = ways[i+1][t-c] if c <= t else 0
+                offsets[i][t][c+1] = offsets[i][t][c] + below
+    return ways, offsets
+
+_ways, _offsets = _pattern_offsets()
+N_PATTERNS = _ways[0][SEEN]
+
+def pattern_of(indices) :
+    """ The rank pattern (cards per slot) of the given card indices. """
+    pattern = [0] * N_SLOTS
+    for i in indices :
+        pattern[_slot_by_index[i]] += 1
+    return pattern
+
+def rank_pattern(pattern) :
+    """ The position of *pattern* in the rank pattern table. """
+    position = 0
+    t = SEEN
+    for i, c in enumerate(pattern) :
+        position += _offsets[i][t][c]
+        t -= c
+    return position
+
+def unrank_pattern(position) :
+    """ The inverse of :func: `rank_pattern`. """
+    pattern = []
+    t = SEEN
+    for i in range(N_SLOTS) :
+        offsets = _offsets[i][t]
+        c = 0
+        while c < _slot_sizes[i] and position >= offsets[c+1] :
+            c += 1
+        position -= offsets[c]
+        pattern.append(c)
+        t -= c
+    return pattern
+
+#_Generation____________________________________________________________________
+
+def _four_of_a_kind_ways(counts) :
+    """ The number of ways to draw the remaining cards such that one of the
+    regular ranks, held *counts* times, is completed.
+    """
+    # Drawn cards so far -> [ways without, ways with a completed rank]
+    state = [[0, 0] for k in range(DRAWN + 1)]
+    state[0][0] = 1
+    for c in counts :
+        unseen = 4 - c
+        new = [[0, 0] for k in range(DRAWN + 1)]
+        for k in range(DRAWN + 1) :
+            for done in range(2) :
+                if not state[k][done] : continue
+                for j in range(min(unseen, DRAWN - k) + 1) :
+                    new[k+j][done or j == unseen] += \
+                        state[k][done] * math.comb(unseen, j)
+        state = new
+    # The rest are special cards
+    unseen_specials = UNSEEN - sum(4 - c for c in counts)
+    return sum(state[k][1] * math.comb(unseen_specials, DRAWN - k)
+               for k in range(DRAWN + 1))
+
+_bomb_cache = {}
+
+def bomb_probability(pattern) :
+    """ Exact probability of a four of a kind among the 14 cards, given the
+    rank *pattern* of the first 8.
+    """
+    counts = tuple(sorted(pattern[2:15]))
+    if counts not in _bomb_cache :
+        _bomb_cache[counts] = _four_of_a_kind_ways(counts) / \
+                              math.comb(UNSEEN, DRAWN)
+    return _bomb_cache[counts]
+
+def expected_plays(pattern, n_samples, rng) :
+    """ Estimate the expected number of plays of the 14 cards by drawing
+    *n_samples* times from the cards not in *pattern*.
+    """
+    unseen = []
+    for slot, c in enumerate(pattern) :
+        unseen.extend([slot] * (_slot_sizes[slot] - c))
+    total = 0
+    for k in range(n_samples) :
+        slots = list(pattern)
+        for slot in rng.sample(unseen, DRAWN) :
+            slots[slot] += 1
+        histogram = 0
+        for slot in range(16) :
+            histogram |= slots[slot] << (slot << 2)
+        total += decomposition._solve(histogram, bool(slots[16]))[0]
+    return total / n_samples
+
+def _straight_free_ways(pattern) :
+    """ For the cards held in one suit, given as 13 bit *pattern*, count the
+    ways to draw *j* = 0..6 further cards of the suit such that it holds no
+    run of 5 or more.
+    """
+    # (current run length, drawn) -> ways
+    state = {(0, 0) : 1}
+    for bit in range(13) :
+        new = {}
+        held = pattern >> bit & 1
+        for (run, drawn), ways in state.items() :
+            options = [(run + 1, drawn)] if held else \
+                      [(0, drawn), (run + 1, drawn + 1)]
+            for run_, drawn_ in options :
+                if run_ >= 5 or drawn_ > DRAWN : continue
+                new[run_, drawn_] = new.get((run_, drawn_), 0) + ways
+        state = new
+    free = [0] * (DRAWN + 1)
+    for (run, drawn), ways in state.items() :
+        free[drawn] += ways
+    return free
+
+def build_suit_runs() :
+    """ Return the suit runs table as an array of 8192 * 7 counts. """
+    table = array('I')
+    for pattern in range(1 << 13) :
+        table.extend(_straight_free_ways(pattern))
+    return table
+
+def build_patterns(start, stop, n_samples, seed) :
+    """ Return the values of the rank patterns *start* to *stop* as an
+    array of floats. Every pattern is sampled with its own seed, so the
+    result does not depend on how the table is split up.
+    """
+    values = array('f')
+    for position in range(start, stop) :
+        pattern = unrank_pattern(position)
+        rng = random.Random(seed * N_PATTERNS + position)
+        values.append(bomb_probability(pattern))
+        values.append(expected_plays(pattern, n_samples, rng))
+    return values
+
+def _build_patterns(args) :
+    return build_patterns(*args)
+
+def _write(f, words) :
+    if not _little_endian :
+        words.byteswap()
+    f.write(words.tobytes())
+
+def build(path, n_samples=64, seed=0, processes=None, chunk_size=5000) :
+    """ Build the tables and write them to *path*. Rank patterns are sampled
+    on a pool of *processes* worker processes (*None*: one per core, 1: in
+    this process), *chunk_size* at a time.
+    """
+    chunks = [(start, min(start + chunk_size, N_PATTERNS), n_samples, seed)
+              for start in range(0, N_PATTERNS, chunk_size)]
+    with open(path, 'wb') as f :
+        f.write(HEADER.pack(MAGIC, N_PATTERNS, n_samples, seed))
+        _write(f, build_suit_runs())
+        if processes == 1 :
+            results = map(_build_patterns, chunks)
+        else :
+            pool = multiprocessing.Pool(processes)
+            results = pool.imap(_build_patterns, chunks)
+        try :
+            for i, values in enumerate(results) :
+                _write(f, values)
+                logger.info('Built %d of %d chunks.', i + 1, len(chunks))
+        finally :
+            if processes != 1 :
+                pool.close()
+                pool.join()
+
+#_Queries_______________________________________________________________________
+
+# Ways to draw j of the unseen special cards, by their number
+_special_ways = [[math.comb(n, j) for j in range(DRAWN + 1)] for n in range(5)]
+_all_ways = math.comb(UNSEEN, DRAWN)
+
+class OddsTable() :
+    """ The tables written by :func: `build`, mapped into memory from the
+    file at *path*.
+    """
+    def __init__(self, path) :
+        with open(path, 'rb') as f :
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, n_patterns, self.n_samples, self.seed = \
+            HEADER.unpack_from(self._map)
+        if magic != MAGIC or n_patterns != N_PATTERNS :
+            self._map.close()
+            raise ValueError('{} is not an odds table.'.format(path))
+        runs_size = (1 << 13) * (DRAWN + 1) * 4
+        runs = memoryview(self._map)[HEADER.size:HEADER.size + runs_size]
+        patterns = memoryview(self._map)[HEADER.size + runs_size:]
+        if _little_endian :
+            self._runs = runs.cast('I')
+            self._patterns = patterns.cast('f')
+        else :
+            # Swapped copies; only big endian machines pay for loading
+            self._runs = array('I', runs.tobytes())
+            self._runs.byteswap()
+            self._patterns = array('f', patterns.tobytes())
+            self._patterns.byteswap()
+        if len(self._patterns) != N_PATTERNS * N_VALUES :
+            self.close()
+            raise ValueError('{} is truncated.'.format(path))
+
+    def close(self) :
+        for view in (self._runs, self._patterns) :
+            if isinstance(view, memoryview) :
+                view.release()
+        self._map.close()
+
+    def __enter__(self) :
+        return self
+
+    def __exit__(self, *exc) :
+        self.close()
+
+    def straight_bomb(self, indices) :
+        """ Exact probability of a straight bomb among the 14 cards, given
+        the card indices of the first 8.
+        """
+        suits = [0] * 4
+        unseen_specials = 4
+        for i in indices :
+            if i < 52 :
+                suits[i // 13] |= 1 << (i % 13)
+            else :
+                unseen_specials -= 1
+        # Ways to draw j cards without a straight bomb, suit by suit
+        free = _special_ways[unseen_specials]
+        for pattern in suits :
+            base = pattern * (DRAWN + 1)
+            suit_free = self._runs[base:base + DRAWN + 1]
+            free = [sum(free[k] * suit_free[j-k] for k in range(j + 1))
+                    for j in range(DRAWN + 1)]
+        return 1 - free[DRAWN] / _all_ways
+
+    def query(self, cards) :
+        """ Return the :data: `Odds` of a hand whose first 8 *cards* (card
+        objects or card indices) are known.
+        """
+        # Indices may also come as numpy integers, e.g. from :mod:
+        # `tichu.dealing`
+        indices = [int(card) if isinstance(card, numbers.Integral)
+                   else card_index(card) for card in cards]
+        if len(set(indices)) != SEEN :
+            raise ValueError('Odds need {} different cards.'.format(SEEN))
+        position = rank_pattern(pattern_of(indices)) * N_VALUES
+        held = set(indices)
+        chance = DRAWN / UNSEEN
+        return Odds(self._patterns[position],
+                    self.straight_bomb(indices),
+                    1. if DRAGON in held else chance,
+                    1. if PHOENIX in held else chance,
+                    self._patterns[position + 1])
+
+def main(argv=None) :
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    p = subparsers.add_parser('build', help='Build the tables.')
+    p.add_argument('path')
+    p.add_argument('-n', '--samples', type=int, default=64,
+                   help='Samples per rank pattern (default 64).')
+    p.add_argument('-s', '--seed', type=int, default=0)
+    p.add_argument('-p', '--processes', type=int, default=None,
+                   help='Worker processes (default: one per core).')
+    p = subparsers.add_parser('query', help='Look up a hand.')
+    p.add_argument('path')
+    p.add_argument('indices', type=int, nargs=SEEN,
+                   help='Card indices of the first 8 cards.')
+    args = parser.parse_args(argv)
+
+    if args.command == 'build' :
+        build(args.path, args.samples, args.seed, args.processes)
+    else :
+        with OddsTable(args.path) as table :
+            print(table.query(args.indices))
+    return 0
+
+if __name__ == '__main__' :
+    sys.exit(main())
@@ -1,14 +1,55 @@
 
 import logging
+import threading
+from operator import itemgetter
 #import watchdog
 
-from combination import Combination
-from kustom.cards import deck
+from combination import Combination, card_index, encode, bit_by_index, \
+                        histogram_by_index, Phoenix_bit, Dragon_bit, Dog_bit, \
+                        Mahjongg_bit
+import decomposition
+from moves import PlayIndex
 
 logger = logging.getLogger('tichu.' + __name__)
 
-class PlayerAction() :
+class PlayerAction(tuple) :
+    """ Base class of the immutable, hashable actions a player can take, 
+    stored as tuples. Actions compare by strength: not playing is weaker 
+    than any play.
+    """
+    __slots__ = ()
     name = 'generic PlayerAction'
+    # The strength of actions that do not play any cards
+    strength = -1
+
+    def __new__(cls) :
+        return tuple.__new__(cls)
+
+    def __hash__(self) :
+        return hash((self.name, tuple.__hash__(self)))
+
+    def __eq__(self, other) :
+        if not isinstance(other, PlayerAction) : return NotImplemented
+        return self.name == other.name and tuple.__eq__(self, other)
+
+    def __ne__(self, other) :
+        if not isinstance(other, PlayerAction) : return NotImplemented
+        return not self == other
+
+    def __lt__(self, other) :
+        return self.strength < other.strength
+
+    def __le__(self, other) :
+        return self.strength <= other.strength
+
+    def __gt__(self, other) :
+        return self.strength > other.strength
+
+    def __ge__(self, other) :
+        return self.strength >= other.strength
+
+    def __reduce__(self) :
+        return (type(self), tuple(self))
 
     def __str__(self) :
         return '<PlayerAction {}>'.format(self.name)
@@ -17,40 +58,87 @@ class PlayerAction() :
         return self.__str__()
 
 class PassAction(PlayerAction) :
+    __slots__ = ()
     name = 'pass'
 
 class PlayAction(PlayerAction) :
+    __slots__ = ()
     name = 'play'
     
-    def __init__(self, combination) :
-        self.combination = combination
+    def __new__(cls, combination) :
+        return tuple.__new__(cls, (combination,))
+
+    combination = property(itemgetter(0))
+
+    @property
+    def strength(self) :
+        return self[0].rank
+
+    def __str__(self) :
+        return '<PlayerAction {}: {}>'.format(self.name, self[0])
 
 class RageQuitAction(PlayerAction) :
     """ For debug purposes. """
+    __slots__ = ()
     name = 'ragequit'
 
-class Player() :
+class ActionChannel() :
+    """ Hands the actions of a player over to the trick loop. The trick 
+    opens the channel when it is the player's turn and blocks in 
+    :meth: `receive` until the player submits an action, without polling.
+    """
+    def __init__(self) :
+        self._condition = threading.Condition()
+        self._action = None
+        self.is_open = False
+
+    def open(self) :
+        """ Allow the player to take action. """
+        with self._condition :
+            self.is_open = True
+
+    def close(self) :
+        """ Prevent the player from doing anything until the next 
+        :meth: `open`.
+        """
+        with self._condition :
+            self.is_open = False
 
-    play_lock = True
-    next_action = None
+    def submit(self, action) :
+        """ Set the next action, waking up a waiting :meth: `receive`. A 
+        previously submitted action that has not been received yet is 
+        replaced.
+        """
+        with self._condition :
+            self._action = action
+            self._condition.notify()
+
+    def receive(self, timeout=None) :
+        """ Block until an action is submitted and return it. Returns *None* 
+        if no action arrived within *timeout* seconds.
+        """
+        with self._condition :
+            if self._action is None :
+                self._condition.wait_for(lambda : self._action is not None, 
+                                         timeout)
+            action = self._action
+            self._action = None
+            return action
+
+class Player() :
 
     def __init__(self, name) :
         self.name = name
+        self.actions = ActionChannel()
+        self.hand = Hand([])
+        # Cards collected from won tricks
+        self.won_cards = []
 
     def draw_cards(self, deck, n=14) :
         self.hand = Hand(deck.draw(n))
 
-    def release_play_lock(self) :
-        """ Release the play_lock, allowing this player to take action. """
-        self.play_lock = False
-
-    def close_play_lock(self) :
-        """ Prevent the player from doing anything by closing his play_lock. 
-        """ 
-        self.play_lock = True
-
     def pass_(self) :
-        self.next_action = PassAction()
+        self.actions.submit(PassAction())
 
     def play(self, cards) :
         """
@@ -58,21 +146,35 @@ class Player() :
         cards  list of int or list of :class: `Card <cards.deck.Card>`s
         =====  =================================================================
         """
-        if self.play_lock :
-            logger.info('%s cannot play now, has play_lock.', self.name)
+        if not self.actions.is_open :
+            logger.info('%s cannot play now, not their turn.', self.name)
             return
 
         combination = self.hand.play(cards)
-        self.next_action = PlayAction(combination)
+        self.actions.submit(PlayAction(combination))
 
     def ragequit(self) :
         """ For debug only. """
-        self.next_action = RageQuitAction()
+        self.actions.submit(RageQuitAction())
+
+def _longest_run(bits) :
+    """ Length of the longest sequence of set bits in *bits*. """
+    length = 0
+    while bits :
+        bits &= bits << 1
+        length += 1
+    return length
 
 class Hand() :
     """ The cards a player holds in his hand. Takes care of the actions a 
     player can take, like playing cards and combinations, passing, drawing 
     cards, etc. 
+
+    Besides the list of *cards*, the hand keeps their bitmask and rank 
+    histogram (see :func: `combination.encode`) up to date as cards are 
+    added or discarded, such that questions about the hand do not require 
+    going through all cards. Discarding only updates the bitmask and the 
+    histogram; the list of *cards* is filtered when it is next used.
     """
     def __init__(self, cards) :
         """ 
@@ -80,7 +182,135 @@ class Hand() :
         cards  list of :class: `Card <cards.deck.Card>` objects.
         =====  =================================================================
         """
-        self.cards = cards
+        self._cards = list(cards)
+        self._indices = [card_index(card) for card in self._cards]
+        self.mask, self.histogram = encode(self._cards)
+        # Bits of discarded cards that are still in *_cards*
+        self._discarded = 0
+        self._play_index = None
+
+    def __len__(self) :
+        """ The number of cards left in this hand. """
+        return self.mask.bit_count()
+
+    @property
+    def cards(self) :
+        """ List of the cards in this hand, in the order they were added. """
+        if self._discarded :
+            mask = self.mask
+            kept = [(card, i) for card, i in zip(self._cards, self._indices) 
+                    if mask >> i & 1]
+            self._cards = [card for card, i in kept]
+            self._indices = [i for card, i in kept]
+            self._discarded = 0
+        return self._cards
+
+    def add(self, cards) :
+        """ Add *cards* to this hand, e.g. when drawing or receiving cards in 
+        an exchange.
+        """
+        # Filter first, a discarded card may come back
+        own = self.cards
+        for card in cards :
+            i = card_index(card)
+            self.mask |= bit_by_index[i]
+            self.histogram += histogram_by_index[i]
+            own.append(card)
+            self._indices.append(i)
+        self._play_index = None
+
+    def discard(self, cards) :
+        """ Remove the given *cards* (e.g. a played combination or cards given 
+        away in an exchange) from this hand. Raise ValueError if one of them 
+        is not in this hand; the hand is left unchanged then.
+        """
+        removed = 0
+        histogram = self.histogram
+        for card in cards :
+            i = card_index(card)
+            if not self.mask & ~removed & bit_by_index[i] :
+                raise ValueError('{} is not in the hand.'.format(card))
+            removed |= bit_by_index[i]
+            histogram -= histogram_by_index[i]
+        self.histogram = histogram
+        self.mask ^= removed
+        self._discarded |= removed
+        self._play_index = None
+
+    #_Queries___________________________________________________________________
+
+    def count(self, rank) :
+        """ The number of cards of the given *rank* (not counting the phoenix). 
+        """
+        return (self.histogram >> (rank << 2)) & 15
+
+    @property
+    def has_phoenix(self) :
+        return bool(self.mask & Phoenix_bit)
+
+    @property
+    def has_dragon(self) :
+        return bool(self.mask & Dragon_bit)
+
+    @property
+    def has_dog(self) :
+        return bool(self.mask & Dog_bit)
+
+    @property
+    def has_mahjongg(self) :
+        return bool(self.mask & Mahjongg_bit)
+
+    def suit_bits(self, suit) :
+        """ Bitset of the regular cards of *suit* (0-3) in this hand, bit 0 
+        corresponding to rank 2.
+        """
+        return (self.mask >> (13 * suit)) & 0x1fff
+
+    def rank_bits(self) :
+        """ Bitset of the ranks that can take part in a straight (Mahjongg to 
+        ace), bit *i* corresponding to rank *i*.
+        """
+        bits = 0
+        for suit in range(4) :
+            bits |= self.suit_bits(suit)
+        bits <<= 2
+        if self.mask & Mahjongg_bit :
+            bits |= 1 << 1
+        return bits
+
+    def has_four_of_a_kind(self) :
+        # A count of 4 is the only one setting the third bit of a rank slot
+        return bool((self.histogram >> 2) & 0x1111111111111111)
+
+    def has_straight_bomb(self) :
+        for suit in range(4) :
+            bits = self.suit_bits(suit)
+            if bits & (bits >> 1) & (bits >> 2) & (bits >> 3) & (bits >> 4) :
+                return True
+        return False
+
+    def has_bomb(self) :
+        """ True if this hand still holds a four of a kind or a straight 
+        bomb.
+        """
+        return self.has_four_of_a_kind() or self.has_straight_bomb()
+
+    def longest_straight(self) :
+        """ Length of the longest straight that can be played from this hand, 
+        using the phoenix if necessary. 0 if there is none.
+        """
+        bits = self.rank_bits()
+        length = _longest_run(bits)
+        if self.has_phoenix :
+            # The phoenix can stand in for any rank from 2 to ace
+            missing = ~bits & 0x7ffc
+            while missing :
+                low = missing & -missing
+                length = max(length, _longest_run(bits | low))
+                missing ^= low
+        return length if length >= 5 else 0
+
+    #_Plays_____________________________________________________________________
 
     def play(self, indices) :
         """ Play the combination of cards defined by the given *indices*.
@@ -95,3 +325,30 @@ class Hand() :
 
         return combination
 
+    def legal_plays(self, beating=None, rank=None) :
+        """ Iterate over all combinations that can be played from this hand. 
+        The plays are enumerated once per state of the hand.
+
+        =======  ===============================================================
+        beating  :class: `Combination <tichu.combination.Combination>` or 
+                 *None*; if given, only yield the plays that beat it.
+        rank     float or *None*; the rank to beat, if it differs from 
+                 *beating.rank* (e.g. for a single phoenix).
+        =======  ===============================================================
+        """
+        if self._play_index is None :
+            self._play_index = PlayIndex(self.cards)
+        if beating is None :
+            return self._play_index.all_plays()
+        else :
+            return self._play_index.beating(beating, rank)
+
+    def decompose(self) :
+        """ Return the strongest split of this hand into the fewest plays 
+        (see :mod: `tichu.decomposition`).
+        """
+        return decomposition.decompose(self.mask)
+
+    def min_plays(self) :
+        """ The fewest plays needed to get rid of this hand. """
+        return decomposition.min_plays(self.mask)
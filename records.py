@@ -0,0 +1,395 @@
+"""
+A compact binary record format for games and a validator that replays it.
+
+A record file is a sequence of little endian 64 bit words. The first word is
+the magic number :data: `MAGIC`, every following word is one record:
+
+=======  =======================================================================
+bits     content
+=======  =======================================================================
+0-55     mask of card indices (bit *i* set for card index *i*, see
+         :func: `combination.encode <tichu.combination.encode>`) or, for
+         some kinds, a number
+56-59    kind of the record, one of the event kinds of :mod: `tichu.events`
+60-61    seat of the player (0-3)
+62-63    extra information
+=======  =======================================================================
+
+===========  ===================================  ==============================
+kind         bits 0-55                            extra
+===========  ===================================  ==============================
+GAME         the seed modulo 2**56                1 if a seed was given
+DEAL         the 14 cards dealt
+CALL         0                                    1: tichu, 2: grand tichu
+EXCHANGE     one card given away                  seat offset of the receiver
+                                                  (1-3)
+PLAY, BOMB   the played cards
+PASS         0
+TRICK_WON    the cards of the trick               seat receiving the cards
+RAGEQUIT     0
+ROUND_OVER   the team's points, offset by
+             :data: `SCORE_OFFSET`, 12 bits each
+===========  ===================================  ==============================
+
+Records are written by :class: `RecordWriter`, an :class: `EventSink
+<tichu.events.EventSink>` that is passed to a :class: `Game
+<tichu.game.Game>` as *events*. Files are read through a memory map, one
+record at a time, so they can be much larger than the available memory::
+
+    with open('games.rec', 'wb') as f :
+        writer = RecordWriter(f)
+        for seed in range(1000) :
+            Game(strategies, seed=seed, events=writer).play()
+        writer.close()
+    print(validate('games.rec'))
+"""
+import logging
+import mmap
+import multiprocessing
+import os
+import struct
+import sys
+from array import array
+
+from combination import Combination, card_objects, card_index, PHOENIX
+from events import EventSink, PLAY, BOMB, PASS, TRICK_WON, RAGEQUIT, DEAL, \
+                   CALL, ROUND_OVER, GAME, EXCHANGE
+from game import Trick
+from player import Player, Hand, PassAction, PlayAction
+
+logger = logging.getLogger('tichu.' + __name__)
+
+MAGIC = struct.unpack('<Q', b'TICHREC\x01')[0]
+RECORD_SIZE = 8
+SCORE_OFFSET = 2048
+
+_little_endian = sys.byteorder == 'little'
+_mask_bits = (1 << 56) - 1
+_all_cards = (1 << (PHOENIX + 2)) - 1
+
+#_Encoding______________________________________________________________________
+
+def pack(kind, seat=0, mask=0, extra=0) :
+    """ Return the record word of the given fields. """
+    return mask | kind << 56 | seat << 60 | extra << 62
+
+def unpack(word) :
+    """ Return the fields (kind, seat, mask, extra) of a record word. """
+    return (word >> 56 & 15, word >> 60 & 3, word & _mask_bits, word >> 62)
+
+def cards_to_mask(cards) :
+    mask = 0
+    for card in cards :
+        mask |= 1 << card_index(card)
+    return mask
+
+def mask_to_cards(mask) :
+    """ The cards of *mask*, ordered by card index. """
+    cards_by_index = card_objects()
+    cards = []
+    while mask :
+        low = mask & -mask
+        cards.append(cards_by_index[low.bit_length() - 1])
+        mask ^= low
+    return cards
+
+def pack_scores(scores) :
+    return (scores[0] + SCORE_OFFSET) | (scores[1] + SCORE_OFFSET) << 12
+
+def unpack_scores(value) :
+    return [(value & 4095) - SCORE_OFFSET, (value >> 12) - SCORE_OFFSET]
+
+#_Writing_______________________________________________________________________
+
+class RecordWriter(EventSink) :
+    """ Write the events of games as records to the binary *file*, buffering
+    *buffer_size* records. Seats are known from the DEAL events, which
+    come in seat order at the start of every round.
+    """
+    def __init__(self, file, buffer_size=4096) :
+        self.file = file
+        self.buffer_size = buffer_size
+        self._buffer = array('Q')
+        self._seats = {}
+        self.count = 0
+        if file.tell() == 0 :
+            self._write_words(array('Q', [MAGIC]))
+
+    def _write_words(self, words) :
+        if not _little_endian :
+            words.byteswap()
+        self.file.write(words.tobytes())
+
+    def emit(self, kind, player, data=None) :
+        if kind == GAME :
+            word = pack(GAME, 0, (data or 0) & _mask_bits, data is not None)
+        elif kind == ROUND_OVER :
+            word = pack(ROUND_OVER, 0, pack_scores(data))
+            self._seats = {}
+        elif kind == DEAL :
+            seat = self._seats[player] = len(self._seats)
+            word = pack(DEAL, seat, cards_to_mask(data))
+        elif kind == CALL :
+            word = pack(CALL, self._seats[player], 0, data // 100)
+        elif kind == EXCHANGE :
+            # One record per card given away
+            seat = self._seats[player]
+            for offset, card in enumerate(data, 1) :
+                self._append(pack(EXCHANGE, seat, cards_to_mask([card]),
+                                  offset))
+            return
+        elif kind in (PLAY, BOMB) :
+            word = pack(kind, self._seats[player], data.mask)
+        elif kind == TRICK_WON :
+            # The trick was just added to the won cards of the receiver.
+            # Within a round, every card object is won only once.
+            receiver = self._seats[player]
+            for other, seat in self._seats.items() :
+                if other.won_cards and other.won_cards[-1] is data[-1] :
+                    receiver = seat
+            word = pack(TRICK_WON, self._seats[player], cards_to_mask(data),
+                        receiver)
+        else :
+            word = pack(kind, self._seats[player])
+        self._append(word)
+
+    def _append(self, word) :
+        self._buffer.append(word)
+        self.count += 1
+        if len(self._buffer) >= self.buffer_size :
+            self.flush()
+
+    def flush(self) :
+        if not self._buffer : return
+        self._write_words(self._buffer)
+        self._buffer = array('Q')
+
+    def close(self) :
+        self.flush()
+        self.file.flush()
+
+#_Reading_______________________________________________________________________
+
+def _from_little(word) :
+    return int.from_bytes(word.to_bytes(8, sys.byteorder), 'little')
+
+def n_words(path) :
+    """ The number of 64 bit words in the record file at *path*, including
+    the magic number.
+    """
+    size = os.path.getsize(path)
+    if size % RECORD_SIZE :
+        raise ValueError('{} is truncated.'.format(path))
+    return size // RECORD_SIZE
+
+def _read(path, start=1) :
+    """ Iterate over (position, record) from word *start* on. """
+    if not n_words(path) :
+        return
+    with open(path, 'rb') as f, \
+         mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m :
+        words = memoryview(m).cast('Q')
+        try :
+            convert = unpack if _little_endian else \
+                      lambda word : unpack(_from_little(word))
+            if convert(words[0]) != unpack(MAGIC) :
+                raise ValueError('{} is not a record file.'.format(path))
+            for i in range(max(start, 1), len(words)) :
+                yield i, convert(words[i])
+        finally :
+            # The map can only be closed once the view is released
+            words.release()
+
+def read_records(path) :
+    """ Iterate over the records (kind, seat, mask, extra) of the file at
+    *path* through a memory map, without reading it into memory.
+    """
+    for i, record in _read(path) :
+        yield record
+
+def read_games(path, start=1, stop=None) :
+    """ Iterate over the games of the record file at *path*, each given as
+    its position in the file (in words) and the list of its records,
+    starting with the GAME record. Only games starting within the words
+    *start* to *stop* are read, which allows to split up a file.
+    """
+    position = game = None
+    for i, record in _read(path, start) :
+        if record[0] == GAME :
+            if game is not None :
+                yield position, game
+            if stop is not None and i >= stop :
+                return
+            position, game = i, []
+        if game is None :
+            # The rest of a game that started before *start*
+            if start > 1 : continue
+            raise ValueError('Record file does not start with a game.')
+        game.append(record)
+    if game is not None :
+        yield position, game
+
+#_Replay________________________________________________________________________
+
+class ValidationReport() :
+    """ Result of :func: `validate`. Keeps the first *max_errors* errors as
+    (position in the file, message) tuples, positions counted in words.
+    """
+    def __init__(self, max_errors=100) :
+        self.games = 0
+        self.rounds = 0
+        self.records = 0
+        self.n_errors = 0
+        self.max_errors = max_errors
+        self.errors = []
+
+    def error(self, position, message) :
+        self.n_errors += 1
+        if len(self.errors) < self.max_errors :
+            self.errors.append((position, message))
+
+    def merge(self, other) :
+        """ Add the counts and errors of *other* to this report. """
+        self.games += other.games
+        self.rounds += other.rounds
+        self.records += other.records
+        self.n_errors += other.n_errors
+        self.errors = sorted(self.errors + other.errors)[:self.max_errors]
+        return self
+
+    @property
+    def ok(self) :
+        return not self.n_errors
+
+    def __str__(self) :
+        return '<ValidationReport {} games, {} rounds, {} records, {} ' \
+               'errors>'.format(self.games, self.rounds, self.records,
+                                self.n_errors)
+
+    def __repr__(self) :
+        return self.__str__()
+
+class _Replay() :
+    """ Replays the records of one game, raising ValueError on the first
+    inconsistency.
+    """
+    def __init__(self) :
+        self.players = [Player('Seat {}'.format(seat)) for seat in range(4)]
+        self.dealt = 0
+        self.trick = None
+        # Exchanged cards as (receiving seat, cards), handed over together
+        # before the first trick
+        self.received = []
+        self.in_play = False
+
+    def record(self, kind, seat, mask, extra) :
+        player = self.players[seat]
+        if kind == DEAL :
+            if mask & self.dealt :
+                raise ValueError('Cards dealt twice.')
+            self.dealt |= mask
+            player.hand = Hand(mask_to_cards(mask))
+            player.won_cards = []
+            return
+        if kind in (GAME, CALL) :
+            return
+        if kind == EXCHANGE :
+            if self.dealt != _all_cards or self.in_play :
+                raise ValueError('Exchange outside of the deal.')
+            if mask.bit_count() != 1 or mask & ~player.hand.mask or not extra :
+                raise ValueError('Invalid exchange by seat {}.'.format(seat))
+            cards = mask_to_cards(mask)
+            player.hand.discard(cards)
+            self.received.append(((seat + extra) % 4, cards))
+            return
+        if kind == ROUND_OVER :
+            if self.dealt != _all_cards :
+                raise ValueError('Round over before dealing.')
+            self.dealt = 0
+            self.trick = None
+            self.received = []
+            self.in_play = False
+            return
+        if self.dealt != _all_cards :
+            raise ValueError('Play before dealing all cards.')
+
+        for receiver, cards in self.received :
+            self.players[receiver].hand.add(cards)
+        self.received = []
+        self.in_play = True
+        trick = self.trick
+        if trick is None :
+            trick = self.trick = Trick(list(self.players))
+        if kind in (PLAY, BOMB) :
+            if mask & ~player.hand.mask :
+                raise ValueError('Cards not in the hand of seat {}.'.format(
+                    seat))
+            combination = Combination(mask_to_cards(mask))
+            if (kind == BOMB) != trick.is_bomb(combination) :
+                raise ValueError('Bomb flag does not match {}.'.format(
+                    combination))
+            if not trick.check_valid_play(combination) :
+                raise ValueError('Invalid play {} on {}.'.format(
+                    combination, trick.top))
+            trick.handle_action(PlayAction(combination), player)
+        elif kind == PASS :
+            if not trick.handle_action(PassAction(), player) :
+                raise ValueError('Pass on an empty trick.')
+        elif kind == TRICK_WON :
+            if trick.winner is not player :
+                raise ValueError('Trick won by seat {} instead of {}.'.format(
+                    seat, self.players.index(trick.winner)))
+            if mask != cards_to_mask(trick.cards) :
+                raise ValueError('Trick cards do not match the plays.')
+            if extra != seat and (extra - seat) % 2 == 0 :
+                raise ValueError('Trick given to the partner.')
+            self.trick = None
+        elif kind == RAGEQUIT :
+            self.trick = None
+        else :
+            raise ValueError('Unknown record kind {}.'.format(kind))
+
+def validate_range(path, start=1, stop=None, max_errors=100) :
+    """ Validate the games starting within the words *start* to *stop* of
+    the record file at *path*. See :func: `validate`.
+    """
+    report = ValidationReport(max_errors)
+    for position, game in read_games(path, start, stop) :
+        report.games += 1
+        report.records += len(game)
+        replay = _Replay()
+        for i, record in enumerate(game) :
+            try :
+                replay.record(*record)
+            except ValueError as e :
+                report.error(position + i, str(e))
+                break
+            if record[0] == ROUND_OVER :
+                report.rounds += 1
+    return report
+
+def _validate_range(args) :
+    return validate_range(*args)
+
+def validate(path, max_errors=100, processes=1, chunk_words=1 << 20) :
+    """ Replay all games in the record file at *path*, checking every play
+    with :class: `Combination <tichu.combination.Combination>` and
+    :meth: `Trick.check_valid_play <tichu.game.Trick.check_valid_play>`.
+    Deals have to be complete and disjoint, played cards have to be in the
+    player's hand and tricks have to go to the last player who played.
+    A game is abandoned at its first error. Return a
+    :class: `ValidationReport`.
+
+    With *processes* other than 1, the file is split into pieces of
+    *chunk_words* records that are validated on a pool of worker processes
+    (*None*: one per core). Every worker maps the file itself.
+    """
+    if processes == 1 :
+        return validate_range(path, max_errors=max_errors)
+    chunks = [(path, start, start + chunk_words, max_errors)
+              for start in range(1, n_words(path), chunk_words)]
+    report = ValidationReport(max_errors)
+    with multiprocessing.Pool(processes) as pool :
+        for chunk_report in pool.imap_unordered(_validate_range, chunks) :
+            report.merge(chunk_report)
+    return report
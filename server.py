@@ -0,0 +1,585 @@
+"""
+An asyncio table server hosting many concurrent games on one event loop.
+
+No threads are involved: a table is a coroutine that plays its
+:class: `Game <tichu.game.Game>` round by round and trick by trick and only
+suspends while waiting for a remote player to act. Seats that are not taken
+by a remote player are played by a server side
+:class: `Strategy <tichu.strategies.Strategy>` (the *bot*).
+
+Clients talk to the server over a :class: `Connection`, either in-process
+(:func: `local_pipe`, messages are passed as dicts) or over a local TCP or
+unix socket (:class: `StreamConnection`, one JSON object per line). A single
+connection can control seats at any number of tables. Cards are sent as
+card indices (see :func: `combination.encode <tichu.combination.encode>`).
+
+Client to server:
+
+========  ======================================================================
+type      fields
+========  ======================================================================
+open      *table*: name of a new table. Optional: *seed*, *bots* (seats
+          played by the server), *target*, *max_rounds*.
+join      *table*, *seat*: control *seat* at *table*. The game starts once
+          every seat is either joined or a bot.
+action    *table*, *seat*, *action* ('play' or 'pass') and *cards* (list of
+          card indices, for plays); the answer to a *prompt*.
+dragon    *table*, *seat*, *receiver*: the answer to a *dragon* request.
+========  ======================================================================
+
+Server to client:
+
+========  ======================================================================
+type      fields
+========  ======================================================================
+prompt    *table*, *seat*, *hand* (card indices), *top* (card indices of the
+          combination to beat or *None* when leading), *rank* (the rank to
+          beat).
+dragon    *table*, *seat*, *opponents*: choose the seat receiving a trick
+          won with the dragon.
+error     *table*, *seat*, *reason*: the last message was rejected. After
+          a rejected action, the seat is prompted again.
+over      *table*, *scores*, *rounds*: the game has ended.
+========  ======================================================================
+
+Tichu calls and the card exchange are not part of the protocol: remote
+players never call and give away the cards chosen by :meth: `Strategy.push
+<tichu.strategies.Strategy.push>`. A seat whose player disconnects or does
+not act within *turn_timeout* seconds is played by the bot.
+
+Run as a script to serve on a socket or to load test a server::
+
+    python server.py serve --port 7000
+    python server.py loadtest --tables 2000
+    python server.py loadtest --tables 500 --port 7000
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import sys
+import time
+
+from combination import Combination, card_objects, card_index
+from core import configure_logging
+from game import Game
+from moves import PlayIndex
+from player import PassAction, PlayAction
+from strategies import Strategy, GreedyStrategy
+
+logger = logging.getLogger('tichu.' + __name__)
+
+#_Transport_____________________________________________________________________
+
+class Connection() :
+    """ Base class of a message connection between server and client. """
+
+    async def send(self, message) :
+        """ Send the dict *message*. """
+        raise NotImplementedError
+
+    async def receive(self) :
+        """ Return the next message, or *None* once the connection is closed.
+        """
+        raise NotImplementedError
+
+    def close(self) :
+        pass
+
+class QueueConnection(Connection) :
+    """ One end of an in-process connection created by :func: `local_pipe`.
+    Messages are not serialized, so the receiving side must not modify them.
+    """
+    def __init__(self, inbox, outbox) :
+        self.inbox = inbox
+        self.outbox = outbox
+
+    async def send(self, message) :
+        self.outbox.put_nowait(message)
+
+    async def receive(self) :
+        return await self.inbox.get()
+
+    def close(self) :
+        # Tell the other end
+        self.outbox.put_nowait(None)
+
+def local_pipe() :
+    """ Return both ends of an in-process connection. """
+    a, b = asyncio.Queue(), asyncio.Queue()
+    return QueueConnection(a, b), QueueConnection(b, a)
+
+class StreamConnection(Connection) :
+    """ A connection over an asyncio stream, e.g. a TCP or unix socket,
+    sending one JSON object per line.
+    """
+    def __init__(self, reader, writer) :
+        self.reader = reader
+        self.writer = writer
+
+    async def send(self, message) :
+        self.writer.write(json.dumps(message).encode() + b'\n')
+        await self.writer.drain()
+
+    async def receive(self) :
+        line = await self.reader.readline()
+        if not line :
+            return None
+        return json.loads(line)
+
+    def close(self) :
+        self.writer.close()
+
+async def connect(host='127.0.0.1', port=None, path=None) :
+    """ Open a :class: `StreamConnection` to a server listening on *port*
+    or, if given, the unix socket *path*.
+    """
+    if path is not None :
+        reader, writer = await asyncio.open_unix_connection(path)
+    else :
+        reader, writer = await asyncio.open_connection(host, port)
+    return StreamConnection(reader, writer)
+
+#_Tables________________________________________________________________________
+
+def combination_from_indices(indices) :
+    cards_by_index = card_objects()
+    return Combination([cards_by_index[i] for i in indices])
+
+class Table() :
+    """ A game played on the server. Seats are either controlled by a
+    remote player over a :class: `Connection` or by the *bot* strategy.
+    """
+    def __init__(self, name, seed=None, bots=(), bot=GreedyStrategy(),
+                 turn_timeout=None, target=1000, max_rounds=100,
+                 events=None) :
+        """
+        ============  ==========================================================
+        name          str; name of the table, unique per server.
+        seed          int or None; seed of the game.
+        bots          list of the seats played by *bot* from the start.
+        bot           :class: `Strategy <tichu.strategies.Strategy>`; plays
+                      the bot seats and stands in for remote players that
+                      time out or disconnect.
+        turn_timeout  float or None; seconds a remote player has to act.
+        target        int; score that ends the game.
+        max_rounds    int; safety limit on the number of rounds.
+        events        :class: `EventSink <tichu.events.EventSink>` of the
+                      game.
+        ============  ==========================================================
+        """
+        self.name = name
+        self.bot = bot
+        self.turn_timeout = turn_timeout
+        # Remote seats use the defaults of the base class for everything the
+        # protocol does not cover (tichu calls)
+        self.strategies = [bot if seat in bots else Strategy()
+                           for seat in range(4)]
+        self.game = Game(self.strategies, seed=seed, target=target,
+                         max_rounds=max_rounds, events=events)
+        self.open_seats = set(range(4)) - set(bots)
+        # The connection of every remote seat
+        self.connections = [None] * 4
+        # The answer the table waits for, per seat
+        self.pending = [None] * 4
+        self.moves = 0
+
+    def join(self, seat, connection) :
+        """ Let *connection* control *seat*. Return True if the table is
+        complete.
+        """
+        if seat not in self.open_seats :
+            raise ValueError('Seat {} at table {} is not free.'.format(
+                seat, self.name))
+        self.open_seats.remove(seat)
+        self.connections[seat] = connection
+        return not self.open_seats
+
+    def leave(self, connection) :
+        """ Hand all seats of *connection* over to the bot. """
+        for seat in range(4) :
+            if self.connections[seat] is connection :
+                self.connections[seat] = None
+                self.strategies[seat] = self.bot
+                self.answer(seat, None)
+
+    def answer(self, seat, message) :
+        """ Deliver the answer *message* of the player at *seat*. """
+        future = self.pending[seat]
+        if future is not None and not future.done() :
+            future.set_result(message)
+
+    async def ask(self, seat, message) :
+        """ Send *message* to the player at *seat* and wait for the answer.
+        Return *None* if the player does not answer in time or leaves.
+        """
+        connection = self.connections[seat]
+        future = asyncio.get_running_loop().create_future()
+        self.pending[seat] = future
+        try :
+            await connection.send(message)
+            if self.turn_timeout is None :
+                return await future
+            return await asyncio.wait_for(future, self.turn_timeout)
+        except asyncio.TimeoutError :
+            logger.info('%s: seat %d timed out.', self.name, seat)
+            return None
+        finally :
+            self.pending[seat] = None
+
+    async def error(self, seat, reason) :
+        connection = self.connections[seat]
+        if connection is not None :
+            await connection.send(dict(type='error', table=self.name,
+                                       seat=seat, reason=reason))
+
+    async def play(self) :
+        """ Play the game. Return the scores. """
+        game = self.game
+        while not game.is_over() :
+            round_ = game.new_round()
+            round_.deal()
+            round_.exchange()
+            leader = round_.first_leader()
+            while not round_.is_over() :
+                leader = await self.play_trick(round_, leader)
+            game.end_round(round_, round_.score())
+        message = dict(type='over', table=self.name, scores=game.scores,
+                       rounds=len(game.rounds))
+        for connection in set(self.connections) - {None} :
+            await connection.send(message)
+        return game.scores
+
+    async def play_trick(self, round_, leader) :
+        """ The asynchronous version of :meth: `Round.play_trick
+        <tichu.game.Round.play_trick>`.
+        """
+        # Tables only played by bots would never give up the event loop
+        await asyncio.sleep(0)
+        trick = round_.start_trick(leader)
+        while not trick.trick_finished() :
+            player = trick.players[0]
+            if len(player.hand) :
+                seat = round_.seats[player]
+                while True :
+                    action = await self.get_action(round_, seat, trick)
+                    if action is not None and \
+                       round_.apply_action(trick, player, action) :
+                        break
+                    await self.error(seat, 'Invalid action.')
+                self.moves += 1
+                if round_.is_over() : break
+            trick.rotate_players()
+
+        receiver = None
+        winner = round_.seats[trick.winner]
+        if trick.won_by_dragon and self.connections[winner] is not None :
+            opponents = round_.opponents(winner)
+            message = await self.ask(winner, dict(
+                type='dragon', table=self.name, seat=winner,
+                opponents=opponents))
+            if message is not None and message.get('receiver') in opponents :
+                receiver = message['receiver']
+        return round_.end_trick(trick, receiver)
+
+    async def get_action(self, round_, seat, trick) :
+        """ Return the action of the player at *seat*, asking the bot if the
+        player is not connected or does not answer.
+        """
+        player = round_.players[seat]
+        if self.connections[seat] is not None :
+            message = await self.ask(seat, dict(
+                type='prompt', table=self.name, seat=seat,
+                hand=[card_index(card) for card in player.hand.cards],
+                top=None if trick.top is None else
+                    [card_index(card) for card in trick.top.cards],
+                rank=trick.top_rank))
+            if message is not None :
+                return self.parse_action(player, message)
+        return self.bot.play(round_, player, trick)
+
+    @staticmethod
+    def parse_action(player, message) :
+        """ Turn an *action* message into a :class: `PlayerAction
+        <tichu.player.PlayerAction>`. Plays of cards that are not in the
+        hand of *player* yield *None*, which no trick accepts.
+        """
+        if message.get('action') == 'pass' :
+            return PassAction()
+        try :
+            combination = combination_from_indices(message['cards'])
+        except (KeyError, IndexError, TypeError, ValueError) :
+            return None
+        if combination.mask & ~player.hand.mask :
+            return None
+        return PlayAction(combination)
+
+class TableServer() :
+    """ Host any number of :class: `Table` objects on the running event
+    loop and serve connections to them.
+    """
+    def __init__(self, turn_timeout=None, bot=GreedyStrategy(),
+                 events=None) :
+        self.turn_timeout = turn_timeout
+        self.bot = bot
+        self.events = events
+        self.tables = {}
+        self.tasks = set()
+        self.games_played = 0
+
+    def open_table(self, name, seed=None, bots=(), target=1000,
+                   max_rounds=100) :
+        if name in self.tables :
+            raise ValueError('Table {} exists.'.format(name))
+        table = Table(name, seed=seed, bots=bots, bot=self.bot,
+                      turn_timeout=self.turn_timeout, target=target,
+                      max_rounds=max_rounds, events=self.events)
+        self.tables[name] = table
+        if not table.open_seats :
+            self.start(table)
+        return table
+
+    def start(self, table) :
+        task = asyncio.ensure_future(self._run(table))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _run(self, table) :
+        try :
+            await table.play()
+            self.games_played += 1
+        except Exception :
+            logger.exception('Table %s crashed.', table.name)
+        finally :
+            del self.tables[table.name]
+
+    async def serve(self, connection) :
+        """ Handle the messages of *connection* until it is closed. """
+        joined = set()
+        try :
+            while True :
+                message = await connection.receive()
+                if message is None :
+                    break
+                try :
+                    self.handle(connection, message, joined)
+                except (KeyError, ValueError, TypeError) as e :
+                    await connection.send(dict(
+                        type='error', table=message.get('table'),
+                        seat=message.get('seat'), reason=str(e)))
+        finally :
+            for table in joined :
+                table.leave(connection)
+            connection.close()
+
+    def handle(self, connection, message, joined) :
+        kind = message['type']
+        if kind == 'open' :
+            self.open_table(message['table'], message.get('seed'),
+                            message.get('bots', ()),
+                            message.get('target', 1000),
+                            message.get('max_rounds', 100))
+            return
+        table = self.tables[message['table']]
+        seat = message['seat']
+        if kind == 'join' :
+            joined.add(table)
+            if table.join(seat, connection) :
+                self.start(table)
+        elif table.connections[seat] is not connection :
+            raise ValueError('Seat {} is not yours.'.format(seat))
+        elif kind in ('action', 'dragon') :
+            table.answer(seat, message)
+        else :
+            raise ValueError('Unknown message type {}.'.format(kind))
+
+    async def _serve_stream(self, reader, writer) :
+        await self.serve(StreamConnection(reader, writer))
+
+    async def listen(self, host='127.0.0.1', port=0, path=None) :
+        """ Start serving on a TCP *port* or, if given, the unix socket
+        *path*. Return the :class: `asyncio.Server`.
+        """
+        if path is not None :
+            return await asyncio.start_unix_server(self._serve_stream, path)
+        return await asyncio.start_server(self._serve_stream, host, port)
+
+    def connect_local(self) :
+        """ Return the client end of a new in-process connection. """
+        server_end, client_end = local_pipe()
+        task = asyncio.ensure_future(self.serve(server_end))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return client_end
+
+#_Load_test_____________________________________________________________________
+
+class ScriptedClient() :
+    """ A client that plays all seats it joined with a cheap fixed script:
+    lead the lowest pair or single, follow with the lowest play of the same
+    type that beats the trick and never bomb. It measures the move latency:
+    the time from sending an action until the next message of the same
+    table arrives.
+    """
+    def __init__(self, connection) :
+        self.connection = connection
+        self.latencies = []
+        self.moves = 0
+        self.errors = 0
+        self.scores = {}
+        # Send time of the last action, per table
+        self._sent = {}
+
+    @staticmethod
+    def choose(hand, top, rank) :
+        """ Return the card indices to play, or *None* to pass. """
+        cards_by_index = card_objects()
+        index = PlayIndex([cards_by_index[i] for i in hand])
+        if top is None :
+            plays = index.plays('pair') or index.plays('single')
+        else :
+            combo_type = combination_from_indices(top).combo_type
+            if combo_type in index.bomb_types :
+                return None
+            plays = index.higher(combo_type, rank)
+            if not plays :
+                return None
+        return [card_index(card) for card in plays[0].cards]
+
+    async def run(self, tables) :
+        """ Play until all *tables* (a set of names) are over. """
+        tables = set(tables)
+        connection = self.connection
+        while tables :
+            message = await connection.receive()
+            if message is None :
+                break
+            now = time.perf_counter()
+            table = message['table']
+            sent = self._sent.pop(table, None)
+            if sent is not None :
+                self.latencies.append(now - sent)
+            kind = message['type']
+            if kind == 'prompt' :
+                cards = self.choose(message['hand'], message['top'],
+                                    message['rank'])
+                answer = dict(type='action', table=table,
+                              seat=message['seat'])
+                if cards is None :
+                    answer['action'] = 'pass'
+                else :
+                    answer['action'] = 'play'
+                    answer['cards'] = cards
+                self.moves += 1
+                self._sent[table] = time.perf_counter()
+                await connection.send(answer)
+            elif kind == 'dragon' :
+                await connection.send(dict(type='dragon', table=table,
+                                           seat=message['seat'],
+                                           receiver=message['opponents'][0]))
+            elif kind == 'over' :
+                self.scores[table] = message['scores']
+                tables.discard(table)
+            elif kind == 'error' :
+                self.errors += 1
+                logger.warning('%s: %s', table, message['reason'])
+
+def percentile(values, p) :
+    """ The *p*-th percentile (0-100) of *values*, nearest rank. """
+    if not values : return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+async def load_test(n_tables, n_clients=4, seed=0, bots=(), max_rounds=1,
+                    server=None, host='127.0.0.1', port=None, path=None) :
+    """ Play *n_tables* games at once with *n_clients*
+    :class: `ScriptedClient` connections, each controlling all non-bot
+    seats of its share of the tables. Without *port* or *path*, the tables
+    are played on *server* (a new :class: `TableServer` by default) in this
+    process over in-process connections. Return a dict with the number of
+    moves, moves/sec and the median and p99 move latency in seconds.
+    """
+    if port is None and path is None and server is None :
+        server = TableServer()
+    clients = []
+    for i in range(n_clients) :
+        if port is None and path is None :
+            connection = server.connect_local()
+        else :
+            connection = await connect(host, port, path)
+        clients.append(ScriptedClient(connection))
+
+    rng = random.Random(seed)
+    prefix = '{:x}'.format(rng.getrandbits(32))
+    names = [[] for client in clients]
+    start = time.perf_counter()
+    for t in range(n_tables) :
+        name = '{}-{}'.format(prefix, t)
+        client = clients[t % n_clients]
+        names[t % n_clients].append(name)
+        await client.connection.send(dict(
+            type='open', table=name, seed=rng.getrandbits(64),
+            bots=list(bots), max_rounds=max_rounds))
+        for seat in range(4) :
+            if seat not in bots :
+                await client.connection.send(dict(type='join', table=name,
+                                                  seat=seat))
+    await asyncio.gather(*[client.run(tables)
+                           for client, tables in zip(clients, names)])
+    elapsed = time.perf_counter() - start
+    for client in clients :
+        client.connection.close()
+
+    latencies = [l for client in clients for l in client.latencies]
+    moves = sum(client.moves for client in clients)
+    return dict(tables=n_tables, moves=moves, seconds=elapsed,
+                moves_per_sec=moves / elapsed,
+                errors=sum(client.errors for client in clients),
+                latency_p50=percentile(latencies, 50),
+                latency_p99=percentile(latencies, 99))
+
+#_Command_line__________________________________________________________________
+
+async def _serve_forever(args) :
+    server = TableServer(turn_timeout=args.timeout)
+    listener = await server.listen(args.host, args.port, args.path)
+    logger.info('Serving on %s.',
+                [s.getsockname() for s in listener.sockets])
+    async with listener :
+        await listener.serve_forever()
+
+def main(argv=None) :
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('command', choices=['serve', 'loadtest'])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('-p', '--port', type=int)
+    parser.add_argument('--path', help='Use this unix socket.')
+    parser.add_argument('--timeout', type=float,
+                        help='Turn timeout in seconds (serve).')
+    parser.add_argument('-n', '--tables', type=int, default=1000,
+                        help='Number of concurrent tables (loadtest).')
+    parser.add_argument('-c', '--clients', type=int, default=4,
+                        help='Number of client connections (loadtest).')
+    parser.add_argument('-r', '--rounds', type=int, default=1,
+                        help='Rounds per game (loadtest).')
+    parser.add_argument('-s', '--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    configure_logging()
+
+    if args.command == 'serve' :
+        asyncio.run(_serve_forever(args))
+        return 0
+
+    # Keep the per-round log messages out of the measurement
+    logging.getLogger('tichu').setLevel(logging.WARNING)
+    result = asyncio.run(load_test(args.tables, args.clients, args.seed,
+                                   max_rounds=args.rounds, host=args.host,
+                                   port=args.port, path=args.path))
+    print('{tables} tables, {moves} moves in {seconds:.2f} s: '
+          '{moves_per_sec:,.0f} moves/s, latency p50 {latency_p50:.2e} s, '
+          'p99 {latency_p99:.2e} s, {errors} errors'.format(**result))
+    return 1 if result['errors'] else 0
+
+if __name__ == '__main__' :
+    sys.exit(main())
@@ -0,0 +1,144 @@
+"""
+Run many headless games in parallel and collect statistics.
+
+Every game gets its own random number generator, seeded from the base seed
+and the game number. Results therefore do not depend on the number of
+worker processes or on the order in which games finish.
+"""
+import hashlib
+import logging
+import multiprocessing
+
+from game import Game
+
+logger = logging.getLogger('tichu.' + __name__)
+
+def game_seed(seed, i) :
+    """ Derive the seed of game number *i* from the base *seed*. """
+    digest = hashlib.sha256('{}:{}'.format(seed, i).encode()).digest()
+    return int.from_bytes(digest[:8], 'little')
+
+class SimulationStats() :
+    """ Summary statistics over a number of games. Instances from different
+    workers are combined with :meth: `merge`.
+    """
+    def __init__(self) :
+        self.games = 0
+        self.rounds = 0
+        self.tricks = 0
+        # Per team
+        self.wins = [0, 0]
+        self.ties = 0
+        self.points = [0, 0]
+        self.double_victories = [0, 0]
+        # Per seat: tichu calls made and won
+        self.calls = [0] * 4
+        self.calls_won = [0] * 4
+
+    def add(self, game) :
+        """ Add the results of a finished :class: `Game <tichu.game.Game>`.
+        """
+        self.games += 1
+        self.rounds += len(game.rounds)
+        winner = game.winner
+        if winner is None :
+            self.ties += 1
+        else :
+            self.wins[winner] += 1
+        for team in range(2) :
+            self.points[team] += game.scores[team]
+        for round_ in game.rounds :
+            self.tricks += round_.n_tricks
+            if len(round_.finished) == 2 :
+                self.double_victories[round_.team(round_.finished[0])] += 1
+            for seat, call in enumerate(round_.calls) :
+                if call :
+                    self.calls[seat] += 1
+                    self.calls_won[seat] += seat == round_.finished[0]
+
+    def merge(self, other) :
+        """ Add the counts of *other* to this instance. """
+        self.games += other.games
+        self.rounds += other.rounds
+        self.tricks += other.tricks
+        self.ties += other.ties
+        for name in ['wins', 'points', 'double_victories', 'calls',
+                     'calls_won'] :
+            mine = getattr(self, name)
+            for i, value in enumerate(getattr(other, name)) :
+                mine[i] += value
+        return self
+
+    def win_rates(self) :
+        """ Fraction of games won by each team. """
+        if not self.games : return [0., 0.]
+        return [wins / self.games for wins in self.wins]
+
+    def __str__(self) :
+        return ('<SimulationStats {} games, {} rounds, wins {}, ties {}, '
+                'points {}>').format(self.games, self.rounds, self.wins,
+                                     self.ties, self.points)
+
+    def __repr__(self) :
+        return self.__str__()
+
+def play_games(strategies, seed, indices, duplicate=False, **game_kwargs) :
+    """ Play the games with the given *indices* and return their
+    :class: `SimulationStats`. In *duplicate* mode, games 2*k* and 2*k* + 1
+    are both seeded like game *k* and get the same deals, the second one
+    with the teams' cards swapped (see :mod: `tichu.dealing`).
+    """
+    if duplicate :
+        # Requires numpy
+        from dealing import DealStream
+    stats = SimulationStats()
+    for i in indices :
+        if duplicate :
+            k, rotation = divmod(i, 2)
+            game_kwargs['deals'] = DealStream(game_seed(seed, k),
+                                              rotation=rotation)
+            i = k
+        game = Game(strategies, seed=game_seed(seed, i), **game_kwargs)
+        game.play()
+        stats.add(game)
+    return stats
+
+def _play_chunk(args) :
+    strategies, seed, indices, duplicate, game_kwargs = args
+    return play_games(strategies, seed, indices, duplicate, **game_kwargs)
+
+def simulate(strategies, n_games, seed=0, processes=None, chunk_size=50,
+             duplicate=False, **game_kwargs) :
+    """ Play *n_games* games on a pool of worker processes and return the
+    merged :class: `SimulationStats`.
+
+    ===========  ===============================================================
+    strategies   list of 4 :class: `Strategy <tichu.strategies.Strategy>`
+                 objects in seat order. They have to be picklable.
+    n_games      int; number of games to play.
+    seed         int; base seed. Game *i* is seeded with
+                 :func: `game_seed(seed, i) <game_seed>`.
+    processes    int or *None*; number of worker processes. Defaults to the
+                 number of cores. With 1, games are played in this process.
+    chunk_size   int; number of games handed to a worker at once.
+    duplicate    bool; play every deal twice, once from each side of the
+                 table (see :func: `play_games`). *n_games* should be even.
+    game_kwargs  further arguments to :class: `Game <tichu.game.Game>`.
+    ===========  ===============================================================
+    """
+    chunks = [(strategies, seed, range(start, min(start + chunk_size,
+                                                   n_games)), duplicate,
+               game_kwargs)
+              for start in range(0, n_games, chunk_size)]
+    stats = SimulationStats()
+    if processes == 1 :
+        for chunk in chunks :
+            stats.merge(_play_chunk(chunk))
+        return stats
+
+    with multiprocessing.Pool(processes) as pool :
+        for chunk_stats in pool.imap_unordered(_play_chunk, chunks) :
+            stats.merge(chunk_stats)
+    logger.info('Simulated %d games.', stats.games)
+    return stats
+
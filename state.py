@@ -0,0 +1,431 @@
+"""
+A compact round state for search: masks and small integers with apply/undo.
+
+:class: `GameState` holds everything a search needs to know about a running
+round in a few integers: the hands as card masks (see :func:
+`combination.encode <tichu.combination.encode>`), the trick as the mask and
+rank of its top combination, and the points won so far. Moves are integers
+as well:
+
+===========  ===================================================================
+action       meaning
+===========  ===================================================================
+mask > 0     play the cards of *mask*
+:data:`PASS` pass (0)
+-1 - seat    give a trick won with the Dragon to *seat*
+===========  ===================================================================
+
+:meth: `GameState.apply` changes the state in place and pushes what it
+changed onto an undo stack, :meth: `GameState.undo` pops it again, so a
+search walks through positions without copying. The rules are those of
+:class: `Round <tichu.game.Round>` and :class: `Trick <tichu.game.Trick>`:
+bombs are only played in turn, the Dog passes the lead to the partner and a
+single Phoenix is half a rank above the card it is played on. Plays are
+classified by :class: `Combination <tichu.combination.Combination>` once per
+card set and cached.
+
+Every state has a 64 bit Zobrist key (:attr: `GameState.key`), updated with
+every move. Keys come from fixed seeds, so they are the same in every
+process and can be stored.
+"""
+import logging
+
+from combination import Combination, card_objects, encode, N_CARDS, \
+                        Dog_bit, Dragon_bit, Phoenix_bit, Mahjongg_bit
+from core import mask_points
+from endgame import ZobristKeys, POINTS_OFFSET, TURN, GIFT
+from moves import PlayIndex
+
+logger = logging.getLogger('tichu.' + __name__)
+
+PASS = 0
+
+_keys = ZobristKeys(seed=0x7ac4)
+
+def _cards(mask) :
+    cards_by_index = card_objects()
+    return [cards_by_index[i] for i in range(N_CARDS) if mask >> i & 1]
+
+#_Plays_________________________________________________________________________
+
+# Card mask -> (combo type, rank, is bomb, points, key as top, keys in the
+# hands) or None, and hand mask -> list of (mask, combo type, rank, is bomb)
+# of all plays
+_classified = {}
+_plays = {}
+MAX_CACHED = 100000
+
+def _info(mask) :
+    try :
+        return _classified[mask]
+    except KeyError :
+        pass
+    if len(_classified) > MAX_CACHED :
+        _classified.clear()
+    try :
+        combination = Combination(_cards(mask))
+    except ValueError :
+        result = None
+    else :
+        combo_type = combination.combo_type
+        result = (combo_type, combination.rank,
+                  combo_type == 'bomb' or combo_type.endswith('straight_bomb'),
+                  mask_points(mask), _mask_key(_keys.top, mask),
+                  tuple(_mask_key(tables, mask) for tables in _keys.hands))
+    _classified[mask] = result
+    return result
+
+def classify(mask) :
+    """ Return (combo type, rank, is bomb) of the cards of *mask*, or *None*
+    if they are no valid combination.
+    """
+    result = _info(mask)
+    return None if result is None else result[:3]
+
+def plays(hand) :
+    """ All plays of the cards in mask *hand* as (mask, combo type, rank, is
+    bomb) tuples.
+    """
+    try :
+        return _plays[hand]
+    except KeyError :
+        pass
+    if len(_plays) > MAX_CACHED :
+        _plays.clear()
+    result = []
+    for combination in PlayIndex(_cards(hand)).all_plays() :
+        mask = combination.mask
+        result.append((mask,) + _info(mask)[:3])
+    _plays[hand] = result
+    return result
+
+def _mask_key(tables, mask) :
+    key = 0
+    for table in tables :
+        key ^= table[mask & 255]
+        mask >>= 8
+    return key
+
+#_State_________________________________________________________________________
+
+class GameState() :
+    """ The state of a round in play (see the module docstring).
+
+    ============  ==============================================================
+    hands         list of the 4 hands as card masks.
+    turn          seat to act, *None* once the round is over.
+    trick_type    combo type of the trick, *None* before the lead.
+    top           mask of the combination to beat, 0 when leading.
+    top_rank      the rank to beat (differs from the rank of *top* for the
+                  Phoenix).
+    winner        seat that played *top*.
+    passes        passes since *top* was played.
+    trick_cards   mask of all cards of the trick.
+    trick_points  points of *trick_cards*.
+    won           list of the points won in tricks by each seat.
+    finished      tuple of the seats that are out of cards, in order.
+    stage         *TURN* or, when the winner of a Dragon trick has to give
+                  it away, *GIFT*.
+    calls         tuple of the tichu calls (0, 100 or 200) per seat.
+    ============  ==============================================================
+    """
+    __slots__ = ('hands', 'turn', 'trick_type', 'top', 'top_rank', 'winner',
+                 'passes', 'trick_cards', 'trick_points', 'won', 'finished',
+                 'stage', 'calls', 'key', '_undo')
+
+    def __init__(self, hands, turn=None, calls=(0, 0, 0, 0), won=(0, 0, 0, 0),
+                 finished=()) :
+        """ Start a trick at *turn* (defaults to the holder of the Mahjongg)
+        with the given *hands* (card masks).
+        """
+        self.hands = list(hands)
+        if turn is None :
+            turn = [seat for seat in range(4)
+                    if hands[seat] & Mahjongg_bit][0]
+        self.turn = turn
+        self.trick_type = None
+        self.top = 0
+        self.top_rank = None
+        self.winner = None
+        self.passes = 0
+        self.trick_cards = 0
+        self.trick_points = 0
+        self.won = list(won)
+        self.finished = tuple(finished)
+        self.stage = TURN
+        self.calls = tuple(calls)
+        self._undo = []
+        self.key = self.compute_key()
+
+    @classmethod
+    def from_round(cls, round_, trick) :
+        """ The state of the running *round_* with *trick*, whose first
+        player is to act.
+        """
+        seats = round_.seats
+        state = cls([p.hand.mask for p in round_.players],
+                    seats[trick.players[0]], round_.calls,
+                    [mask_points(encode(p.won_cards)[0])
+                     for p in round_.players],
+                    round_.finished)
+        if trick.top is not None :
+            state.trick_type = trick.combo_type
+            state.top = trick.top.mask
+            state.top_rank = trick.top_rank
+            state.winner = seats[trick.winner]
+            state.passes = trick.passes
+            state.trick_cards = encode(trick.cards)[0]
+            state.trick_points = mask_points(state.trick_cards)
+        # Players without cards are skipped
+        state.turn = state._next(state.turn)
+        state.key = state.compute_key()
+        return state
+
+    def copy(self) :
+        """ An independent copy, without the undo history. """
+        state = GameState.__new__(GameState)
+        for name in self.__slots__ :
+            setattr(state, name, getattr(self, name))
+        state.hands = list(self.hands)
+        state.won = list(self.won)
+        state._undo = []
+        return state
+
+    #_Keys______________________________________________________________________
+
+    def compute_key(self) :
+        """ The Zobrist key of this state, computed from scratch. """
+        key = _keys.stage[self.stage] ^ _keys.passes[self.passes] ^ \
+              _keys.trick_points[self.trick_points + POINTS_OFFSET] ^ \
+              _keys.winner[4 if self.winner is None else self.winner] ^ \
+              _mask_key(_keys.top, self.top)
+        if self.turn is not None :
+            key ^= _keys.turn[self.turn]
+        if self.top == Phoenix_bit :
+            key ^= _keys.phoenix_rank[int(2 * self.top_rank)]
+        for seat in range(4) :
+            key ^= _mask_key(_keys.hands[seat], self.hands[seat])
+            key ^= _keys.won[seat][self.won[seat] + POINTS_OFFSET]
+        for i, seat in enumerate(self.finished) :
+            key ^= _keys.finished[i][seat]
+        return key
+
+    def __hash__(self) :
+        return self.key
+
+    def __eq__(self, other) :
+        if not isinstance(other, GameState) : return NotImplemented
+        return self._fields() == other._fields()
+
+    def _fields(self) :
+        return (tuple(self.hands), self.turn, self.trick_type, self.top,
+                self.top_rank, self.winner, self.passes, self.trick_cards,
+                self.trick_points, tuple(self.won), self.finished, self.stage,
+                self.calls)
+
+    #_Queries___________________________________________________________________
+
+    def is_over(self) :
+        """ True once the round is over and the last trick handed out. """
+        return self.turn is None
+
+    def _round_finished(self) :
+        finished = self.finished
+        if len(finished) == 2 and (finished[0] - finished[1]) % 2 == 0 :
+            return True
+        return len(finished) >= 3
+
+    def scores(self) :
+        """ The round scores of both teams, once the round is over. """
+        scores = [0, 0]
+        first = self.finished[0]
+        if len(self.finished) == 2 :
+            scores[first % 2] = 200
+        else :
+            last = [s for s in range(4) if s not in self.finished][0]
+            scores[1 - last % 2] += mask_points(self.hands[last])
+            won = list(self.won)
+            won[first] += won[last]
+            won[last] = 0
+            for seat in range(4) :
+                scores[seat % 2] += won[seat]
+        for seat, call in enumerate(self.calls) :
+            if call :
+                scores[seat % 2] += call if seat == first else -call
+        return scores
+
+    def legal_moves(self) :
+        """ All actions of the player to act. """
+        if self.turn is None :
+            return []
+        if self.stage == GIFT :
+            return [-1 - seat for seat in range(4)
+                    if (seat - self.winner) % 2]
+        hand_plays = plays(self.hands[self.turn])
+        if not self.top :
+            return [play[0] for play in hand_plays]
+        rank = self.top_rank
+        return [PASS] + [mask for mask, combo_type, play_rank, is_bomb
+                         in hand_plays if play_rank > rank and
+                         (is_bomb or combo_type == self.trick_type)]
+
+    def _next(self, seat) :
+        """ The first seat from *seat* on that holds cards. """
+        for i in range(4) :
+            if self.hands[(seat + i) % 4] :
+                return (seat + i) % 4
+        return None
+
+    #_Moves_____________________________________________________________________
+
+    def apply(self, action) :
+        """ Take *action* for the player to act. Raise ValueError if it is
+        not allowed.
+        """
+        if self.turn is None :
+            raise ValueError('The round is over.')
+        self._undo.append((tuple(self.hands), self.turn, self.trick_type,
+                           self.top, self.top_rank, self.winner, self.passes,
+                           self.trick_cards, self.trick_points,
+                           tuple(self.won), self.finished, self.stage,
+                           self.key))
+        try :
+            if self.stage == GIFT :
+                self._gift(action)
+            elif action == PASS :
+                self._pass()
+            else :
+                self._play(action)
+        except ValueError :
+            self.undo()
+            raise
+
+    def undo(self) :
+        """ Take back the last applied action. """
+        (hands, self.turn, self.trick_type, self.top, self.top_rank,
+         self.winner, self.passes, self.trick_cards, self.trick_points, won,
+         self.finished, self.stage, self.key) = self._undo.pop()
+        self.hands[:] = hands
+        self.won[:] = won
+
+    def _set_turn(self, turn) :
+        if self.turn is not None :
+            self.key ^= _keys.turn[self.turn]
+        if turn is not None :
+            self.key ^= _keys.turn[turn]
+        self.turn = turn
+
+    # The key updates of plays and passes are written out, as they are the
+    # moves of every search
+
+    def _play(self, mask) :
+        seat = self.turn
+        hand = self.hands[seat]
+        if mask & ~hand :
+            raise ValueError('Cards not in the hand of seat {}.'.format(seat))
+        info = _info(mask)
+        if info is None :
+            raise ValueError('Not a combination: {:#x}.'.format(mask))
+        combo_type, rank, is_bomb, points, top_key, hand_keys = info
+        keys = _keys
+        key = self.key ^ top_key
+        top = self.top
+        if top :
+            if not is_bomb and combo_type != self.trick_type or \
+               rank <= self.top_rank :
+                raise ValueError('Play does not beat the trick.')
+            key ^= _info(top)[4] ^ keys.winner[self.winner]
+            if top == Phoenix_bit :
+                key ^= keys.phoenix_rank[int(2 * self.top_rank)]
+        else :
+            self.trick_type = combo_type
+            key ^= keys.winner[4]
+        if mask == Phoenix_bit :
+            rank = 1.5 if not top else self.top_rank + 0.5
+            key ^= keys.phoenix_rank[int(2 * rank)]
+
+        hand &= ~mask
+        self.hands[seat] = hand
+        key ^= hand_keys[seat]
+        if not hand :
+            key ^= keys.finished[len(self.finished)][seat]
+            self.finished += (seat,)
+        trick_points = self.trick_points + points
+        key ^= keys.trick_points[self.trick_points + POINTS_OFFSET] ^ \
+               keys.trick_points[trick_points + POINTS_OFFSET] ^ \
+               keys.winner[seat] ^ keys.passes[self.passes] ^ keys.passes[0]
+        self.key = key
+        self.trick_cards |= mask
+        self.trick_points = trick_points
+        self.top = mask
+        self.top_rank = rank
+        self.winner = seat
+        self.passes = 0
+
+        if mask == Dog_bit :
+            # The lead goes to the partner
+            self._resolve(seat, (seat + 2) % 4)
+        elif self._round_finished() or self._trick_finished() :
+            self._end_trick()
+        else :
+            self._set_turn(self._next(seat + 1))
+
+    def _pass(self) :
+        if not self.top :
+            raise ValueError('The leading player may not pass.')
+        passes = self.passes
+        self.key ^= _keys.passes[passes] ^ _keys.passes[passes + 1]
+        self.passes = passes + 1
+        if self._trick_finished() :
+            self._end_trick()
+        else :
+            self._set_turn(self._next(self.turn + 1))
+
+    def _gift(self, action) :
+        receiver = -1 - action
+        if not 0 <= receiver < 4 or (receiver - self.winner) % 2 == 0 :
+            raise ValueError('The Dragon trick goes to an opponent.')
+        self._resolve(receiver, self.winner)
+
+    def _trick_finished(self) :
+        others = 0
+        for seat, hand in enumerate(self.hands) :
+            if hand and seat != self.winner :
+                others += 1
+        return self.passes >= others
+
+    def _end_trick(self) :
+        if self.top == Dragon_bit :
+            self.key ^= _keys.stage[self.stage] ^ _keys.stage[GIFT]
+            self.stage = GIFT
+            self._set_turn(self.winner)
+        else :
+            self._resolve(self.winner, self.winner)
+
+    def _resolve(self, receiver, leader) :
+        """ Give the trick to *receiver* and let the first seat holding
+        cards from *leader* on lead the next one.
+        """
+        keys = _keys
+        won = self.won[receiver] + self.trick_points
+        key = self.key ^ \
+              keys.won[receiver][self.won[receiver] + POINTS_OFFSET] ^ \
+              keys.won[receiver][won + POINTS_OFFSET] ^ \
+              keys.trick_points[self.trick_points + POINTS_OFFSET] ^ \
+              keys.trick_points[POINTS_OFFSET] ^ _info(self.top)[4] ^ \
+              keys.winner[self.winner] ^ keys.winner[4] ^ \
+              keys.passes[self.passes] ^ keys.passes[0] ^ \
+              keys.stage[self.stage] ^ keys.stage[TURN]
+        if self.top == Phoenix_bit :
+            key ^= keys.phoenix_rank[int(2 * self.top_rank)]
+        self.key = key
+        self.won[receiver] = won
+        self.trick_points = 0
+        self.top = 0
+        self.top_rank = None
+        self.winner = None
+        self.passes = 0
+        self.stage = TURN
+        self.trick_type = None
+        self.trick_cards = 0
+        self._set_turn(None if self._round_finished() else self._next(leader))
@@ -0,0 +1,86 @@
+"""
+Strategies take the decisions of a player in a headless game. The game
+engine (:class: `Round <tichu.game.Round>`) calls them directly, no threads
+or waiting for input are involved.
+
+A strategy has to implement :meth: `Strategy.play`, the remaining decisions
+have sensible defaults.
+"""
+import logging
+
+from player import PassAction, PlayAction
+
+logger = logging.getLogger('tichu.' + __name__)
+
+class Strategy() :
+    """ Base class for all strategies. Strategies should not keep state
+    between calls that is not reproducible from the *round_*, such that
+    simulations are reproducible from their seed. Randomness should be taken
+    from *round_.rng*.
+    """
+
+    def play(self, round_, player, trick) :
+        """ Return the :class: `PlayerAction <tichu.player.PlayerAction>` of
+        *player* on the given *trick*. Leading players may not pass.
+        """
+        raise NotImplementedError
+
+    def call_grand_tichu(self, round_, player) :
+        """ Decide on a grand tichu call after seeing the first 8 cards in
+        *player.hand*.
+        """
+        return False
+
+    def call_tichu(self, round_, player) :
+        """ Decide on a tichu call after seeing all 14 cards. """
+        return False
+
+    def push(self, round_, player) :
+        """ Return the cards *player* gives to the next three seats (the
+        opponent after them, the partner and the other opponent) before the
+        first trick. Defaults to the lowest two cards for the opponents and
+        the highest for the partner.
+        """
+        cards = sorted(player.hand.cards, key=lambda card : card.rank)
+        return [cards[0], cards[-1], cards[1]]
+
+    def give_dragon(self, round_, player, opponents) :
+        """ Return the seat (out of *opponents*) that receives a trick won
+        with the dragon. Defaults to the opponent with more cards left.
+        """
+        return max(opponents,
+                   key=lambda seat : len(round_.players[seat].hand.cards))
+
+class RandomStrategy(Strategy) :
+    """ Play a uniformly random legal move, passing counts as one of them
+    if allowed.
+    """
+
+    def play(self, round_, player, trick) :
+        plays = list(trick.legal_plays(player.hand))
+        if trick.top is not None :
+            plays.append(None)
+        choice = round_.rng.choice(plays)
+        if choice is None :
+            return PassAction()
+        return PlayAction(choice)
+
+class GreedyStrategy(Strategy) :
+    """ Get rid of cards as cheaply as possible: lead the lowest ranked of
+    the plays with the most cards, follow with the lowest non-bomb that
+    beats the trick and pass otherwise.
+    """
+
+    def play(self, round_, player, trick) :
+        if trick.top is None :
+            plays = list(trick.legal_plays(player.hand))
+            best = max(plays, key=lambda combination :
+                       (not trick.is_bomb(combination), combination.N,
+                        -combination.rank))
+            return PlayAction(best)
+
+        for combination in trick.legal_plays(player.hand) :
+            if not trick.is_bomb(combination) :
+                return PlayAction(combination)
+        return PassAction()
+
@@ -0,0 +1,323 @@
+"""
+Long tournaments between strategies, with resumable results and ratings.
+
+Every pair of entrants plays the same *n_deals* deal sequences twice, once
+from each side of the table: the entrant that held the cards of team 0 in
+the first game holds the cards of team 1 in the second (see :mod:
+`tichu.dealing`). Both seats of a team are played by the same strategy.
+
+Games are numbered in a fixed schedule and played on a pool of worker
+processes. Every finished game is appended as one JSON line to the results
+file, which doubles as the checkpoint: a tournament started again on the
+same file only plays the games that are missing. A line cut short by a
+crash is dropped. Large tournaments can be split into *shards* that run on
+different machines, each with its own results file; :func: `read_results`
+merges them.
+
+Ratings are updated after every game with the Glicko system, which keeps a
+rating deviation next to every Elo style rating. The deviation shrinks with
+the number of games and gives a confidence interval::
+
+    t = Tournament({'greedy' : GreedyStrategy(), 'random' : RandomStrategy()},
+                   'results.jsonl', n_deals=500)
+    t.run()
+    print(t.ratings)
+"""
+import argparse
+import itertools
+import json
+import logging
+import math
+import multiprocessing
+import os
+import sys
+
+from core import configure_logging
+import strategies
+from game import Game
+from simulation import game_seed
+
+logger = logging.getLogger('tichu.' + __name__)
+
+#_Ratings_______________________________________________________________________
+
+_q = math.log(10) / 400
+
+def _g(deviation) :
+    return 1 / math.sqrt(1 + 3 * _q**2 * deviation**2 / math.pi**2)
+
+class Ratings() :
+    """ Glicko ratings, updated one game at a time. New entrants start at
+    *initial* with deviation *deviation*; deviations do not drop below
+    *min_deviation*.
+    """
+    def __init__(self, initial=1500., deviation=350., min_deviation=20.) :
+        self.initial = initial
+        self.deviation = deviation
+        self.min_deviation = min_deviation
+        self.ratings = {}
+        self.deviations = {}
+        self.games = {}
+
+    def _get(self, name) :
+        if name not in self.ratings :
+            self.ratings[name] = self.initial
+            self.deviations[name] = self.deviation
+            self.games[name] = 0
+        return self.ratings[name], self.deviations[name]
+
+    def expected(self, a, b) :
+        """ Expected score of *a* against *b*. """
+        (r_a, d_a), (r_b, d_b) = self._get(a), self._get(b)
+        return 1 / (1 + 10**(-_g(d_b) * (r_a - r_b) / 400))
+
+    def update(self, a, b, score) :
+        """ *a* scored *score* (1 win, 0.5 tie, 0 loss) against *b*. """
+        new = {}
+        for player, opponent, s in ((a, b, score), (b, a, 1 - score)) :
+            r, d = self._get(player)
+            d_o = self._get(opponent)[1]
+            g = _g(d_o)
+            e = self.expected(player, opponent)
+            inverse_d2 = _q**2 * g**2 * e * (1 - e)
+            variance = 1 / (1 / d**2 + inverse_d2)
+            new[player] = (r + _q * variance * g * (s - e),
+                           max(math.sqrt(variance), self.min_deviation))
+        for player, (r, d) in new.items() :
+            self.ratings[player] = r
+            self.deviations[player] = d
+            self.games[player] += 1
+
+    def interval(self, name, z=1.96) :
+        """ The confidence interval of the rating of *name*; the default *z*
+        gives 95 %.
+        """
+        r, d = self._get(name)
+        return r - z * d, r + z * d
+
+    def standings(self) :
+        """ List of (name, rating, deviation, games), best first. """
+        return sorted(((name, self.ratings[name], self.deviations[name],
+                        self.games[name]) for name in self.ratings),
+                      key=lambda row : -row[1])
+
+    def __str__(self) :
+        lines = ['{:20s} {:7.1f} +- {:5.1f}  ({} games)'.format(
+                     name, rating, 1.96 * deviation, games)
+                 for name, rating, deviation, games in self.standings()]
+        return '\n'.join(lines)
+
+#_Results_file__________________________________________________________________
+
+def read_results(*paths) :
+    """ Return the header and the results of the given results files, sorted
+    by game number. An incomplete last line is ignored.
+    """
+    header = None
+    results = {}
+    for path in paths :
+        if not os.path.exists(path) : continue
+        with open(path) as f :
+            for line in f :
+                if not line.endswith('\n') : break
+                entry = json.loads(line)
+                if 'tournament' in entry :
+                    if header is not None and \
+                       header['tournament'] != entry['tournament'] :
+                        raise ValueError('{} belongs to another '
+                                         'tournament.'.format(path))
+                    header = entry
+                else :
+                    results[entry['game']] = entry
+    return header, [results[i] for i in sorted(results)]
+
+def _repair(path) :
+    """ Cut an incomplete last line off the file at *path*. """
+    with open(path, 'rb+') as f :
+        data = f.read()
+        end = data.rfind(b'\n') + 1
+        if end != len(data) :
+            logger.warning('Dropping an incomplete line of %s.', path)
+            f.truncate(end)
+
+def _score(result) :
+    """ Score of team 0 in a result: 1 for a win, 0.5 for a tie. """
+    a, b = result['scores']
+    return 1. if a > b else 0.5 if a == b else 0.
+
+def rate(results, **kwargs) :
+    """ Return the :class: `Ratings` after the given *results*, e.g. the
+    merged results of all shards. *kwargs* go to :class: `Ratings`.
+    """
+    ratings = Ratings(**kwargs)
+    for result in results :
+        ratings.update(*result['teams'], _score(result))
+    return ratings
+
+#_Games_________________________________________________________________________
+
+def play_game(entrants, game, game_kwargs) :
+    """ Play scheduled *game* (a tuple (number, team 0, team 1, deal seed))
+    between the *entrants* and return its result entry.
+    """
+    from dealing import DealStream
+    number, team_0, team_1, seed = game
+    seats = [entrants[team_0], entrants[team_1]] * 2
+    g = Game(seats, seed=seed, deals=DealStream(seed), **game_kwargs)
+    scores = g.play()
+    return {'game' : number, 'teams' : [team_0, team_1], 'scores' : scores,
+            'rounds' : len(g.rounds)}
+
+# Set up once per worker process, such that strategies are only sent once
+_worker = {}
+
+def _init_worker(entrants, game_kwargs) :
+    _worker['entrants'] = entrants
+    _worker['game_kwargs'] = game_kwargs
+
+def _play_chunk(games) :
+    return [play_game(_worker['entrants'], game, _worker['game_kwargs'])
+            for game in games]
+
+class Tournament() :
+    """ A tournament between the strategies in *entrants*, written to the
+    results file at *path* (see the module docstring).
+
+    ===========  ===============================================================
+    entrants     dict; name -> :class: `Strategy <tichu.strategies.Strategy>`.
+                 Strategies have to be picklable.
+    path         str; results file. Existing results are kept.
+    n_deals      int; deal sequences per pair of entrants. Each is played
+                 twice. May be raised when resuming.
+    seed         int; base seed of the deals.
+    processes    int or *None*; worker processes (*None*: one per core, 1:
+                 play in this process).
+    chunk_size   int; games handed to a worker at once.
+    shard        (i, n); only play every *n*-th game, starting at *i*.
+    sync_every   int; results are forced to disk after this many games.
+    game_kwargs  further arguments to :class: `Game <tichu.game.Game>`.
+    ===========  ===============================================================
+    """
+    def __init__(self, entrants, path, n_deals=100, seed=0, processes=None,
+                 chunk_size=10, shard=(0, 1), sync_every=100, **game_kwargs) :
+        self.entrants = entrants
+        self.path = path
+        self.n_deals = n_deals
+        self.seed = seed
+        self.processes = processes
+        self.chunk_size = chunk_size
+        self.shard = shard
+        self.sync_every = sync_every
+        self.game_kwargs = game_kwargs
+        self.ratings = Ratings()
+        self.results = []
+
+    @property
+    def config(self) :
+        # Games keep their numbers when *n_deals* is raised, so it may change
+        # between runs
+        return {'entrants' : sorted(self.entrants), 'seed' : self.seed,
+                'game_kwargs' : self.game_kwargs}
+
+    def schedule(self) :
+        """ All games of the tournament as (number, team 0, team 1, deal
+        seed) tuples. Deals come first, so a partial run is balanced.
+        """
+        games = []
+        pairs = list(itertools.combinations(sorted(self.entrants), 2))
+        for deal in range(self.n_deals) :
+            for p, (a, b) in enumerate(pairs) :
+                seed = game_seed(self.seed, deal * len(pairs) + p)
+                for team_0, team_1 in ((a, b), (b, a)) :
+                    games.append((len(games), team_0, team_1, seed))
+        i, n = self.shard
+        return games[i::n]
+
+    def _add(self, result) :
+        self.results.append(result)
+        self.ratings.update(*result['teams'], _score(result))
+
+    def resume(self) :
+        """ Load the results of an earlier run and return the games still
+        to play.
+        """
+        header, results = read_results(self.path)
+        if header is not None and header['tournament'] != self.config :
+            raise ValueError('{} belongs to another tournament.'.format(
+                self.path))
+        self.results = list(results)
+        self.ratings = rate(self.results)
+        done = set(result['game'] for result in results)
+        return [game for game in self.schedule() if game[0] not in done]
+
+    def run(self, max_games=None) :
+        """ Play the missing games (at most *max_games*), appending their
+        results to the file. Return the :class: `Ratings`.
+        """
+        if os.path.exists(self.path) :
+            _repair(self.path)
+        games = self.resume()[:max_games]
+        logger.info('%d results loaded, %d games to play.', len(self.results),
+                    len(games))
+        chunks = [games[start:start + self.chunk_size]
+                  for start in range(0, len(games), self.chunk_size)]
+        pool = None
+        with open(self.path, 'a') as f :
+            if not f.tell() :
+                f.write(json.dumps({'tournament' : self.config}) + '\n')
+            if self.processes == 1 :
+                _init_worker(self.entrants, self.game_kwargs)
+                results = map(_play_chunk, chunks)
+            else :
+                pool = multiprocessing.Pool(self.processes, _init_worker,
+                                            (self.entrants, self.game_kwargs))
+                results = pool.imap_unordered(_play_chunk, chunks)
+            try :
+                unsynced = 0
+                for chunk in results :
+                    for result in chunk :
+                        f.write(json.dumps(result) + '\n')
+                        self._add(result)
+                    unsynced += len(chunk)
+                    f.flush()
+                    if unsynced >= self.sync_every :
+                        os.fsync(f.fileno())
+                        unsynced = 0
+                        logger.info('%d games played.', len(self.results))
+            finally :
+                f.flush()
+                os.fsync(f.fileno())
+                if pool is not None :
+                    pool.terminate()
+                    pool.join()
+        # Results arrive in any order. Rating them by game number makes the
+        # final ratings independent of workers and restarts.
+        self.results.sort(key=lambda result : result['game'])
+        self.ratings = rate(self.results)
+        return self.ratings
+
+def main(argv=None) :
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('path', help='Results file.')
+    parser.add_argument('entrants', nargs='+',
+                        help='Strategy classes of the strategies module.')
+    parser.add_argument('-n', '--deals', type=int, default=100,
+                        help='Deal sequences per pair (default 100).')
+    parser.add_argument('-s', '--seed', type=int, default=0)
+    parser.add_argument('-p', '--processes', type=int, default=None,
+                        help='Worker processes (default: one per core).')
+    parser.add_argument('--shard', type=int, nargs=2, default=(0, 1),
+                        metavar=('I', 'N'), help='Play every N-th game, '
+                        'starting at I.')
+    args = parser.parse_args(argv)
+    configure_logging(logging.INFO)
+
+    entrants = dict((name, getattr(strategies, name)())
+                    for name in args.entrants)
+    tournament = Tournament(entrants, args.path, args.deals, args.seed,
+                            args.processes, shard=tuple(args.shard))
+    print(tournament.run())
+    return 0
+
+if __name__ == '__main__' :
+    sys.exit(main())
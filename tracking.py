@@ -0,0 +1,248 @@
+"""
+Track which cards are still out and who could hold them.
+
+A :class: `CardTracker` takes the view of one seat. For every seat it keeps
+a 56 bit mask of the cards that seat may still hold (bit *i* for card index
+*i*, see :func: `combination.encode <tichu.combination.encode>`), so the
+possible holders of a card are the seats whose mask has its bit set. Every
+update touches a fixed number of masks, which keeps it cheap enough to run
+inside the trick loop.
+
+===============  ===============================================================
+update           inference
+===============  ===============================================================
+deal             own cards are known, all others may be with any other seat
+play             the played cards are gone; a player without cards holds
+                 nothing
+exchange         cards given away are known to be with the receiving seat
+pass             a player passing on a single of the other team probably has
+                 no higher single (kept apart as *unlikely*, as passing is
+                 always allowed)
+===============  ===============================================================
+
+A seat whose possible cards are as many as the cards in its hand is known to
+hold exactly those. The tracker is an :class: `EventSink
+<tichu.events.EventSink>`, so it can follow a :class: `Game
+<tichu.game.Game>` directly::
+
+    tracker = CardTracker(seat=0)
+    Game(strategies, events=tracker).play()
+"""
+import logging
+
+from combination import N_CARDS, PHOENIX, DRAGON, Phoenix_bit, \
+                        rank_by_index, suit_masks, encode
+from events import EventSink, PLAY, BOMB, PASS, TRICK_WON, DEAL, ROUND_OVER, \
+                   EXCHANGE
+
+logger = logging.getLogger('tichu.' + __name__)
+
+ALL_CARDS = (1 << N_CARDS) - 1
+
+# The four cards of every regular rank
+_rank_masks = [sum(1 << (suit * 13 + rank - 2) for suit in range(4))
+               for rank in range(2, 15)]
+
+_higher_singles = {}
+
+def higher_singles(rank) :
+    """ Mask of the cards that beat a single of *rank* (the phoenix beats
+    everything but the Dragon).
+    """
+    try :
+        return _higher_singles[rank]
+    except KeyError :
+        pass
+    mask = 0
+    for i in range(N_CARDS) :
+        if i != PHOENIX and rank_by_index[i] > rank :
+            mask |= 1 << i
+    if rank < rank_by_index[DRAGON] :
+        mask |= Phoenix_bit
+    _higher_singles[rank] = mask
+    return mask
+
+def _has_bomb(mask) :
+    """ True if the cards of *mask* hold a four of a kind or a straight bomb.
+    """
+    for rank_mask in _rank_masks :
+        if mask & rank_mask == rank_mask :
+            return True
+    for suit, suit_mask in enumerate(suit_masks) :
+        runs = (mask & suit_mask) >> (13 * suit)
+        for i in range(4) :
+            runs &= runs >> 1
+        if runs :
+            return True
+    return False
+
+def _as_mask(cards) :
+    if isinstance(cards, int) :
+        return cards
+    return encode(cards)[0]
+
+class CardTracker(EventSink) :
+    """ What the player at *seat* can know about the whereabouts of the
+    cards, given its own *hand* (cards or a mask; may be given later by
+    :meth: `deal` or a DEAL event).
+
+    ==========  ================================================================
+    possible    list of 4 masks; cards each seat may hold.
+    unlikely    list of 4 masks; possible cards a seat probably does not hold,
+                inferred from passes.
+    known       list of 4 masks; cards each seat is known to hold.
+    played      mask of the cards played so far.
+    hand_sizes  list of 4 ints; number of cards in every hand.
+    ==========  ================================================================
+    """
+    def __init__(self, seat, hand=None) :
+        self.seat = seat
+        self._seats = {}
+        self.deal(0 if hand is None else hand)
+
+    def deal(self, hand) :
+        """ Start a new round, *hand* being the own cards. """
+        mask = _as_mask(hand)
+        others = ALL_CARDS & ~mask
+        self.possible = [mask if seat == self.seat else others
+                         for seat in range(4)]
+        self.unlikely = [0] * 4
+        self.known = [0] * 4
+        self.known[self.seat] = mask
+        self.played = 0
+        self.hand_sizes = [14] * 4
+        # The single to beat in the running trick, and by whom
+        self._single_rank = None
+        self._winner = None
+
+    #_Updates___________________________________________________________________
+
+    def play(self, seat, cards, top_rank=None) :
+        """ The player at *seat* played *cards* (cards, a mask or a
+        :class: `Combination <tichu.combination.Combination>`). *top_rank*
+        is the rank they have on the trick, if it is a single.
+        """
+        mask = getattr(cards, 'mask', None)
+        if mask is None :
+            mask = _as_mask(cards)
+        keep = ~mask
+        for s in range(4) :
+            self.possible[s] &= keep
+            self.unlikely[s] &= keep
+            self.known[s] &= keep
+        self.played |= mask
+        self.hand_sizes[seat] -= mask.bit_count()
+        if not self.hand_sizes[seat] :
+            self.possible[seat] = self.unlikely[seat] = 0
+        self._winner = seat
+        self._single_rank = top_rank
+        for s in range(4) :
+            self._resolve(s)
+
+    def pass_(self, seat) :
+        """ The player at *seat* passed. """
+        if self._single_rank is not None and self._winner is not None and \
+           (self._winner - seat) % 2 :
+            self.unlikely[seat] |= self.possible[seat] & \
+                                   higher_singles(self._single_rank) & \
+                                   ~self.known[seat]
+
+    def end_trick(self) :
+        self._single_rank = None
+        self._winner = None
+
+    def exchange(self, given, received=()) :
+        """ Cards were exchanged before the first trick. *given* maps the
+        seats that got cards from this player to those cards, *received* the
+        seats that gave cards to this player to theirs.
+        """
+        for seat, cards in dict(received).items() :
+            mask = _as_mask(cards)
+            for s in range(4) :
+                self.possible[s] &= ~mask
+            self.possible[self.seat] |= mask
+            self.known[self.seat] |= mask
+        for seat, cards in dict(given).items() :
+            mask = _as_mask(cards)
+            for s in range(4) :
+                self.possible[s] &= ~mask
+                self.known[s] &= ~mask
+            self.possible[seat] |= mask
+            self.known[seat] |= mask
+
+    def _resolve(self, seat) :
+        # A hand with as many possible cards as cards is known
+        if self.possible[seat].bit_count() == self.hand_sizes[seat] :
+            self.known[seat] = self.possible[seat]
+
+    #_Events____________________________________________________________________
+
+    def emit(self, kind, player, data=None) :
+        if kind == DEAL :
+            # Deals come in seat order; only the own hand is looked at
+            seat = self._seats[player] = len(self._seats)
+            if seat == self.seat :
+                self.deal(data)
+        elif kind in (PLAY, BOMB) :
+            top_rank = None
+            if data.N == 1 :
+                top_rank = data.rank
+                if data.with_phoenix :
+                    top_rank = (self._single_rank or 1) + 0.5
+            self.play(self._seats[player], data, top_rank)
+        elif kind == PASS :
+            self.pass_(self._seats[player])
+        elif kind == EXCHANGE :
+            giver = self._seats[player]
+            if giver == self.seat :
+                self.exchange(dict(((giver + offset) % 4, [card])
+                                   for offset, card in enumerate(data, 1)))
+            else :
+                offset = (self.seat - giver) % 4
+                self.exchange((), {giver : [data[offset - 1]]})
+        elif kind == TRICK_WON :
+            self.end_trick()
+        elif kind == ROUND_OVER :
+            self._seats = {}
+
+    #_Queries___________________________________________________________________
+
+    def holders(self, index) :
+        """ The seats that may hold the card with *index*. """
+        bit = 1 << index
+        return [s for s in range(4) if self.possible[s] & bit]
+
+    def others(self) :
+        return [s for s in range(4) if s != self.seat]
+
+    def opponents(self) :
+        return [s for s in range(4) if (s - self.seat) % 2]
+
+    def out(self, seats=None, likely=False) :
+        """ Mask of the cards the given *seats* (default: all other seats)
+        may hold. With *likely*, cards inferred to be unlikely are left out.
+        """
+        mask = 0
+        for s in (self.others() if seats is None else seats) :
+            mask |= self.possible[s] & ~self.unlikely[s] if likely else \
+                    self.possible[s]
+        return mask
+
+    def can_beat_single(self, rank, seats=None, likely=False) :
+        """ True if one of *seats* (default: the opponents) may hold a single
+        beating *rank*.
+        """
+        if seats is None :
+            seats = self.opponents()
+        return bool(self.out(seats, likely) & higher_singles(rank))
+
+    def bombs_possible(self, seats=None) :
+        """ True if one of *seats* (default: the opponents) may hold a bomb.
+        """
+        if seats is None :
+            seats = self.opponents()
+        return any(_has_bomb(self.possible[s]) for s in seats)
+
+    def is_known(self, seat) :
+        """ True if all cards of *seat* are known. """
+        return self.known[seat].bit_count() == self.hand_sizes[seat]